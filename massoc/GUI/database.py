@@ -10,7 +10,7 @@ __license__ = 'Apache 2.0'
 from threading import Thread
 import wx
 from wx.lib.pubsub import pub
-from massoc.scripts.main import run_neo4j
+from massoc.scripts.main import run_neo4j, _read_network
 import webbrowser
 from biom import load_table
 import networkx as nx
@@ -303,7 +303,7 @@ class DataPanel(wx.Panel):
             if msg['network'] is not None:
                 filelist = deepcopy(msg['network'])
                 for file in filelist:
-                    network = nx.read_weighted_edgelist(file)
+                    network = _read_network(file)
                     self.checks += "Loaded network from " + file + ". \n\n"
                     nodes = len(network.nodes)
                     edges = len(network.edges)
@@ -16,7 +16,8 @@ from wx.lib.pubsub import pub
 import massoc
 from massoc.scripts.main import run_network, get_input
 from massoc.scripts.batch import read_settings
-from time import sleep
+from massoc.scripts.netexec import cancel_jobs
+from time import sleep, time
 import sys
 import logging
 from copy import deepcopy
@@ -312,7 +313,8 @@ class NetworkPanel(wx.Panel):
                     biom_names.append(biomname)
         self.settings['procbioms'] = biom_names
         try:
-            eg = Thread(target=massoc_worker, args=(self.settings,))
+            # cancellations sent from the progress dialog are newer than this
+            eg = Thread(target=massoc_worker, args=(self.settings, time()))
             eg.start()
             dlg = LoadingBar(self.settings)
             dlg.ShowModal()
@@ -324,7 +326,7 @@ class NetworkPanel(wx.Panel):
         for tool in self.settings['tools']:
             for level in self.settings['levels']:
                 for name in self.settings['name']:
-                    filename = self.settings['fp'] + '/' + tool + '_' + level + '_' + name + '.txt'
+                    filename = self.settings['fp'] + '/' + tool + '_' + level + '_' + name + '.h5'
                     network_names.append(filename)
         self.settings['network'] = network_names
         self.send_settings()
@@ -475,14 +477,28 @@ class LoadingBar(wx.Dialog):
         if settings['tools'] is not None and settings['levels'] is not None:
             self.number_networks = (len(settings['tools']) * len(settings['levels'])) + 1
         self.count = 0
+        self.fp = settings['fp']
         self.text = wx.StaticText(self, label="Starting...")
         self.progress = wx.Gauge(self, range=self.number_networks+2)
+        self.cancel = wx.Button(self, label="Cancel network inference")
+        self.cancel.Bind(wx.EVT_BUTTON, self.cancel_network)
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(self.text, 0, wx.EXPAND | wx.ALL, 10)
         sizer.Add(self.progress, 0, wx.EXPAND | wx.ALL, 10)
+        sizer.Add(self.cancel, 0, wx.ALIGN_CENTER_HORIZONTAL | wx.ALL, 10)
         self.SetSizer(sizer)
         pub.subscribe(self.get_progress, "update")
 
+    def cancel_network(self, event):
+        """Stops all running network inference jobs.
+        Jobs that were completed are kept and can be resumed later."""
+        try:
+            cancel_jobs(self.fp)
+            self.cancel.Enable(False)
+            self.text.SetLabel('Cancelling network inference...')
+        except Exception:
+            logger.error("Failed to cancel network inference. ", exc_info=True)
+
     def get_progress(self, msg):
         """Progress bar appears to work, but end /start is not calculated correctly.
         Issue is trivial but may be nice to fix. """
@@ -495,13 +511,13 @@ class LoadingBar(wx.Dialog):
             self.Destroy()
 
 
-def massoc_worker(inputs):
+def massoc_worker(inputs, started=None):
     """
     Alternative version of massoc's main pipe.
     Uses publisher to send messages instead of sys.stdout.write.
     """
     get_input(inputs, publish=True)
-    run_network(inputs, publish=True)
+    run_network(inputs, publish=True, started=started)
 
 
 
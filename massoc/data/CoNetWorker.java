@@ -0,0 +1,86 @@
+/*
+ * Runs CoNet as a warm worker for massoc, so the JVM is started once
+ * instead of for every call to the CooccurrenceAnalyser.
+ * Requires Java 11 or later, which runs this file without compiling it first:
+ * java -cp CoNet.jar CoNetWorker.java
+ *
+ * Each job is a tab-separated line with a job id and the CooccurrenceAnalyser arguments.
+ * The worker answers with '@massoc<TAB>id<TAB>ok' or '@massoc<TAB>id<TAB>error<TAB>message'.
+ * Output of CoNet itself is sent to stderr.
+ * Calls to System.exit by CoNet are blocked, so the worker answers the job and keeps running.
+ * Java 18 and later only allow this if the JVM is started with -Djava.security.manager=allow;
+ * otherwise, CoNet can exit the JVM and massoc runs the job again without the worker.
+ */
+
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.security.Permission;
+import java.util.Arrays;
+
+public class CoNetWorker {
+
+    /* Thrown instead of exiting the JVM when CoNet calls System.exit. */
+    static class ExitBlocked extends SecurityException {
+        final int status;
+
+        ExitBlocked(int status) {
+            super("CoNet exited with code " + status);
+            this.status = status;
+        }
+    }
+
+    /* Blocks System.exit and allows everything else. */
+    @SuppressWarnings("removal")
+    static class ExitTrap extends SecurityManager {
+        @Override
+        public void checkExit(int status) {
+            throw new ExitBlocked(status);
+        }
+
+        @Override
+        public void checkPermission(Permission permission) {
+        }
+
+        @Override
+        public void checkPermission(Permission permission, Object context) {
+        }
+    }
+
+    @SuppressWarnings("removal")
+    public static void main(String[] args) throws Exception {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+        PrintStream out = System.out;
+        System.setOut(System.err);
+        try {
+            System.setSecurityManager(new ExitTrap());
+        } catch (UnsupportedOperationException | SecurityException e) {
+            System.err.println("System.exit cannot be blocked by this JVM: " + e);
+        }
+        Method analyser = Class.forName("be.ac.vub.bsb.cooccurrence.cmd.CooccurrenceAnalyser")
+                .getMethod("main", String[].class);
+        out.println("@massoc\tready");
+        out.flush();
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] fields = line.split("\t");
+            String result = "ok";
+            try {
+                analyser.invoke(null, (Object) Arrays.copyOfRange(fields, 1, fields.length));
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                if (cause instanceof ExitBlocked && ((ExitBlocked) cause).status == 0) {
+                    result = "ok";
+                } else {
+                    result = "error\t" + String.valueOf(cause).replaceAll("[\t\r\n]", " ");
+                }
+            } catch (Exception e) {
+                result = "error\t" + String.valueOf(e).replaceAll("[\t\r\n]", " ");
+            }
+            out.println("@massoc\t" + fields[0] + "\t" + result);
+            out.flush();
+        }
+    }
+}
@@ -19,10 +19,14 @@ __license__ = 'Apache 2.0'
 
 import sys
 import os
+import json
 from biom import load_table
 from biom.parse import MetadataMap
 from massoc.scripts.batch import Batch, write_settings, read_settings, read_bioms
-from massoc.scripts.netwrap import Nets, run_parallel
+from massoc.scripts.netwrap import Nets, run_parallel, group_networks, run_queue_worker
+from massoc.scripts.netnull import null_model
+from massoc.scripts.netsweep import threshold_sweep
+from massoc.scripts.netarray import NetArray
 from copy import deepcopy
 from platform import system
 from subprocess import Popen
@@ -228,12 +232,13 @@ def get_input(inputs, publish=False):
     logger.info('Settings file written to disk.  ')
 
 
-def run_network(inputs, publish=False):
+def run_network(inputs, publish=False, started=None):
     """
     Pipes functions from the different massoc modules to run complete network inference.
 
     :param inputs: Dictionary of inputs.
     :param publish: If True, publishes messages to be received by GUI.
+    :param started: Time at which the run was started, passed to run_parallel.
     :return:
     """
     _create_logger(inputs['fp'])
@@ -251,15 +256,28 @@ def run_network(inputs, publish=False):
     for tool in bioms.inputs['tools']:
         for level in bioms.inputs['levels']:
             for name in bioms.inputs['name']:
-                filename = bioms.inputs['fp'] + '/' + tool + '_' + level + '_' + name + '.txt'
+                filename = bioms.inputs['fp'] + '/' + tool + '_' + level + '_' + name + '.h5'
                 network_names.append(filename)
     bioms.inputs['network'] = network_names
     if publish:
         pub.sendMessage('update', msg='Starting network inference. This may take some time!')
+    networks = bioms
     try:
         logger.info('Running network inference...  ')
-        networks = run_parallel(bioms)
+        networks = run_parallel(bioms, publish=publish, started=started)
+        if inputs.get('spar_sweep'):
+            thresholds = list(inputs['spar_sweep'])
+            thresholds.append(inputs.get('spar_pval') or 0.001)
+            threshold_sweep(networks.inputs['fp'],
+                            [name for name in networks.networks if name.startswith('sparcc_')],
+                            thresholds)
+        if inputs.get('consensus'):
+            consensus = networks.consensus(inputs['consensus'])
+            for name in consensus:
+                networks.inputs['network'].append(networks.inputs['fp'] + '/' + name + '.h5')
         networks.write_networks()
+        if inputs.get('net_export'):
+            networks.write_networks(fmt=inputs['net_export'])
     except Exception:
         logger.warning('Failed to complete network inference.  ', exc_info=True)
     write_settings(networks.inputs)
@@ -268,6 +286,20 @@ def run_network(inputs, publish=False):
     logger.info('Finished running network inference.  ')
 
 
+def run_worker(inputs):
+    """
+    Runs network inference jobs submitted to a file queue by the network module,
+    until network inference is finished.
+    Settings are taken from the queue, so no settings file is needed.
+
+    :param inputs: Dictionary of inputs.
+    :return:
+    """
+    logger.info('Waiting for jobs in ' + inputs['queue'] + '... ')
+    run_queue_worker(inputs['queue'], cores=inputs.get('cores') or 1, idle=inputs.get('idle'))
+    logger.info('Finished running network inference jobs.  ')
+
+
 def run_neo4j(inputs, publish=False):
     """
     Starts and carries out operations on the Neo4j database.
@@ -377,7 +409,7 @@ def run_neo4j(inputs, publish=False):
         bioms = Batch(filestore, inputs)
         bioms = Nets(bioms)
         for file in inputs['network']:
-            network = _read_network(file)
+            network = _read_network(file, netarray=True)
             bioms.add_networks(network, file)
         importdriver = None
         sleep(12)
@@ -406,7 +438,7 @@ def run_neo4j(inputs, publish=False):
             # pub.sendMessage('update', msg='Uploading network files...')
             logger.info('Uploading network files...  ')
             for item in bioms.networks:
-                network = bioms.networks[item]
+                network = bioms.get_network(item)
                 # try to split filename to make a nicer network id
                 subnames = item.split('/')
                 if len(subnames) == 1:
@@ -427,7 +459,8 @@ def run_neo4j(inputs, publish=False):
 def run_netstats(inputs, publish=False):
     """
     Runs statistical analyses on the Neo4j database, as well as logic operations.
-    To do: null models.
+    If a number of null models is specified, the overlap between the networks
+    of different tools is compared to that of degree-preserving randomizations.
 
     :param inputs: Dictionary of inputs.
     :param publish: If True, publishes messages to be received by GUI.
@@ -439,6 +472,8 @@ def run_netstats(inputs, publish=False):
     # handler to file
     _create_logger(inputs['fp'])
     checks = str()
+    if inputs.get('null'):
+        checks += run_null_models(inputs)
     if 'pid' in inputs:
         existing_pid = pid_exists(inputs['pid'])
     else:
@@ -513,6 +548,44 @@ def run_netstats(inputs, publish=False):
     write_settings(inputs)
 
 
+def run_null_models(inputs):
+    """
+    Compares the union, intersection and difference sizes of the networks
+    inferred for each taxonomic level and BIOM file to those of randomized networks.
+    The results are written to null_models.json in the output filepath.
+
+    :param inputs: Dictionary of inputs.
+    :return: Summary of results
+    """
+    checks = str()
+    results = dict()
+    num = None
+    if inputs.get('num'):
+        num = [int(n) for n in inputs['num']]
+    cores = inputs.get('cores')
+    if not cores:
+        cores = 1
+    groups = group_networks(inputs['network'] or list())
+    for level, name in groups:
+        if len(groups[(level, name)]) < 2:
+            continue
+        networks = [_read_network(file, netarray=True) for file in groups[(level, name)]]
+        logger.info('Generating ' + str(inputs['null']) + ' null models for ' +
+                    level + '_' + name + '... ')
+        stats = null_model(networks, n=int(inputs['null']), cores=int(cores),
+                           num=num, weight=bool(inputs.get('weight')))
+        results[level + '_' + name] = {'networks': groups[(level, name)], 'statistics': stats}
+        for statistic in stats:
+            checks += (level + '_' + name + ' ' + statistic + ': ' +
+                       str(stats[statistic]['observed']) + ' (null mean ' +
+                       str(round(stats[statistic]['null_mean'], 2)) + ', p = ' +
+                       str(round(stats[statistic]['p'], 4)) + ') \n')
+    with open(inputs['fp'] + '/null_models.json', 'w') as file:
+        file.write(json.dumps(results, indent=4))
+    logger.info(checks)
+    return checks
+
+
 def run_metastats(inputs, publish=False):
     """
     Module that carries out analysis of metadata on the database.
@@ -703,18 +776,25 @@ def _create_logger(filepath):
     logger.addHandler(fh)
 
 
-def _read_network(filepath):
+def _read_network(filepath, netarray=False):
     """
     Imports network file according to extension.
+    Networks written by massoc (.h5) are read as NetArray objects.
 
     :param filepath: Network filepath
+    :param netarray: If True, returns a NetArray object instead of a NetworkX object
     :return: NetworkX object
     """
     filename = filepath.split(sep=".")
     extension = filename[len(filename) - 1]
     network = None
     try:
-        if extension == 'graphml':
+        if extension == 'h5':
+            network = NetArray.read_hdf5(filepath)
+            if not netarray:
+                network = network.to_networkx()
+            return network
+        elif extension == 'graphml':
             network = nx.read_graphml(filepath)
         elif extension == 'txt':
             network = nx.read_weighted_edgelist(filepath)
@@ -730,6 +810,8 @@ def _read_network(filepath):
                     network = nx.relabel_nodes(network, nx.get_node_attributes(network, 'name'))
         except IndexError:
             logger.warning('One of the imported networks contains no nodes.', exc_info=True)
+        if netarray:
+            network = NetArray.from_networkx(network)
     except Exception:
         logger.error('Could not import network file!', exc_info=True)
     return network
@@ -0,0 +1,576 @@
+"""
+Array-based utilities for networks produced by the network inference tools.
+
+Several tools (SPIEC-EASI, SparCC) write their results to disk
+as dense taxa x taxa matrices. Reading these matrices into a DataFrame,
+masking them and converting them with NetworkX requires several dense copies
+of the matrix to be held in memory. The functions in this module read such matrices
+in row chunks and only keep the cells that pass a threshold as
+coordinate (COO) triplets, so graphs can be constructed from the triplets directly.
+
+Inferred networks are stored as NetArray objects.
+These hold node names once, edges as parallel arrays
+and node attributes column-wise, and are only converted
+to NetworkX graphs when a graph is needed.
+NetArray objects are written to HDF5 files (.h5) with the same layout,
+so the edge arrays can be memory-mapped when the network is read again.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import tempfile
+import h5py
+import numpy as np
+import pandas
+import networkx as nx
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+def read_triplets(matrix, mask=None, threshold=None, chunksize=1000):
+    """
+    Reads a tab-delimited, square association matrix in row chunks
+    and returns the non-zero cells as COO triplets.
+    Only the upper triangle (including the diagonal) is kept,
+    because the matrices written by the network inference tools are symmetric.
+    If a mask file (e.g. a matrix of p-values) is supplied,
+    only cells where the mask is smaller than the threshold are kept.
+    Cells of the mask are matched to the matrix by their row and column names;
+    if the rows are in a different order, the mask is read in full.
+
+    :param matrix: Filepath to tab-delimited matrix with row and column names
+    :param mask: Filepath to tab-delimited matrix with the same row and column names as matrix
+    :param threshold: Cells with mask values equal to or above this threshold are removed
+    :param chunksize: Number of rows read at once
+    :return: Tuple of node names, row indices, column indices and cell values
+    """
+    if mask is not None and threshold is None:
+        raise ValueError("Please supply a threshold for the mask.")
+    nodes = list()
+    rows = list()
+    cols = list()
+    weights = list()
+    reader = pandas.read_csv(matrix, sep='\t', index_col=0, chunksize=chunksize)
+    if mask is not None:
+        mask_reader = pandas.read_csv(mask, sep='\t', index_col=0, chunksize=chunksize)
+    else:
+        mask_reader = None
+    mask_table = None
+    start = 0
+    for chunk in reader:
+        values = chunk.to_numpy(dtype=float)
+        keep = values != 0
+        keep &= ~np.isnan(values)
+        if mask_reader is not None:
+            labels = chunk.index.astype(str)
+            if mask_table is None:
+                mask_chunk = next(mask_reader, None)
+                if mask_chunk is None or not mask_chunk.index.astype(str).equals(labels):
+                    # rows are in a different order, so chunks of the two files cannot be paired
+                    mask_table = pandas.read_csv(mask, sep='\t', index_col=0)
+                    mask_table.index = mask_table.index.astype(str)
+            if mask_table is not None:
+                if not labels.isin(mask_table.index).all():
+                    raise ValueError("Rows of " + matrix + " are missing from " + mask + ".")
+                mask_chunk = mask_table.reindex(index=labels)
+            if set(mask_chunk.columns) != set(chunk.columns):
+                raise ValueError("Columns of " + matrix + " and " + mask + " do not match.")
+            mask_values = mask_chunk.reindex(columns=chunk.columns).to_numpy(dtype=float)
+            keep &= mask_values < threshold
+        # only upper triangle of symmetric matrix is needed
+        keep &= np.arange(values.shape[1])[np.newaxis, :] >= \
+            np.arange(start, start + values.shape[0])[:, np.newaxis]
+        chunk_rows, chunk_cols = np.nonzero(keep)
+        rows.append((chunk_rows + start).astype(np.int32))
+        cols.append(chunk_cols.astype(np.int32))
+        weights.append(values[chunk_rows, chunk_cols])
+        nodes.extend(chunk.index)
+        start += values.shape[0]
+    if len(rows) == 0:
+        return nodes, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+    return nodes, np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+
+def triplets_to_graph(nodes, rows, cols, weights, sign=True):
+    """
+    Constructs a NetworkX graph from COO triplets.
+    All nodes are added to the graph, including nodes without edges,
+    so the output matches that of nx.from_pandas_adjacency.
+
+    :param nodes: List of node names, indexed by the row and column indices
+    :param rows: Array of row indices
+    :param cols: Array of column indices
+    :param weights: Array of edge weights
+    :param sign: If True, edge weights are replaced by their sign (1 or -1)
+    :return: NetworkX object
+    """
+    if sign:
+        weights = np.sign(weights)
+    network = nx.Graph()
+    network.add_nodes_from(nodes)
+    network.add_weighted_edges_from(zip([nodes[i] for i in rows],
+                                        [nodes[i] for i in cols],
+                                        weights.tolist()))
+    return network
+
+
+def graph_to_triplets(network):
+    """
+    Converts the edges of a NetworkX graph to COO triplets.
+    Edges without a weight are given a weight of 1.
+
+    :param network: NetworkX object
+    :return: Tuple of node names, row indices, column indices and edge weights
+    """
+    nodes = list(network.nodes)
+    node_index = {node: i for i, node in enumerate(nodes)}
+    edges = list(network.edges(data='weight', default=1))
+    rows = np.array([node_index[edge[0]] for edge in edges], dtype=np.int32)
+    cols = np.array([node_index[edge[1]] for edge in edges], dtype=np.int32)
+    weights = np.array([edge[2] for edge in edges], dtype=float)
+    return nodes, rows, cols, weights
+
+
+# single NaN object, so missing attribute values share one category
+_NAN = float('nan')
+
+
+class NetArray(object):
+
+    """Compact, array-based representation of an undirected, weighted network.
+    Node names are stored once and edges refer to them by int32 indices.
+    Node attributes (e.g. taxonomy) are stored column-wise,
+    as a list of unique values and an int32 array with the index of the value for each node.
+
+    Parameters
+    ----------
+    nodes : list
+        Node names
+    src : numpy.ndarray
+        Index of the first node of each edge
+    dst : numpy.ndarray
+        Index of the second node of each edge
+    weight : numpy.ndarray
+        Edge weights
+    sign : numpy.ndarray
+        Edge signs (1 or -1)
+    attributes : dict
+        Node attributes, with tuples of values and value indices per attribute name
+    edge_attributes : dict
+        Edge attributes, with an array of values for each edge per attribute name
+
+    """
+
+    def __init__(self, nodes, src=None, dst=None, weight=None):
+        """
+        Initializes the network from COO triplets.
+        Node names are interned, so networks with the same nodes share the names.
+
+        :param nodes: List of node names, indexed by src and dst
+        :param src: Array of first node indices
+        :param dst: Array of second node indices
+        :param weight: Array of edge weights; if None, all weights are 1
+        """
+        self.nodes = [sys.intern(node) if type(node) is str else node for node in nodes]
+        if src is None:
+            src = np.zeros(0)
+            dst = np.zeros(0)
+        self.src = np.asarray(src, dtype=np.int32)
+        self.dst = np.asarray(dst, dtype=np.int32)
+        if weight is None:
+            weight = np.ones(len(self.src))
+        self.weight = np.asarray(weight, dtype=float)
+        self.sign = np.sign(self.weight).astype(np.int8)
+        self.attributes = dict()
+        self.edge_attributes = dict()
+
+    def number_of_nodes(self):
+        """
+        :return: Number of nodes
+        """
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        """
+        :return: Number of edges
+        """
+        return len(self.src)
+
+    def set_node_attributes(self, values):
+        """
+        Sets node attributes from a dictionary with node names as keys
+        and dictionaries of attribute names and values as values,
+        like nx.set_node_attributes. Nodes that are not in the network are ignored.
+
+        :param values: Dictionary of dictionaries with node attributes
+        :return:
+        """
+        lookup = dict()
+        for column in self.attributes:
+            categories = self.attributes[column][0]
+            lookup[column] = {value: i for i, value in enumerate(categories)}
+        for i, node in enumerate(self.nodes):
+            if node not in values:
+                continue
+            for column, value in values[node].items():
+                if column not in self.attributes:
+                    self.attributes[column] = (list(), np.full(len(self.nodes), -1, dtype=np.int32))
+                    lookup[column] = dict()
+                if value != value:
+                    value = _NAN
+                if value not in lookup[column]:
+                    lookup[column][value] = len(self.attributes[column][0])
+                    self.attributes[column][0].append(value)
+                self.attributes[column][1][i] = lookup[column][value]
+
+    def get_node_attributes(self, name):
+        """
+        Returns the values of a node attribute,
+        like nx.get_node_attributes.
+
+        :param name: Attribute name
+        :return: Dictionary with node names as keys and attribute values as values
+        """
+        if name not in self.attributes:
+            return dict()
+        categories, codes = self.attributes[name]
+        return {self.nodes[i]: categories[code] for i, code in enumerate(codes.tolist()) if code >= 0}
+
+    def set_edge_attribute(self, name, values):
+        """
+        Sets a numeric edge attribute.
+
+        :param name: Attribute name
+        :param values: Array with a value for each edge, in the order of the edge arrays
+        :return:
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) != len(self.src):
+            raise ValueError("Please supply a value for each edge.")
+        self.edge_attributes[name] = values
+
+    def to_networkx(self):
+        """
+        Constructs a NetworkX graph with the same nodes, edges, node attributes and edge attributes.
+
+        :return: NetworkX object
+        """
+        network = nx.Graph()
+        network.add_nodes_from(self.nodes)
+        network.add_weighted_edges_from(zip([self.nodes[i] for i in self.src.tolist()],
+                                            [self.nodes[i] for i in self.dst.tolist()],
+                                            self.weight.tolist()))
+        for name in self.attributes:
+            nx.set_node_attributes(network, values=self.get_node_attributes(name), name=name)
+        if len(self.edge_attributes) > 0:
+            edges = list(zip([self.nodes[i] for i in self.src.tolist()],
+                             [self.nodes[i] for i in self.dst.tolist()]))
+            for name in self.edge_attributes:
+                nx.set_edge_attributes(network, values=dict(zip(edges, self.edge_attributes[name].tolist())),
+                                       name=name)
+        return network
+
+    @classmethod
+    def from_networkx(cls, network):
+        """
+        Constructs a NetArray from a NetworkX graph.
+        Edges without a weight are given a weight of 1.
+
+        :param network: NetworkX object
+        :return: NetArray
+        """
+        nodes, rows, cols, weights = graph_to_triplets(network)
+        netarray = cls(nodes, rows, cols, weights)
+        attributes = {node: data for node, data in network.nodes(data=True) if len(data) > 0}
+        if len(attributes) > 0:
+            netarray.set_node_attributes(attributes)
+        return netarray
+
+    def write_edgelist(self, path):
+        """
+        Writes the network as a weighted edge list,
+        in the same format as nx.write_weighted_edgelist.
+
+        :param path: Filepath
+        :return:
+        """
+        names = [str(node) for node in self.nodes]
+        with open(path, 'w') as file:
+            file.writelines([names[u] + ' ' + names[v] + ' ' + str(w) + '\n' for u, v, w in
+                             zip(self.src.tolist(), self.dst.tolist(), self.weight.tolist())])
+
+    @classmethod
+    def read_edgelist(cls, path):
+        """
+        Reads a weighted edge list written by write_edgelist or nx.write_weighted_edgelist.
+        Nodes are numbered in order of appearance.
+
+        :param path: Filepath
+        :return: NetArray
+        """
+        try:
+            edges = pandas.read_csv(path, sep=' ', header=None, dtype={0: str, 1: str, 2: float})
+        except pandas.errors.EmptyDataError:
+            return cls(list())
+        ends = np.concatenate([edges[0].to_numpy(), edges[1].to_numpy()])
+        nodes, first, index = np.unique(ends, return_index=True, return_inverse=True)
+        # np.unique sorts the nodes, so they are put back in order of appearance
+        order = np.argsort(first)
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order))
+        index = rank[index]
+        return cls(nodes[order].tolist(), index[:len(edges)], index[len(edges):],
+                   edges[2].to_numpy())
+
+    def write_hdf5(self, path):
+        """
+        Writes the network to an HDF5 file.
+        The file contains the node names, the edge arrays,
+        a group with the values and value indices of each node attribute
+        and a group with the values of each edge attribute.
+        Edge arrays are stored contiguously and uncompressed,
+        so they can be memory-mapped by read_hdf5.
+        The network is first written to a temporary file that then replaces the file,
+        so networks that were memory-mapped from the file can still be read.
+
+        :param path: Filepath
+        :return:
+        """
+        handle, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        os.close(handle)
+        try:
+            self._write_hdf5(temp)
+            os.replace(temp, path)
+        finally:
+            if os.path.isfile(temp):
+                os.remove(temp)
+
+    def _write_hdf5(self, path):
+        """
+        Writes the network to a new HDF5 file.
+
+        :param path: Filepath
+        :return:
+        """
+        with h5py.File(path, 'w') as file:
+            file.create_dataset('nodes', data=[str(node) for node in self.nodes],
+                                dtype=h5py.string_dtype())
+            file.create_dataset('src', data=self.src)
+            file.create_dataset('dst', data=self.dst)
+            file.create_dataset('weight', data=self.weight)
+            file.create_dataset('sign', data=self.sign)
+            group = file.create_group('attributes')
+            for name in self.attributes:
+                categories, codes = self.attributes[name]
+                column = group.create_group(name)
+                # values are stored as JSON so numbers and missing values keep their type
+                column.create_dataset('values', data=[json.dumps(value, default=str) for value in categories],
+                                      dtype=h5py.string_dtype())
+                column.create_dataset('codes', data=codes)
+            group = file.create_group('edge_attributes')
+            for name in self.edge_attributes:
+                group.create_dataset(name, data=self.edge_attributes[name])
+
+    @classmethod
+    def read_hdf5(cls, path, mmap=False):
+        """
+        Reads a network written by write_hdf5.
+        Memory-mapped networks become invalid if the file is truncated,
+        which crashes the process, so they should only be used for files that are not rewritten.
+
+        :param path: Filepath
+        :param mmap: If True, edge arrays are memory-mapped instead of read into memory
+        :return: NetArray
+        """
+        with h5py.File(path, 'r') as file:
+            netarray = cls(file['nodes'].asstr()[()].tolist())
+            netarray.src = _read_dataset(file['src'], path, mmap)
+            netarray.dst = _read_dataset(file['dst'], path, mmap)
+            netarray.weight = _read_dataset(file['weight'], path, mmap)
+            netarray.sign = _read_dataset(file['sign'], path, mmap)
+            for name in file['attributes']:
+                column = file['attributes'][name]
+                categories = [json.loads(value) for value in column['values'].asstr()[()]]
+                netarray.attributes[name] = (categories, column['codes'][()])
+            # files written before edge attributes were added do not have the group
+            if 'edge_attributes' in file:
+                for name in file['edge_attributes']:
+                    netarray.edge_attributes[name] = _read_dataset(file['edge_attributes'][name], path, mmap)
+        return netarray
+
+
+class EdgeWriter(object):
+
+    """Writes edges to an HDF5 file with the layout of NetArray.write_hdf5,
+    appending them in chunks so the full edge list is never held in memory.
+    The file can be read with NetArray.read_hdf5.
+
+    Parameters
+    ----------
+    path : str
+        Filepath
+    edges : int
+        Number of edges written so far
+
+    """
+
+    def __init__(self, path, nodes, chunksize=65536):
+        """
+        Creates the HDF5 file with the node names and empty edge arrays.
+
+        :param path: Filepath
+        :param nodes: List of node names
+        :param chunksize: Number of edges per HDF5 chunk
+        """
+        self.path = path
+        self.edges = 0
+        self._file = h5py.File(path, 'w')
+        self._file.create_dataset('nodes', data=[str(node) for node in nodes],
+                                  dtype=h5py.string_dtype())
+        for name, dtype in [('src', np.int32), ('dst', np.int32),
+                            ('weight', float), ('sign', np.int8)]:
+            self._file.create_dataset(name, shape=(0,), maxshape=(None,),
+                                      dtype=dtype, chunks=(chunksize,))
+        self._file.create_group('attributes')
+
+    def append(self, src, dst, weight):
+        """
+        Appends edges to the file.
+
+        :param src: Array of first node indices
+        :param dst: Array of second node indices
+        :param weight: Array of edge weights
+        :return:
+        """
+        weight = np.asarray(weight, dtype=float)
+        size = self.edges + len(weight)
+        for name, values in [('src', src), ('dst', dst), ('weight', weight),
+                             ('sign', np.sign(weight))]:
+            self._file[name].resize((size,))
+            self._file[name][self.edges:size] = values
+        self.edges = size
+
+    def close(self):
+        """
+        Closes the file.
+
+        :return:
+        """
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def edge_keys(src, dst, n):
+    """
+    Returns a canonical integer key for each undirected edge,
+    with the lowest node index first.
+
+    :param src: Array of first node indices
+    :param dst: Array of second node indices
+    :param n: Number of nodes
+    :return: Array of edge keys
+    """
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    return np.minimum(src, dst) * np.int64(n) + np.maximum(src, dst)
+
+
+def isin_sorted(values, index):
+    """
+    Checks for each value whether it occurs in a sorted array.
+
+    :param values: Array of values
+    :param index: Sorted array
+    :return: Boolean array
+    """
+    if len(index) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(index, values)
+    positions[positions == len(index)] = 0
+    return index[positions] == values
+
+
+def edge_support(networks):
+    """
+    Counts how many networks contain each edge.
+    Edges are identified by a canonical key of the two node indices
+    (lowest index first) and the edge sign,
+    so edges with opposite signs are counted separately.
+    Edges with a weight of 0 have no sign and are not counted.
+    Each network is counted at most once per edge.
+
+    :param networks: List of NetArray objects
+    :return: Tuple of node names, first node indices, second node indices, signs and support counts
+    """
+    nodes = np.unique(np.concatenate([np.asarray(network.nodes, dtype=str) for network in networks]))
+    n = np.int64(len(nodes))
+    keys = list()
+    for network in networks:
+        index = np.searchsorted(nodes, np.asarray(network.nodes, dtype=str)).astype(np.int64)
+        signed = np.asarray(network.sign) != 0
+        src = index[np.asarray(network.src)[signed]]
+        dst = index[np.asarray(network.dst)[signed]]
+        positive = (np.asarray(network.sign)[signed] > 0).astype(np.int64)
+        keys.append(np.unique(edge_keys(src, dst, n) * 2 + positive))
+    keys, support = np.unique(np.concatenate(keys), return_counts=True)
+    pairs = keys // 2
+    signs = np.where(keys % 2 == 1, 1, -1).astype(np.int8)
+    return nodes.tolist(), (pairs // n).astype(np.int32), (pairs % n).astype(np.int32), signs, support
+
+
+def consensus(networks, thresholds):
+    """
+    Constructs consensus networks that contain the edges
+    present in at least a number of networks.
+    All nodes of the networks are included.
+
+    :param networks: List of NetArray objects
+    :param thresholds: List of minimum numbers of networks that need to contain an edge
+    :return: Dictionary with thresholds as keys and NetArray objects as values
+    """
+    nodes, src, dst, signs, support = edge_support(networks)
+    results = dict()
+    for threshold in thresholds:
+        keep = support >= threshold
+        results[threshold] = NetArray(nodes, src[keep], dst[keep], signs[keep])
+    return results
+
+
+def _read_dataset(dataset, path, mmap):
+    """
+    Returns an HDF5 dataset as array.
+    Contiguous datasets are memory-mapped if requested;
+    empty or chunked datasets are read into memory.
+
+    :param dataset: h5py Dataset
+    :param path: Filepath of HDF5 file
+    :param mmap: If True, the dataset is memory-mapped
+    :return: Numpy array
+    """
+    offset = dataset.id.get_offset()
+    if mmap and offset is not None and dataset.size > 0:
+        return np.memmap(path, dtype=dataset.dtype, mode='r',
+                         offset=offset, shape=dataset.shape)
+    return dataset[()]
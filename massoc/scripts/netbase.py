@@ -105,7 +105,7 @@ class ImportDriver(object):
                 with self._driver.session() as session:
                     for net in nets.networks:
                         name = net.split('.')[0]
-                        self.convert_networkx(network=nets.networks[net],
+                        self.convert_networkx(network=nets.get_network(net),
                                               network_id=name, mode='weight', exp_id=exp_id)
         except Exception:
             logger.error("Could not port network object to database. \n", exc_info=True)
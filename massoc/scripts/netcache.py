@@ -0,0 +1,176 @@
+"""
+Network inference can take hours, while the processed BIOM files and tool settings
+often do not change between runs. The NetCache class stores inferred networks on disk,
+keyed by a hash of the processed count matrix, the tool and its settings.
+When massoc is run again with the same data and settings,
+the network is read from the cache instead of being inferred again.
+
+Networks are stored as edge arrays in npz files.
+The cache has a maximum size; when it grows too large,
+the least recently used networks are removed.
+The modification time of each cache file is used to track when it was last used,
+so several massoc processes can share one cache folder.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import numpy as np
+from massoc.scripts.netarray import NetArray
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+class NetCache(object):
+
+    """Cache of inferred networks.
+    Each network is stored as a separate npz file,
+    named after the key generated with get_key.
+
+    Parameters
+    ----------
+    location : str
+        Folder where cached networks are stored
+    max_size : float
+        Maximum size of the cache in megabytes
+
+    """
+
+    def __init__(self, location, max_size=1000):
+        """
+        Initializes the cache and creates the cache folder if necessary.
+
+        :param location: Folder where cached networks are stored.
+        :param max_size: Maximum size of the cache in megabytes.
+        """
+        self.location = location
+        self.max_size = max_size
+        os.makedirs(location, exist_ok=True)
+
+    def get_key(self, biomfile, tool, settings=None, files=None):
+        """
+        Generates a key from the count matrix, tool and settings.
+        The contents of files (e.g. settings scripts) are hashed,
+        so changing a script also changes the key.
+
+        :param biomfile: BIOM file used for network inference
+        :param tool: Name of network inference tool
+        :param settings: Dictionary of tool settings
+        :param files: List of filepaths to scripts or settings files
+        :return: Hexadecimal key
+        """
+        key = hashlib.sha256()
+        matrix = biomfile.matrix_data.tocsr()
+        matrix.sort_indices()
+        for array in [matrix.data.astype(float), matrix.indices, matrix.indptr]:
+            key.update(np.ascontiguousarray(array).tobytes())
+        key.update('\t'.join(biomfile.ids(axis='observation')).encode())
+        key.update('\t'.join(biomfile.ids(axis='sample')).encode())
+        key.update(tool.encode())
+        if settings is not None:
+            key.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        if files is not None:
+            for file in files:
+                key.update(str(file).encode())
+                if file is not None and os.path.isfile(file):
+                    with open(file, 'rb') as script:
+                        key.update(script.read())
+        return key.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached network for a key,
+        or None if the network is not in the cache.
+
+        :param key: Key generated with get_key
+        :return: NetArray object
+        """
+        path = self._path(key)
+        try:
+            data = np.load(path, allow_pickle=False)
+            network = NetArray(data['nodes'].tolist(), data['rows'],
+                               data['cols'], data['weights'])
+            for name in data.files:
+                if name.startswith('edge_'):
+                    network.edge_attributes[name[5:]] = data[name]
+            data.close()
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+        # modification time keeps track of most recent use
+        os.utime(path)
+        return network
+
+    def put(self, key, network):
+        """
+        Writes a network to the cache.
+        The file is first written to a temporary file and then renamed,
+        so other processes never read incomplete networks.
+
+        :param key: Key generated with get_key
+        :param network: NetArray or NetworkX object
+        :return:
+        """
+        if not isinstance(network, NetArray):
+            network = NetArray.from_networkx(network)
+        handle, temp = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                edges = {'edge_' + name: values for name, values in network.edge_attributes.items()}
+                np.savez(file, nodes=np.array(network.nodes, dtype=str),
+                         rows=network.src, cols=network.dst, weights=network.weight, **edges)
+            os.replace(temp, self._path(key))
+        except Exception:
+            logger.error("Unable to write network to cache. ", exc_info=True)
+            if os.path.isfile(temp):
+                os.remove(temp)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used networks
+        until the cache is smaller than the maximum size.
+
+        :return:
+        """
+        entries = list()
+        for entry in os.scandir(self.location):
+            if entry.name.endswith('.npz'):
+                stats = entry.stat()
+                entries.append((stats.st_mtime, stats.st_size, entry.path))
+        total = sum([entry[1] for entry in entries])
+        entries.sort()
+        for entry in entries:
+            if total <= self.max_size * 1024 * 1024:
+                break
+            try:
+                os.remove(entry[2])
+            except FileNotFoundError:
+                pass
+            total -= entry[1]
+
+    def _path(self, key):
+        """
+        Returns the filepath for a key.
+
+        :param key: Key generated with get_key
+        :return: Filepath
+        """
+        return os.path.join(self.location, key + '.npz')
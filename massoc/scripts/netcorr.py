@@ -0,0 +1,610 @@
+"""
+The netcorr module carries out correlation-based network inference in-process.
+Abundances are clr-transformed per sample, and Pearson correlations
+are computed from the sufficient statistics of the transformed values:
+the number of samples, the sum of each taxon and the cross-products of all taxa.
+
+Because the clr transformation of a sample does not depend on other samples,
+these statistics can be stored and updated with only the samples
+that were added since the previous run.
+The network is then thresholded again from the updated statistics,
+without reading the old samples.
+
+For tables with too many taxa to hold a taxa x taxa matrix in memory,
+correlation_network computes Pearson correlations, Spearman correlations
+or proportionality (rho) in blocks of taxa, distributed across processes.
+Only pairs that pass the threshold are kept, and these are written
+to disk as each block completes, so memory use depends on the block size.
+The threshold for proportionality is estimated from the false discovery rate
+of permuted data, which is computed with the same blocks.
+Only positive proportionality is kept: unlike a negative correlation,
+a negative rho does not indicate that two taxa change in opposite directions,
+only that their log-ratio varies more than the taxa themselves.
+Alternatively, edge_number_network keeps a fixed number of pairs
+with the highest and lowest scores of all blocks.
+
+Statistics of higher taxonomic levels are computed from the OTU-level counts,
+which are summed with a taxonomy indicator matrix before the clr transformation.
+The correlations are therefore the same as those of the collapsed tables,
+while the OTU table only needs to be read once for all levels.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import h5py
+import numpy as np
+import multiprocessing as mp
+from scipy.sparse import csr_matrix
+from scipy.stats import t, rankdata
+from massoc.scripts.netarray import NetArray, EdgeWriter
+from massoc.scripts.netsweep import EdgeSelector, top_pairs
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+def clr(counts, pseudocount=1):
+    """
+    Carries out a centred log-ratio transformation of each sample.
+
+    :param counts: Array of counts with taxa as rows and samples as columns
+    :param pseudocount: Pseudocount added to all counts
+    :return: Array of clr-transformed values
+    """
+    logs = np.log(np.asarray(counts, dtype=float) + pseudocount)
+    return logs - logs.mean(axis=0)
+
+
+class CorrStats(object):
+
+    """Sufficient statistics for the correlations between taxa.
+
+    Parameters
+    ----------
+    nodes : list
+        Taxon names
+    samples : list
+        Names of the samples included in the statistics
+    n : int
+        Number of samples
+    sums : numpy.ndarray
+        Sum of the clr-transformed values of each taxon
+    products : numpy.ndarray
+        Sum of the products of the clr-transformed values of each pair of taxa
+
+    """
+
+    def __init__(self, nodes):
+        """
+        Initializes empty statistics for a list of taxa.
+
+        :param nodes: List of taxon names
+        """
+        self.nodes = list(nodes)
+        self.samples = list()
+        self.n = 0
+        self.sums = np.zeros(len(self.nodes))
+        self.products = np.zeros((len(self.nodes), len(self.nodes)))
+
+    @classmethod
+    def from_table(cls, table, nodes=None, groups=None):
+        """
+        Computes the statistics of a BIOM file.
+        If groups of taxa are given, the statistics are those of the summed counts
+        of each group, e.g. genera from OTUs.
+
+        :param table: BIOM file
+        :param nodes: List of names of the aggregated taxa
+        :param groups: List with a list of taxon names for each aggregated taxon
+        :return: CorrStats
+        """
+        stats = cls(table.ids(axis='observation') if groups is None else nodes)
+        stats.update(table, groups)
+        return stats
+
+    def matches(self, table):
+        """
+        Checks whether the statistics can be updated with a BIOM file.
+        This is only the case if the BIOM file contains the same taxa,
+        and all samples included in the statistics.
+
+        :param table: BIOM file
+        :return: True if the statistics can be updated
+        """
+        if list(table.ids(axis='observation')) != self.nodes:
+            return False
+        return set(self.samples).issubset(table.ids(axis='sample'))
+
+    def update(self, table, groups=None):
+        """
+        Adds the samples of a BIOM file that are not yet included in the statistics.
+        If groups of taxa are given, the counts of each group are summed
+        before the clr transformation, as the clr of a sum is not the sum of clr values.
+
+        :param table: BIOM file
+        :param groups: List with a list of taxon names for each taxon of the statistics
+        :return: Number of added samples
+        """
+        if groups is None and list(table.ids(axis='observation')) != self.nodes:
+            raise ValueError("The BIOM file contains different taxa than the statistics.")
+        if groups is not None and len(groups) != len(self.nodes):
+            raise ValueError("The number of groups does not match the taxa of the statistics.")
+        included = set(self.samples)
+        new = [sample for sample in table.ids(axis='sample') if sample not in included]
+        if len(new) == 0:
+            return 0
+        counts = table.filter(new, axis='sample', inplace=False).matrix_data
+        if groups is not None:
+            counts = indicator_matrix(list(table.ids(axis='observation')), groups).T @ counts
+        values = clr(counts.toarray())
+        self.n += len(new)
+        self.sums += values.sum(axis=1)
+        self.products += values @ values.T
+        self.samples.extend(new)
+        return len(new)
+
+    def covariance(self):
+        """
+        :return: Covariance matrix of the clr-transformed values
+        """
+        return (self.products - np.outer(self.sums, self.sums) / self.n) / (self.n - 1)
+
+    def correlation(self):
+        """
+        Pearson correlations of the clr-transformed values.
+        Taxa without variance have missing correlations.
+
+        :return: Correlation matrix
+        """
+        cov = self.covariance()
+        sd = np.sqrt(np.clip(np.diag(cov), 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = cov / np.outer(sd, sd)
+        return np.clip(corr, -1, 1)
+
+    def network(self, pval_threshold=0.001):
+        """
+        Returns a network of all pairs of taxa with a significant correlation.
+        P-values are computed with a two-sided t-test.
+
+        :param pval_threshold: Pairs with p-values equal to or above this threshold are removed
+        :return: NetArray with correlation signs as weights
+        """
+        df = self.n - 2
+        if df < 1:
+            return NetArray(self.nodes)
+        corr = self.correlation()
+        rows, cols = np.triu_indices(len(self.nodes), 1)
+        values = corr[rows, cols]
+        keep = ~np.isnan(values) & (values != 0)
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+        with np.errstate(divide='ignore'):
+            stat = np.abs(values) * np.sqrt(df / np.clip(1 - values ** 2, 0, None))
+        pvals = 2 * t.sf(stat, df)
+        keep = pvals < pval_threshold
+        return NetArray(self.nodes, rows[keep], cols[keep], np.sign(values[keep]))
+
+    def write_hdf5(self, path):
+        """
+        Writes the statistics to an HDF5 file.
+
+        :param path: Filepath
+        :return:
+        """
+        with h5py.File(path, 'w') as file:
+            file.create_dataset('nodes', data=[str(node) for node in self.nodes],
+                                dtype=h5py.string_dtype())
+            file.create_dataset('samples', data=[str(sample) for sample in self.samples],
+                                dtype=h5py.string_dtype())
+            file.create_dataset('sums', data=self.sums)
+            file.create_dataset('products', data=self.products)
+
+    @classmethod
+    def read_hdf5(cls, path):
+        """
+        Reads statistics written by write_hdf5.
+
+        :param path: Filepath
+        :return: CorrStats
+        """
+        with h5py.File(path, 'r') as file:
+            stats = cls(file['nodes'].asstr()[()].tolist())
+            stats.samples = file['samples'].asstr()[()].tolist()
+            stats.n = len(stats.samples)
+            stats.sums = file['sums'][()]
+            stats.products = file['products'][()]
+        return stats
+
+
+def indicator_matrix(nodes, groups):
+    """
+    Constructs a sparse matrix with taxa as rows and groups as columns,
+    with a 1 if a taxon belongs to a group.
+    Taxa in groups that are not in the list of taxa are ignored.
+
+    :param nodes: List of taxon names
+    :param groups: List with a list of taxon names for each group
+    :return: Sparse indicator matrix
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    rows = list()
+    cols = list()
+    for j, group in enumerate(groups):
+        for node in group:
+            if node in index:
+                rows.append(index[node])
+                cols.append(j)
+    return csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(nodes), len(groups)))
+
+
+def stats_path(folder, name):
+    """
+    :param folder: Folder with stored statistics
+    :param name: Network name
+    :return: Filepath to the statistics of the network
+    """
+    return os.path.join(folder, name + '_stats.h5')
+
+
+def correlation_network(counts, nodes, path, method='pearson', threshold=None,
+                        pval_threshold=None, block=1000, cores=1, folder=None):
+    """
+    Computes correlations or proportionality between all pairs of taxa
+    in blocks, and writes the pairs that pass the threshold to an HDF5 file.
+    Abundances are clr-transformed first.
+    P-values of Pearson and Spearman correlations are computed with a two-sided t-test;
+    the p-value threshold is converted to a correlation threshold,
+    so blocks only need to be compared to a single value.
+
+    :param counts: Array of counts with taxa as rows and samples as columns
+    :param nodes: List of taxon names
+    :param path: Filepath for the network
+    :param method: Either 'pearson', 'spearman' or 'rho'
+    :param threshold: Pairs with an absolute score below this threshold are removed;
+                      for rho, pairs with a score below this threshold
+    :param pval_threshold: Pairs with p-values equal to or above this threshold are removed
+    :param block: Number of taxa per block
+    :param cores: Number of processes
+    :param folder: Folder for the memory-mapped transformed values
+    :return: NetArray with scores as weights
+    """
+    if method not in ['pearson', 'spearman', 'rho']:
+        raise ValueError("Please supply pearson, spearman or rho as method.")
+    if len(nodes) == 0:
+        EdgeWriter(path, nodes).close()
+        return NetArray.read_hdf5(path)
+    values, scale = _transform(counts, method)
+    cutoff = 0
+    if threshold is not None:
+        cutoff = threshold
+    if pval_threshold is not None:
+        if method == 'rho':
+            raise ValueError("P-values are not available for proportionality.")
+        df = values.shape[1] - 2
+        if df < 1:
+            cutoff = np.inf
+        else:
+            stat = t.isf(pval_threshold / 2, df)
+            cutoff = max(cutoff, np.nextafter(stat / np.sqrt(df + stat ** 2), 1))
+    blocks = _blocks(len(nodes), block)
+    if folder is None:
+        folder = os.path.dirname(os.path.abspath(path))
+    with EdgeWriter(path, nodes) as writer:
+        for rows, cols, scores in _map_blocks(_kernel_block, blocks, values, scale, folder,
+                                              os.path.basename(path), cores, cutoff=cutoff,
+                                              positive=method == 'rho'):
+            writer.append(rows, cols, scores)
+    return NetArray.read_hdf5(path)
+
+
+def rho_cutoff(counts, fdr=0.05, permutations=20, block=1000, cores=1, seed=None,
+               folder=None, bins=100):
+    """
+    Estimates the proportionality threshold that gives a false discovery rate,
+    with the permutation approach of the propr package:
+    the clr-transformed values of each taxon are shuffled across samples,
+    and the number of pairs that pass a threshold in the permuted data
+    estimates the number of false positives at that threshold.
+    Only positive scores are counted, as negative proportionality is not kept.
+    Pairs are only counted per threshold in a grid of bins,
+    so no scores are kept in memory.
+    Each block of taxa is shuffled with a seed of its own,
+    so all blocks of a permutation use the same shuffled values
+    and the threshold does not depend on the number of processes.
+
+    :param counts: Array of counts with taxa as rows and samples as columns
+    :param fdr: Maximum false discovery rate
+    :param permutations: Number of permutations
+    :param block: Number of taxa per block
+    :param cores: Number of processes
+    :param seed: Seed for the permutations
+    :param folder: Folder for the memory-mapped transformed values
+    :param bins: Number of thresholds between 0 and 1
+    :return: Smallest threshold with an estimated false discovery rate below fdr, or inf
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    values, scale = _transform(counts, 'rho')
+    if len(values) < 2:
+        return np.inf
+    if folder is None:
+        folder = os.getcwd()
+    blocks = _blocks(len(values), block)
+    items = [item + (permutation,) for permutation in range(permutations + 1) for item in blocks]
+    observed = np.zeros(bins + 1, dtype=np.int64)
+    expected = np.zeros(bins + 1, dtype=np.int64)
+    for permutation, counted in _map_blocks(_count_block, items, values, scale, folder,
+                                            'rho_' + str(seed), cores, seed=seed, bins=bins):
+        if permutation == 0:
+            observed += counted
+        else:
+            expected += counted
+    # number of pairs with a positive score of at least each threshold
+    observed = np.cumsum(observed[::-1])[::-1]
+    expected = np.cumsum(expected[::-1])[::-1] / max(permutations, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(observed > 0, expected / observed, np.inf)
+    passed = np.nonzero(rates <= fdr)[0]
+    if len(passed) == 0:
+        logger.warning('No proportionality threshold has a false discovery rate below ' + str(fdr) + '. ')
+        return np.inf
+    return passed[0] / bins
+
+
+def edge_number_network(counts, nodes, number, method='pearson', block=1000, cores=1, folder=None):
+    """
+    Constructs a network with a fixed number of edges,
+    like the edge number threshold guessing of CoNet:
+    half of the edges are the pairs with the highest scores
+    and the other half are the pairs with the lowest scores.
+    Only positive scores are selected as highest and negative scores as lowest,
+    so weak associations are not included when there are few of one sign.
+    For rho, all edges are pairs with the highest scores, as negative proportionality is not kept.
+    Each block returns only its strongest pairs, which are merged across blocks,
+    so the scores of all pairs are never sorted.
+
+    :param counts: Array of counts with taxa as rows and samples as columns
+    :param nodes: List of taxon names
+    :param number: Number of edges
+    :param method: Either 'pearson', 'spearman' or 'rho'
+    :param block: Number of taxa per block
+    :param cores: Number of processes
+    :param folder: Folder for the memory-mapped transformed values
+    :return: Tuple of NetArray with scores as weights, the lowest threshold and the highest threshold;
+             thresholds are None if no pairs with scores of that sign were selected
+    """
+    if method not in ['pearson', 'spearman', 'rho']:
+        raise ValueError("Please supply pearson, spearman or rho as method.")
+    lowest = EdgeSelector(0 if method == 'rho' else number // 2, largest=False)
+    highest = EdgeSelector(number - lowest.number, largest=True)
+    if len(nodes) > 0:
+        values, scale = _transform(counts, method)
+        if folder is None:
+            folder = os.getcwd()
+        for selected in _map_blocks(_select_block, _blocks(len(nodes), block), values, scale, folder,
+                                    'edges_' + str(os.getpid()), cores,
+                                    highest=highest.number, lowest=lowest.number):
+            highest.add(*selected[0])
+            lowest.add(*selected[1])
+    edges = [highest.edges(), lowest.edges()]
+    network = NetArray(nodes, np.concatenate([edges[0][0], edges[1][0]]),
+                       np.concatenate([edges[0][1], edges[1][1]]),
+                       np.concatenate([edges[0][2], edges[1][2]]))
+    return network, lowest.threshold(), highest.threshold()
+
+
+def _transform(counts, method):
+    """
+    Transforms counts so the scores of a block are the dot products of its rows.
+    Values are clr-transformed and centred per taxon; for Spearman, clr values are ranked.
+    For correlations, rows are scaled to unit length;
+    for rho, the squared norms are returned so the dot products can be scaled.
+
+    :param counts: Array of counts with taxa as rows and samples as columns
+    :param method: Either 'pearson', 'spearman' or 'rho'
+    :return: Tuple of transformed values and squared norms for rho, or None
+    """
+    values = clr(counts)
+    if method == 'spearman':
+        values = rankdata(values, axis=1)
+    values = values - values.mean(axis=1)[:, np.newaxis]
+    norms = np.sqrt(np.sum(values ** 2, axis=1))
+    if method == 'rho':
+        # rho is 2 cov(x, y) / (var(x) + var(y)), the sample size cancels out
+        return values, norms ** 2
+    # rows are scaled to unit length, so the dot product is the correlation
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where(norms[:, np.newaxis] > 0, values / norms[:, np.newaxis], 0)
+    return values, None
+
+
+def _blocks(n, block):
+    """
+    :param n: Number of taxa
+    :param block: Number of taxa per block
+    :return: List of tuples with start and end of the first and second block,
+             for all blocks in the upper triangle
+    """
+    starts = list(range(0, n, block))
+    return [(i, min(i + block, n), j, min(j + block, n))
+            for i in starts for j in starts if j >= i]
+
+
+def _map_blocks(function, items, values, scale, folder, name, cores, **settings):
+    """
+    Writes the transformed values to a memory-mapped file
+    and yields the results of a kernel function for each block,
+    in one or more processes.
+
+    :param function: Kernel function that accepts a block
+    :param items: List of blocks
+    :param values: Transformed values
+    :param scale: Squared norms of each taxon for rho, or None
+    :param folder: Folder for the memory-mapped transformed values
+    :param name: Name of the memory-mapped file
+    :param cores: Number of processes
+    :param settings: Settings of the kernel function
+    :return: Generator of kernel results, in any order
+    """
+    data = os.path.join(folder, name + '.values')
+    mapped = np.memmap(data, dtype=float, mode='w+', shape=values.shape)
+    mapped[:] = values
+    mapped.flush()
+    context = (data, values.shape, scale, settings)
+    del mapped
+    try:
+        if cores and cores > 1 and len(items) > 1:
+            pool = mp.Pool(cores, initializer=_init_kernel, initargs=context)
+            try:
+                for result in pool.imap_unordered(function, items):
+                    yield result
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_kernel(*context)
+            for item in items:
+                yield function(item)
+    finally:
+        _kernel_context.clear()
+        os.remove(data)
+
+
+# transformed values and settings of a kernel process, set by _init_kernel
+_kernel_context = dict()
+
+
+def _init_kernel(data, shape, scale, settings):
+    """
+    Initializes a process for correlation_network or rho_cutoff
+    by memory-mapping the transformed values.
+
+    :param data: Filepath to transformed values
+    :param shape: Shape of the transformed values
+    :param scale: Squared norms of each taxon for rho, or None
+    :param settings: Dictionary with settings of the kernel function
+    :return:
+    """
+    _kernel_context.clear()
+    _kernel_context['values'] = np.memmap(data, dtype=float, mode='r', shape=shape)
+    _kernel_context['scale'] = scale
+    _kernel_context.update(settings)
+
+
+def _block_scores(i0, i1, j0, j1, permutation=0):
+    """
+    Computes the scores between two blocks of taxa.
+    For permutations other than 0, the values of each taxon are shuffled first.
+
+    :param i0: Start of first block
+    :param i1: End of first block
+    :param j0: Start of second block
+    :param j1: End of second block
+    :param permutation: Number of the permutation, or 0 for the original values
+    :return: Tuple of scores and, for blocks on the diagonal, a mask of the upper triangle
+    """
+    values = _kernel_context['values']
+    first = values[i0:i1]
+    second = values[j0:j1]
+    if permutation > 0:
+        seed = _kernel_context['seed']
+        first = np.random.default_rng([seed, permutation, i0]).permuted(first, axis=1)
+        second = first if i0 == j0 else np.random.default_rng([seed, permutation, j0]).permuted(second, axis=1)
+    scores = first @ second.T
+    scale = _kernel_context['scale']
+    if scale is not None:
+        # scores are scaled in place, since blocks are large
+        denominator = np.add.outer(scale[i0:i1], scale[j0:j1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(scores, denominator, out=scores)
+        scores *= 2
+        if not (np.all(scale[i0:i1] > 0) and np.all(scale[j0:j1] > 0)):
+            scores[denominator == 0] = 0
+    triangle = None
+    if i0 == j0:
+        triangle = np.arange(j1 - j0)[np.newaxis, :] > np.arange(i1 - i0)[:, np.newaxis]
+    return scores, triangle
+
+
+def _kernel_block(item):
+    """
+    Computes the scores between two blocks of taxa
+    and returns the pairs that pass the threshold.
+    For blocks on the diagonal, only the upper triangle is returned.
+
+    :param item: Tuple of start and end of the first and second block
+    :return: Tuple of first node indices, second node indices and scores
+    """
+    i0, i1, j0, j1 = item
+    scores, triangle = _block_scores(i0, i1, j0, j1)
+    if _kernel_context.get('positive'):
+        keep = scores >= _kernel_context['cutoff']
+        keep &= scores > 0
+    else:
+        keep = np.abs(scores) >= _kernel_context['cutoff']
+        keep &= scores != 0
+    if triangle is not None:
+        keep &= triangle
+    rows, cols = np.nonzero(keep)
+    return (rows + i0).astype(np.int32), (cols + j0).astype(np.int32), scores[rows, cols]
+
+
+def _count_block(item):
+    """
+    Counts the pairs of two blocks of taxa per bin of positive scores.
+    Bin i contains scores from i / bins up to (i + 1) / bins;
+    the last bin contains scores of 1. Negative scores are not counted.
+
+    :param item: Tuple of start and end of the first and second block, and the permutation
+    :return: Tuple of the permutation and the number of pairs per bin
+    """
+    i0, i1, j0, j1, permutation = item
+    scores, triangle = _block_scores(i0, i1, j0, j1, permutation)
+    if triangle is not None:
+        scores = scores[triangle]
+    bins = _kernel_context['bins']
+    scores = scores[scores > 0]
+    scores *= bins
+    counted = np.bincount(scores.astype(np.intp).ravel(), minlength=bins + 1)
+    # scores can exceed 1 by rounding errors
+    counted[bins] += counted[bins + 1:].sum()
+    return permutation, counted[:bins + 1]
+
+
+def _select_block(item):
+    """
+    Selects the pairs of two blocks of taxa with the highest positive
+    and lowest negative scores, with a partial sort.
+
+    :param item: Tuple of start and end of the first and second block
+    :return: Tuple of first node indices, second node indices and scores,
+             for the highest and for the lowest scores
+    """
+    i0, i1, j0, j1 = item
+    scores, triangle = _block_scores(i0, i1, j0, j1)
+    if triangle is not None:
+        scores[~triangle] = np.nan
+    selected = list()
+    for number, largest in [(_kernel_context['highest'], True), (_kernel_context['lowest'], False)]:
+        index = top_pairs(scores, number, largest)
+        values = scores.ravel()[index]
+        index = index[values > 0] if largest else index[values < 0]
+        rows, cols = np.unravel_index(index, scores.shape)
+        selected.append(((rows + i0).astype(np.int32), (cols + j0).astype(np.int32),
+                         scores.ravel()[index]))
+    return selected
@@ -0,0 +1,403 @@
+"""
+The network inference tools are external programs (Java, R and Python 2)
+that can run for hours, hang or use all available memory.
+This module supervises these programs: each job is given a wall-clock limit
+and a memory limit, and the programs are killed together with all their child processes
+when a limit is exceeded or when the user cancels network inference.
+
+Cancellation works through a file in the output folder,
+so it can be requested from the GUI and is seen by all worker processes.
+
+Each job writes its intermediate files to its own scratch directory,
+on tmpfs when available, so concurrent jobs and concurrent massoc runs
+cannot overwrite each other's files.
+
+Commands are run with asyncio, so the output of the tools
+is streamed to the log while they run, tagged with the job name,
+and several short commands of a job (e.g. SparCC bootstraps) can run
+at the same time under one supervisor with run_many.
+A command fails as soon as it exits with an error
+or does not write the files it should produce.
+Jobs of different tools are run concurrently by the executors in netwrap.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import signal
+import shutil
+import asyncio
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from time import time
+import subprocess
+from psutil import Process, NoSuchProcess
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+class ToolError(Exception):
+
+    """Raised when an external tool is stopped by the supervisor.
+
+    Parameters
+    ----------
+    reason : str
+        Reason for stopping the tool: 'timeout', 'memory', 'cancelled',
+        'exit' (non-zero exit code) or 'output' (missing output files)
+    command : str
+        Command that was stopped
+
+    """
+
+    def __init__(self, message, reason, command=None):
+        super(ToolError, self).__init__(message)
+        self.reason = reason
+        self.command = command
+
+
+class JobSupervisor(object):
+
+    """Runs the commands of a single network inference job.
+    The wall-clock limit applies to all commands of the job together,
+    because some tools (e.g. SparCC) run many short commands.
+
+    Parameters
+    ----------
+    timeout : float
+        Maximum runtime of the job in seconds
+    max_memory : float
+        Maximum memory (resident set size) of a command and its children in megabytes
+    cancel : str
+        Filepath; if this file exists, the job is cancelled
+    scratch : str
+        Folder in which scratch directories are created
+    concurrency : int
+        Maximum number of commands run at the same time by run_many
+    log : logging.Logger
+        Logger that receives the output of the commands
+
+    """
+
+    def __init__(self, timeout=None, max_memory=None, cancel=None, scratch=None, interval=0.5,
+                 concurrency=1, log=None):
+        """
+        Initializes the supervisor and starts the clock for the wall-clock limit.
+
+        :param timeout: Maximum runtime of the job in seconds.
+        :param max_memory: Maximum memory of a command in megabytes.
+        :param cancel: Filepath to cancellation file.
+        :param scratch: Folder for scratch directories; if None, tmpfs or the system temp folder is used.
+        :param interval: Number of seconds between checks of the running command.
+        :param concurrency: Maximum number of commands run at the same time by run_many.
+        :param log: Logger for the output of the commands; by default, the logger of this module.
+        """
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.cancel = cancel
+        self.scratch = scratch
+        self.interval = interval
+        self.concurrency = concurrency
+        self.log = log if log is not None else logger
+        self.start = time()
+
+    @contextmanager
+    def scratch_dir(self, name):
+        """
+        Creates a scratch directory that is removed with all its contents
+        when the job is finished, also when the job fails or is stopped.
+
+        :param name: Name of the job, used as prefix of the directory
+        :return: Filepath to scratch directory
+        """
+        root = self.scratch if self.scratch else scratch_root()
+        folder = tempfile.mkdtemp(prefix='massoc_' + name + '_', dir=root)
+        try:
+            yield folder
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def call(self, cmd, cwd=None):
+        """
+        Runs a command in a new process group and waits for it to finish.
+        If the job runs out of time or memory, or is cancelled,
+        the command and all its child processes are killed and a ToolError is raised.
+        The exit code is returned, so it is up to the caller to check it.
+
+        :param cmd: Command to run, as a shell string or argument list
+        :param cwd: Working directory for the command
+        :return: Exit code of the command
+        """
+        return self.run(cmd, cwd=cwd, check=False)
+
+    def run(self, cmd, cwd=None, tag=None, artifacts=None, check=True):
+        """
+        Runs a command like call, but streams its output to the log
+        and raises a ToolError if the command fails.
+
+        :param cmd: Command to run, as a shell string or argument list
+        :param cwd: Working directory for the command
+        :param tag: Name of the job, added to each logged line
+        :param artifacts: List of files that the command should write
+        :param check: If True, a non-zero exit code or missing artifact raises a ToolError
+        :return: Exit code of the command
+        """
+        return asyncio.run(self.run_async(cmd, cwd=cwd, tag=tag, artifacts=artifacts, check=check))
+
+    def run_many(self, commands):
+        """
+        Runs multiple commands, with at most the concurrency limit running at the same time.
+        If one of the commands fails, the other commands are stopped
+        and the ToolError of the failed command is raised.
+
+        :param commands: List of dictionaries with keyword arguments for run
+        :return: List of exit codes
+        """
+        return asyncio.run(self._run_many(commands))
+
+    async def _run_many(self, commands):
+        """
+        Coroutine for run_many.
+
+        :param commands: List of dictionaries with keyword arguments for run
+        :return: List of exit codes
+        """
+        semaphore = asyncio.Semaphore(max(int(self.concurrency), 1))
+
+        async def limited(command):
+            async with semaphore:
+                return await self.run_async(**command)
+
+        tasks = [asyncio.ensure_future(limited(command)) for command in commands]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # cancelled commands kill their processes before they finish
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run_async(self, cmd, cwd=None, tag=None, artifacts=None, check=True):
+        """
+        Coroutine that runs a command and streams its output to the log.
+        The limits of the job are checked while the command runs.
+
+        :param cmd: Command to run, as a shell string or argument list
+        :param cwd: Working directory for the command
+        :param tag: Name of the job, added to each logged line
+        :param artifacts: List of files that the command should write
+        :param check: If True, a non-zero exit code or missing artifact raises a ToolError
+        :return: Exit code of the command
+        """
+        self.check(cmd)
+        if tag is None:
+            tag = os.path.basename(cmd if type(cmd) is str else cmd[0])
+        if sys.platform == 'win32':
+            options = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            options = {'start_new_session': True}
+        if type(cmd) is str:
+            process = await asyncio.create_subprocess_shell(cmd, cwd=cwd, stdout=subprocess.PIPE,
+                                                            stderr=subprocess.PIPE, **options)
+        else:
+            process = await asyncio.create_subprocess_exec(*[str(arg) for arg in cmd], cwd=cwd,
+                                                           stdout=subprocess.PIPE,
+                                                           stderr=subprocess.PIPE, **options)
+        errors = deque(maxlen=20)
+        readers = [asyncio.ensure_future(self._stream(process.stdout, tag, None)),
+                   asyncio.ensure_future(self._stream(process.stderr, tag, errors))]
+        try:
+            while process.returncode is None:
+                self.check(cmd, process)
+                try:
+                    await asyncio.wait_for(process.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # also reached when the coroutine is cancelled by run_many
+            kill_tree(process.pid)
+            await process.wait()
+            raise
+        finally:
+            # child processes that were left running can keep the pipes open
+            done, pending = await asyncio.wait(readers, timeout=5)
+            for reader in pending:
+                reader.cancel()
+        if check and process.returncode != 0:
+            raise ToolError(tag + " exited with code " + str(process.returncode) + ": " +
+                            ' '.join(errors), 'exit', cmd)
+        if check and artifacts:
+            missing = [path for path in artifacts
+                       if not os.path.isfile(path) or os.path.getsize(path) == 0]
+            if len(missing) > 0:
+                raise ToolError(tag + " did not write " + ', '.join(missing) + ": " +
+                                ' '.join(errors), 'output', cmd)
+        return process.returncode
+
+    async def _stream(self, stream, tag, errors):
+        """
+        Logs each line written by a command.
+
+        :param stream: Stream of stdout or stderr
+        :param tag: Name of the job
+        :param errors: Deque that keeps the last lines of stderr, or None for stdout
+        :return:
+        """
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            line = line.decode(errors='replace').rstrip()
+            if errors is not None:
+                errors.append(line)
+                self.log.info('[' + tag + '] stderr: ' + line)
+            else:
+                self.log.info('[' + tag + '] ' + line)
+
+    def check(self, cmd, process=None):
+        """
+        Raises a ToolError if the job has exceeded one of its limits.
+
+        :param cmd: Command that is being run
+        :param process: Popen object of running command
+        :return:
+        """
+        if self.cancel is not None and os.path.isfile(self.cancel):
+            raise ToolError("Network inference was cancelled.", 'cancelled', cmd)
+        if self.timeout is not None and time() - self.start > self.timeout:
+            raise ToolError("Job exceeded the time limit of " + str(self.timeout) +
+                            " seconds.", 'timeout', cmd)
+        if self.max_memory is not None and process is not None:
+            memory = tree_memory(process.pid)
+            if memory > self.max_memory * 1024 * 1024:
+                raise ToolError("Job exceeded the memory limit of " + str(self.max_memory) +
+                                " MB.", 'memory', cmd)
+
+
+def scratch_root(min_free=1024):
+    """
+    Returns the tmpfs folder if it is writable and has enough free space,
+    otherwise None, so the system temp folder is used instead.
+    Files on tmpfs are stored in memory, so SparCC bootstraps
+    of large tables should not fill it up.
+
+    :param min_free: Minimum free space in megabytes
+    :return: Folder for scratch directories
+    """
+    shm = '/dev/shm'
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        if shutil.disk_usage(shm).free > min_free * 1024 * 1024:
+            return shm
+    return None
+
+
+def tree_memory(pid):
+    """
+    Returns the summed resident set size of a process and its children.
+
+    :param pid: Process ID
+    :return: Memory in bytes
+    """
+    memory = 0
+    try:
+        parent = Process(pid)
+        processes = [parent] + parent.children(recursive=True)
+    except NoSuchProcess:
+        return memory
+    for process in processes:
+        try:
+            memory += process.memory_info().rss
+        except NoSuchProcess:
+            pass
+    return memory
+
+
+def kill_tree(pid):
+    """
+    Kills a process and all of its children.
+    Java and R processes started by the tool scripts are children of the shell,
+    so killing only the shell would leave them running.
+
+    :param pid: Process ID
+    :return:
+    """
+    try:
+        parent = Process(pid)
+        children = parent.children(recursive=True)
+    except NoSuchProcess:
+        return
+    for child in children:
+        try:
+            child.kill()
+        except NoSuchProcess:
+            pass
+    try:
+        parent.kill()
+    except NoSuchProcess:
+        pass
+    if sys.platform != 'win32':
+        # processes that were orphaned are still in the process group
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def cancel_path(filepath):
+    """
+    Returns the location of the cancellation file for an output folder.
+
+    :param filepath: Output folder
+    :return: Filepath to cancellation file
+    """
+    return filepath + '/massoc.cancel'
+
+
+def clear_cancel(filepath, started):
+    """
+    Removes a cancellation file left behind by an earlier run.
+    Files written after the run started are kept,
+    so a cancellation sent while the run is starting up is not lost.
+
+    :param filepath: Output folder
+    :param started: Start time of the run, in seconds since the epoch
+    :return: True if the file was removed
+    """
+    path = cancel_path(filepath)
+    try:
+        if os.path.getmtime(path) < started:
+            os.remove(path)
+            return True
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def cancel_jobs(filepath):
+    """
+    Cancels all network inference jobs writing to an output folder.
+    Running tools are killed by their supervisor,
+    and jobs that have not started yet fail immediately.
+
+    :param filepath: Output folder
+    :return:
+    """
+    with open(cancel_path(filepath), 'w') as file:
+        file.write('cancel')
+    logger.info('Cancelling network inference... ')
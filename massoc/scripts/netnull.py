@@ -0,0 +1,181 @@
+"""
+The netnull module generates null models for inferred networks.
+Networks are randomized with a double-edge swap,
+which preserves the degree of every node.
+Comparing the overlap between networks of different tools
+to the overlap between randomized networks shows whether the tools
+agree on more associations than expected by chance.
+
+Swaps are carried out in rounds on the edge arrays of NetArray objects:
+each round pairs up all edges at random and accepts all swaps
+that do not create self-loops or duplicate edges.
+Randomizations are distributed across multiple processes.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import sys
+import numpy as np
+import multiprocessing as mp
+from massoc.scripts.netarray import NetArray, edge_support, edge_keys, isin_sorted
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# networks and settings of a worker process, set by _init_null
+_null_context = dict()
+
+
+def randomize(network, nswap=None, seed=None, max_rounds=100):
+    """
+    Returns a degree-preserving randomization of a network.
+    Two edges a-b and c-d are replaced by a-d and c-b
+    (or a-c and d-b), and each new edge keeps the weight of one of the original edges.
+
+    :param network: NetArray object
+    :param nswap: Number of swaps; by default, 10 times the number of edges
+    :param seed: Seed for the random number generator
+    :param max_rounds: Maximum number of swap rounds
+    :return: Randomized NetArray object
+    """
+    src = network.src.astype(np.int64)
+    dst = network.dst.astype(np.int64)
+    m = len(src)
+    n = np.int64(max(len(network.nodes), 1))
+    if nswap is None:
+        nswap = 10 * m
+    rng = np.random.default_rng(seed)
+    swapped = 0
+    rounds = 0
+    while m > 1 and swapped < nswap and rounds < max_rounds:
+        keys = np.sort(edge_keys(src, dst, n))
+        order = rng.permutation(m)
+        half = m // 2
+        first = order[:half]
+        second = order[half:2 * half]
+        flip = rng.random(half) < 0.5
+        a = src[first]
+        b = dst[first]
+        c = np.where(flip, dst[second], src[second])
+        d = np.where(flip, src[second], dst[second])
+        new_first = edge_keys(a, d, n)
+        new_second = edge_keys(c, b, n)
+        accept = (a != d) & (c != b)
+        accept &= ~isin_sorted(new_first, keys) & ~isin_sorted(new_second, keys)
+        # two swaps in the same round should not create the same edge
+        candidates = np.nonzero(accept)[0]
+        proposed = np.concatenate([new_first[candidates], new_second[candidates]])
+        _, inverse, counts = np.unique(proposed, return_inverse=True, return_counts=True)
+        duplicate = counts[inverse] > 1
+        accepted = candidates[~(duplicate[:len(candidates)] | duplicate[len(candidates):])]
+        dst[first[accepted]] = d[accepted]
+        src[second[accepted]] = c[accepted]
+        dst[second[accepted]] = b[accepted]
+        swapped += len(accepted)
+        rounds += 1
+    return NetArray(network.nodes, src, dst, network.weight)
+
+
+def overlap_statistics(networks, num=None, weight=True):
+    """
+    Computes the sizes of the union, intersection and difference of networks,
+    as reported by the netstats logic operations.
+
+    :param networks: List of NetArray objects
+    :param num: List of numbers of networks for partial intersections
+    :param weight: If False, edges with different signs are considered the same edge
+    :return: Dictionary with union, intersection and difference sizes
+    """
+    if not weight:
+        networks = [NetArray(network.nodes, network.src, network.dst) for network in networks]
+    support = edge_support(networks)[4]
+    statistics = {'union': int(len(support)),
+                  'intersection': int(np.sum(support == len(networks))),
+                  'difference': int(np.sum(support == 1))}
+    if num:
+        for n in num:
+            statistics['intersection_' + str(n)] = int(np.sum(support >= int(n)))
+    return statistics
+
+
+def null_model(networks, n=100, cores=1, seed=None, nswap=None, num=None, weight=True):
+    """
+    Compares the overlap between networks to the overlap between
+    degree-preserving randomizations of the same networks.
+    Intersections are tested for being larger than expected,
+    while unions and differences are tested for being smaller than expected,
+    so all p-values are small if networks agree more than expected by chance.
+
+    :param networks: List of NetArray objects
+    :param n: Number of randomizations
+    :param cores: Number of processes
+    :param seed: Seed for the random number generator
+    :param nswap: Number of swaps per randomization
+    :param num: List of numbers of networks for partial intersections
+    :param weight: If False, edges with different signs are considered the same edge
+    :return: Dictionary with observed size, mean null size and empirical p-value per statistic
+    """
+    observed = overlap_statistics(networks, num=num, weight=weight)
+    seeds = np.random.SeedSequence(seed).generate_state(n).tolist()
+    context = {'networks': networks, 'nswap': nswap, 'num': num, 'weight': weight}
+    if cores and cores > 1:
+        pool = mp.Pool(cores, initializer=_init_null, initargs=(context,))
+        try:
+            replicates = pool.map(_null_replicate, seeds)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_null(context)
+        replicates = [_null_replicate(replicate) for replicate in seeds]
+    results = dict()
+    for statistic in observed:
+        null = np.array([replicate[statistic] for replicate in replicates])
+        if statistic.startswith('intersection'):
+            extreme = np.sum(null >= observed[statistic])
+        else:
+            extreme = np.sum(null <= observed[statistic])
+        results[statistic] = {'observed': observed[statistic],
+                              'null_mean': float(np.mean(null)) if n > 0 else None,
+                              'p': float((extreme + 1) / (n + 1))}
+    return results
+
+
+def _init_null(context):
+    """
+    Initializes a worker process with the networks and settings,
+    so they are sent to each worker once.
+
+    :param context: Dictionary with networks, nswap, num and weight
+    :return:
+    """
+    _null_context.clear()
+    _null_context.update(context)
+
+
+def _null_replicate(seed):
+    """
+    Randomizes all networks and computes their overlap statistics.
+
+    :param seed: Seed for the random number generator
+    :return: Dictionary with union, intersection and difference sizes
+    """
+    rng = np.random.default_rng(seed)
+    randomized = [randomize(network, nswap=_null_context['nswap'],
+                            seed=rng.integers(2 ** 32))
+                  for network in _null_context['networks']]
+    return overlap_statistics(randomized, num=_null_context['num'],
+                              weight=_null_context['weight'])
@@ -0,0 +1,447 @@
+"""
+The netqueue module distributes jobs over processes on multiple machines
+that share a filesystem, through a job queue stored in a folder.
+
+The queue folder contains a 'pending' folder with a file per job,
+a 'running' folder with claimed jobs and their heartbeats,
+and a 'results' folder with a result file per completed job.
+A worker claims a job by renaming its file from 'pending' to 'running';
+renaming is atomic, so only one worker can claim each job.
+While the job runs, the worker updates the modification time of a heartbeat file.
+Jobs with a heartbeat that stops changing are put back in the queue,
+so the jobs of workers that crashed or lost their node are run again.
+A stalled job is first renamed, so only one process can put it back,
+and workers only report a result while they still own the heartbeat of the job.
+The heartbeat is only compared to earlier observations of the same file,
+so the clocks of different machines do not need to be in sync.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import pickle
+import socket
+import tempfile
+import threading
+from time import time, sleep
+from uuid import uuid4
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+class FileQueue(object):
+
+    """Job queue stored in a folder on a shared filesystem.
+
+    Parameters
+    ----------
+    folder : str
+        Queue folder
+    heartbeat : float
+        Number of seconds between heartbeats of a running job
+    stale : float
+        Number of seconds without heartbeat after which a job is put back in the queue
+    attempts : int
+        Number of times a job is claimed before it is reported as failed
+    run : str
+        Identifier of the current run, or None if no run was started
+    metadata : dict
+        Information shared with the workers of the current run
+
+    """
+
+    def __init__(self, folder, heartbeat=10, stale=60, attempts=3):
+        """
+        Initializes a queue in a folder.
+        Workers should use FileQueue.open, so they use the settings of the run.
+
+        :param folder: Queue folder
+        :param heartbeat: Number of seconds between heartbeats
+        :param stale: Number of seconds without heartbeat before a job is put back
+        :param attempts: Number of times a job is claimed before it fails
+        """
+        self.folder = folder
+        self.heartbeat = heartbeat
+        self.stale = stale
+        self.attempts = attempts
+        self.run = None
+        self.metadata = dict()
+        # last observed heartbeat of running jobs, with the local time of observation
+        self._seen = dict()
+        for name in ['pending', 'running', 'results']:
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+
+    @classmethod
+    def open(cls, folder):
+        """
+        Opens the queue of the current run.
+
+        :param folder: Queue folder
+        :return: FileQueue, or None if no run was started
+        """
+        try:
+            with open(os.path.join(folder, 'queue.json'), 'r') as file:
+                settings = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        queue = cls(folder, settings['heartbeat'], settings['stale'], settings['attempts'])
+        queue.run = settings['run']
+        queue.metadata = settings['metadata']
+        return queue
+
+    def start(self, metadata=None):
+        """
+        Starts a new run by removing jobs and results of previous runs
+        and writing the settings of the queue.
+
+        :param metadata: Dictionary with information for the workers
+        :return: Run identifier
+        """
+        for name in ['pending', 'running', 'results']:
+            for file in os.listdir(os.path.join(self.folder, name)):
+                _remove(os.path.join(self.folder, name, file))
+        _remove(os.path.join(self.folder, 'done'))
+        self.run = uuid4().hex
+        self.metadata = metadata if metadata is not None else dict()
+        settings = {'run': self.run, 'heartbeat': self.heartbeat, 'stale': self.stale,
+                    'attempts': self.attempts, 'metadata': self.metadata}
+        _write_file(os.path.join(self.folder, 'queue.json'), json.dumps(settings), 'w')
+        return self.run
+
+    def submit(self, name, job, attempt=0):
+        """
+        Adds a job to the queue.
+
+        :param name: Unique name of the job
+        :param job: Picklable job
+        :param attempt: Number of times the job was claimed before
+        :return:
+        """
+        record = {'run': self.run, 'name': name, 'job': job, 'attempt': attempt}
+        _write_file(self._path('pending', name, '.job'),
+                    pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL), 'wb')
+
+    def claim(self):
+        """
+        Claims a pending job of the current run.
+        Jobs are claimed in the order they were submitted.
+
+        :return: Job record, or None if no job could be claimed
+        """
+        submitted = list()
+        for file in os.listdir(os.path.join(self.folder, 'pending')):
+            if not file.endswith('.job'):
+                continue
+            try:
+                mtime = os.stat(os.path.join(self.folder, 'pending', file)).st_mtime
+            except OSError:
+                continue
+            submitted.append((mtime, file[:-4]))
+        for _, name in sorted(submitted):
+            running = self._path('running', name, '.job')
+            try:
+                os.rename(self._path('pending', name, '.job'), running)
+            except OSError:
+                # another worker claimed the job first
+                continue
+            try:
+                with open(running, 'rb') as handle:
+                    record = pickle.load(handle)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            if record['run'] != self.run:
+                _remove(running)
+                continue
+            _write_file(self._path('running', name, '.heartbeat'), _worker_id(), 'w')
+            return record
+        return None
+
+    def beat(self, name):
+        """
+        Updates the heartbeat of a running job claimed by this worker.
+
+        :param name: Name of the job
+        :return:
+        """
+        if self.owns(name):
+            try:
+                os.utime(self._path('running', name, '.heartbeat'))
+            except OSError:
+                pass
+
+    def owns(self, name):
+        """
+        :param name: Name of the job
+        :return: True if the heartbeat of the job was written by this worker
+        """
+        try:
+            with open(self._path('running', name, '.heartbeat'), 'r') as file:
+                return file.read() == _worker_id()
+        except OSError:
+            return False
+
+    def complete(self, name, result):
+        """
+        Writes the result of a job and removes it from the running jobs.
+        If the job was put back in the queue while it was running,
+        the result is discarded, as the job is now owned by another worker.
+
+        :param name: Name of the job
+        :param result: JSON-serializable result
+        :return: True if the result was written
+        """
+        if not self.owns(name):
+            logger.warning('Job ' + name + ' was put back in the queue, '
+                           'so its result from worker ' + _worker_id() + ' is discarded. ')
+            return False
+        self._write_result(name, result)
+        _remove(self._path('running', name, '.job'))
+        _remove(self._path('running', name, '.heartbeat'))
+        return True
+
+    def collect(self):
+        """
+        Collects the results of completed jobs of the current run.
+        Collected results are removed from the queue.
+
+        :return: Dictionary with job names as keys and results as values
+        """
+        results = dict()
+        for file in os.listdir(os.path.join(self.folder, 'results')):
+            if not file.endswith('.json'):
+                continue
+            path = os.path.join(self.folder, 'results', file)
+            try:
+                with open(path, 'r') as handle:
+                    record = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            if record['run'] == self.run:
+                results[file[:-5]] = record['result']
+            _remove(path)
+        return results
+
+    def requeue_stalled(self):
+        """
+        Puts running jobs without recent heartbeat back in the queue.
+        Jobs that were claimed too often are completed with a failure instead.
+
+        :return: List of names of stalled jobs
+        """
+        stalled = list()
+        now = time()
+        names = [file[:-4] for file in os.listdir(os.path.join(self.folder, 'running'))
+                 if file.endswith('.job')]
+        for name in names:
+            try:
+                beat = os.stat(self._path('running', name, '.heartbeat')).st_mtime
+            except OSError:
+                beat = None
+            if name not in self._seen or self._seen[name][0] != beat:
+                self._seen[name] = (beat, now)
+                continue
+            if now - self._seen[name][1] < self.stale:
+                continue
+            del self._seen[name]
+            # renaming is atomic, so only one process can put the job back
+            claimed = self._path('running', name, '.' + uuid4().hex + '.requeue')
+            try:
+                os.rename(self._path('running', name, '.job'), claimed)
+            except OSError:
+                continue
+            try:
+                with open(claimed, 'rb') as handle:
+                    record = pickle.load(handle)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                _remove(claimed)
+                continue
+            # the heartbeat is removed before the job is back in the queue,
+            # so it cannot belong to a new claim
+            _remove(self._path('running', name, '.heartbeat'))
+            stalled.append(name)
+            if record['attempt'] + 1 >= self.attempts:
+                logger.warning('Job ' + name + ' stalled ' + str(self.attempts) + ' times. ')
+                self._write_result(name, {'reason': 'stalled', 'command': None,
+                                          'message': 'The job stopped sending heartbeats ' +
+                                                     str(self.attempts) + ' times.'})
+            else:
+                logger.warning('Job ' + name + ' stalled and was put back in the queue. ')
+                self.submit(name, record['job'], record['attempt'] + 1)
+            _remove(claimed)
+        for name in list(self._seen):
+            if name not in names:
+                del self._seen[name]
+        return stalled
+
+    def cancel(self):
+        """
+        Removes all pending jobs.
+
+        :return: List of names of removed jobs
+        """
+        cancelled = list()
+        for file in os.listdir(os.path.join(self.folder, 'pending')):
+            if file.endswith('.job') and _remove(os.path.join(self.folder, 'pending', file)):
+                cancelled.append(file[:-4])
+        return cancelled
+
+    def pending(self):
+        """
+        :return: Number of pending jobs
+        """
+        return len([file for file in os.listdir(os.path.join(self.folder, 'pending'))
+                    if file.endswith('.job')])
+
+    def finish(self):
+        """
+        Marks the run as finished, so workers stop.
+
+        :return:
+        """
+        _write_file(os.path.join(self.folder, 'done'), self.run, 'w')
+
+    def finished(self):
+        """
+        :return: True if the current run was marked as finished
+        """
+        try:
+            with open(os.path.join(self.folder, 'done'), 'r') as file:
+                return file.read() == self.run
+        except OSError:
+            return False
+
+    def _write_result(self, name, result):
+        """
+        :param name: Name of the job
+        :param result: JSON-serializable result
+        :return:
+        """
+        _write_file(self._path('results', name, '.json'),
+                    json.dumps({'run': self.run, 'result': result}), 'w')
+
+    def _path(self, folder, name, extension):
+        """
+        :param folder: Subfolder of the queue
+        :param name: Name of the job
+        :param extension: File extension
+        :return: Filepath
+        """
+        return os.path.join(self.folder, folder, name + extension)
+
+
+def work(folder, execute, poll=1, idle=None):
+    """
+    Runs jobs from a queue until the run is finished.
+    A worker can be started before the run;
+    it waits until jobs are submitted.
+    While no jobs are pending, the worker puts stalled jobs back in the queue.
+
+    :param folder: Queue folder
+    :param execute: Function that accepts a job and the metadata of the run, and returns a result
+    :param poll: Number of seconds between checks for new jobs
+    :param idle: Number of seconds without jobs after which the worker stops, or None
+    :return: Number of jobs that were run
+    """
+    queue = None
+    completed = 0
+    waiting = time()
+    while True:
+        current = FileQueue.open(folder)
+        if current is not None and (queue is None or current.run != queue.run):
+            queue = current
+            logger.info('Worker ' + _worker_id() + ' joined run ' + queue.run + '. ')
+        record = queue.claim() if queue is not None else None
+        if record is None:
+            if queue is not None:
+                if queue.finished():
+                    break
+                queue.requeue_stalled()
+            if idle is not None and time() - waiting > idle:
+                break
+            sleep(poll)
+            continue
+        name = record['name']
+        logger.info('Worker ' + _worker_id() + ' claimed ' + name + '. ')
+        stop = threading.Event()
+        thread = threading.Thread(target=_send_heartbeats, args=(queue, name, stop))
+        thread.daemon = True
+        thread.start()
+        try:
+            result = execute(record['job'], queue.metadata)
+        finally:
+            stop.set()
+            thread.join()
+        queue.complete(name, result)
+        completed += 1
+        waiting = time()
+    logger.info('Worker ' + _worker_id() + ' completed ' + str(completed) + ' jobs. ')
+    return completed
+
+
+def _send_heartbeats(queue, name, stop):
+    """
+    Updates the heartbeat of a job until the stop event is set.
+
+    :param queue: FileQueue
+    :param name: Name of the job
+    :param stop: threading.Event
+    :return:
+    """
+    while not stop.wait(queue.heartbeat):
+        queue.beat(name)
+
+
+def _worker_id():
+    """
+    :return: Name of the machine and process ID
+    """
+    return socket.gethostname() + ':' + str(os.getpid())
+
+
+def _write_file(path, data, mode):
+    """
+    Writes a file by first writing to a temporary file in the same folder,
+    so other processes never read partial files.
+
+    :param path: Filepath
+    :param data: Contents of the file
+    :param mode: 'w' for text and 'wb' for bytes
+    :return:
+    """
+    handle, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(handle, mode) as file:
+            file.write(data)
+        os.replace(temp, path)
+    finally:
+        _remove(temp)
+
+
+def _remove(path):
+    """
+    Removes a file that may have been removed by another process.
+
+    :param path: Filepath
+    :return: True if the file was removed by this process
+    """
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,200 @@
+"""
+The netstable module estimates how stable the edges of a network are
+across networks inferred from bootstrapped or subsampled data.
+
+Networks are consumed one at a time, so the resampled networks
+never need to be held in memory or on disk together.
+For every edge seen in at least one network, the number of networks
+that contain the edge and the running mean and variance of the edge weight
+are updated with Welford's algorithm.
+Networks without the edge contribute a weight of 0,
+so edges that are only found in some resamples get a mean close to 0.
+Memory use depends on the number of distinct edges,
+not on the number of networks.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import sys
+import numpy as np
+from massoc.scripts.netarray import NetArray, edge_keys, isin_sorted
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+class EdgeStability(object):
+
+    """Running edge statistics of resampled networks with the same nodes.
+    Edges are identified by a key of the two node indices, lowest index first;
+    keys are kept sorted, so edges of a new network are found with a binary search.
+
+    Parameters
+    ----------
+    nodes : list
+        Node names
+    n : int
+        Number of networks added so far
+    keys : numpy.ndarray
+        Sorted edge keys
+    count : numpy.ndarray
+        Number of networks that contain each edge
+    mean : numpy.ndarray
+        Running mean of the weight of each edge
+    m2 : numpy.ndarray
+        Running sum of squared deviations from the mean of each edge
+
+    """
+
+    def __init__(self, nodes):
+        """
+        Initializes statistics without networks.
+
+        :param nodes: List of node names
+        """
+        self.nodes = list(nodes)
+        self.n = 0
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int32)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self._index = None
+
+    def update(self, network):
+        """
+        Adds a network to the statistics.
+        Nodes of the network that are not in the node list raise a KeyError.
+
+        :param network: NetArray object
+        :return: Number of edges that were not seen before
+        """
+        keys, weights = self._edge_keys(network)
+        self.n += 1
+        added = keys[~isin_sorted(keys, self.keys)]
+        if len(added) > 0:
+            # new edges were absent from all previous networks, so they start at a mean of 0
+            merged = np.union1d(self.keys, added)
+            position = np.searchsorted(merged, self.keys)
+            count = np.zeros(len(merged), dtype=np.int32)
+            mean = np.zeros(len(merged))
+            m2 = np.zeros(len(merged))
+            count[position] = self.count
+            mean[position] = self.mean
+            m2[position] = self.m2
+            self.keys, self.count, self.mean, self.m2 = merged, count, mean, m2
+        values = np.zeros(len(self.keys))
+        position = np.searchsorted(self.keys, keys)
+        values[position] = weights
+        self.count[position] += 1
+        delta = values - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (values - self.mean)
+        return len(added)
+
+    def frequency(self):
+        """
+        :return: Fraction of networks that contain each edge
+        """
+        if self.n == 0:
+            return np.zeros(len(self.keys))
+        return self.count / self.n
+
+    def variance(self):
+        """
+        :return: Sample variance of the weight of each edge
+        """
+        if self.n < 2:
+            return np.zeros(len(self.keys))
+        return self.m2 / (self.n - 1)
+
+    def network(self, frequency=0):
+        """
+        Constructs a network with the edges found in at least a fraction of the networks.
+        Edge weights are the mean weights and the statistics are added as edge attributes.
+
+        :param frequency: Minimum fraction of networks that contain an edge
+        :return: NetArray object
+        """
+        keep = self.frequency() >= frequency
+        n = np.int64(max(len(self.nodes), 1))
+        network = NetArray(self.nodes, self.keys[keep] // n, self.keys[keep] % n, self.mean[keep])
+        return self.annotate(network)
+
+    def annotate(self, network):
+        """
+        Adds the statistics of the edges of a network as edge attributes:
+        'stability' is the fraction of networks that contain the edge,
+        'weight_mean' and 'weight_sd' are the mean and standard deviation of its weight.
+        Edges that were never seen get a stability of 0.
+
+        :param network: NetArray object with nodes in the node list
+        :return: Annotated NetArray object
+        """
+        keys, _ = self._edge_keys(network, unique=False)
+        found = isin_sorted(keys, self.keys)
+        position = np.searchsorted(self.keys, keys[found])
+        scores = {'stability': self.frequency(), 'weight_mean': self.mean,
+                  'weight_sd': np.sqrt(self.variance())}
+        for name, values in scores.items():
+            column = np.zeros(len(keys))
+            column[found] = values[position]
+            network.set_edge_attribute(name, column)
+        return network
+
+    def _edge_keys(self, network, unique=True):
+        """
+        Converts the edges of a network to keys of this node list.
+
+        :param network: NetArray object
+        :param unique: If True, keys are sorted and duplicate edges are removed
+        :return: Tuple of edge keys and edge weights
+        """
+        if network.nodes == self.nodes:
+            index = np.arange(len(self.nodes), dtype=np.int64)
+        else:
+            if self._index is None:
+                self._index = {node: i for i, node in enumerate(self.nodes)}
+            index = np.array([self._index[node] for node in network.nodes], dtype=np.int64)
+        src = index[np.asarray(network.src)]
+        dst = index[np.asarray(network.dst)]
+        keys = edge_keys(src, dst, max(len(self.nodes), 1))
+        weights = np.asarray(network.weight, dtype=float)
+        if unique:
+            keys, first = np.unique(keys, return_index=True)
+            weights = weights[first]
+        return keys, weights
+
+
+def edge_stability(networks, nodes=None):
+    """
+    Computes edge statistics from an iterable of networks.
+    Networks can be generated one at a time,
+    so only one resampled network is held in memory.
+
+    :param networks: Iterable of NetArray objects
+    :param nodes: List of node names; by default, the nodes of the first network
+    :return: EdgeStability object
+    """
+    stability = None
+    if nodes is not None:
+        stability = EdgeStability(nodes)
+    for network in networks:
+        if stability is None:
+            stability = EdgeStability(network.nodes)
+        stability.update(network)
+    if stability is None:
+        stability = EdgeStability(list())
+    return stability
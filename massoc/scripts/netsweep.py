@@ -0,0 +1,332 @@
+"""
+The netsweep module derives networks at multiple thresholds
+from a single network inference run.
+
+Instead of thresholding the association matrix of a tool once,
+all node pairs are stored together with their association score
+and significance, sorted once by significance.
+The network at any threshold is then a prefix of the sorted edge arrays,
+which is found with a binary search, so trying different p-value cutoffs
+does not require network inference to be run again.
+
+When a network should have a fixed number of edges instead,
+like with the edge number threshold guessing of CoNet,
+EdgeSelector keeps the strongest pairs of blocks of scores.
+Each block is only partially sorted, and the candidates of all blocks
+are merged in a heap with one entry per selected edge,
+so the full set of pairs is never sorted or held in memory.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import heapq
+import h5py
+import numpy as np
+import pandas
+from massoc.scripts.netarray import NetArray
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+class EdgeScores(object):
+
+    """Association scores and p-values of all node pairs of a network,
+    sorted by p-value (and by decreasing absolute score for equal p-values).
+
+    Parameters
+    ----------
+    nodes : list
+        Node names
+    src : numpy.ndarray
+        Index of the first node of each pair
+    dst : numpy.ndarray
+        Index of the second node of each pair
+    score : numpy.ndarray
+        Association score of each pair, e.g. a correlation
+    pval : numpy.ndarray
+        P-value of each pair, in ascending order
+
+    """
+
+    def __init__(self, nodes, src, dst, score, pval):
+        """
+        Initializes the scores and sorts the pairs by p-value.
+        Pairs with a score of 0 or a missing score or p-value are removed,
+        as they never become edges.
+
+        :param nodes: List of node names, indexed by src and dst
+        :param src: Array of first node indices
+        :param dst: Array of second node indices
+        :param score: Array of association scores
+        :param pval: Array of p-values
+        """
+        score = np.asarray(score, dtype=float)
+        pval = np.asarray(pval, dtype=float)
+        keep = (score != 0) & ~np.isnan(score) & ~np.isnan(pval)
+        order = np.lexsort((-np.abs(score[keep]), pval[keep]))
+        self.nodes = list(nodes)
+        self.src = np.asarray(src, dtype=np.int32)[keep][order]
+        self.dst = np.asarray(dst, dtype=np.int32)[keep][order]
+        self.score = score[keep][order]
+        self.pval = pval[keep][order]
+
+    def number_of_edges(self, threshold):
+        """
+        :param threshold: P-value threshold; pairs with p-values equal to or above it are removed
+        :return: Number of edges at the threshold
+        """
+        return int(np.searchsorted(self.pval, threshold, side='left'))
+
+    def network(self, threshold=None, edges=None):
+        """
+        Returns the network at a p-value threshold,
+        or the network with a fixed number of most significant edges.
+        Edge weights are the signs of the scores, like the networks of run_spar.
+
+        :param threshold: P-value threshold
+        :param edges: Number of edges
+        :return: NetArray
+        """
+        if threshold is not None:
+            edges = self.number_of_edges(threshold)
+        elif edges is None:
+            raise ValueError("Please supply a threshold or a number of edges.")
+        return NetArray(self.nodes, self.src[:edges], self.dst[:edges],
+                        np.sign(self.score[:edges]))
+
+    def sweep(self, thresholds):
+        """
+        Reports the number of edges and the density of the network
+        at each threshold.
+
+        :param thresholds: List of p-value thresholds
+        :return: List of dictionaries with threshold, edges and density
+        """
+        thresholds = np.sort(np.asarray(thresholds, dtype=float))
+        counts = np.searchsorted(self.pval, thresholds, side='left')
+        n = len(self.nodes)
+        pairs = max(n * (n - 1) // 2, 1)
+        return [{'threshold': float(threshold), 'edges': int(count), 'density': count / pairs}
+                for threshold, count in zip(thresholds, counts)]
+
+    @classmethod
+    def read_matrices(cls, matrix, pvals, chunksize=1000):
+        """
+        Reads a tab-delimited, square association matrix and matrix of p-values
+        in row chunks and keeps the upper triangle (excluding the diagonal).
+
+        :param matrix: Filepath to tab-delimited matrix with row and column names
+        :param pvals: Filepath to tab-delimited matrix of p-values with the same shape
+        :param chunksize: Number of rows read at once
+        :return: EdgeScores
+        """
+        nodes = list()
+        src = list()
+        dst = list()
+        scores = list()
+        pvalues = list()
+        reader = pandas.read_csv(matrix, sep='\t', index_col=0, chunksize=chunksize)
+        pval_reader = pandas.read_csv(pvals, sep='\t', index_col=0, chunksize=chunksize)
+        start = 0
+        for chunk in reader:
+            values = chunk.to_numpy(dtype=float)
+            pval_values = next(pval_reader).to_numpy(dtype=float)
+            keep = np.arange(values.shape[1])[np.newaxis, :] > \
+                np.arange(start, start + values.shape[0])[:, np.newaxis]
+            chunk_rows, chunk_cols = np.nonzero(keep)
+            src.append((chunk_rows + start).astype(np.int32))
+            dst.append(chunk_cols.astype(np.int32))
+            scores.append(values[chunk_rows, chunk_cols])
+            pvalues.append(pval_values[chunk_rows, chunk_cols])
+            nodes.extend(chunk.index)
+            start += values.shape[0]
+        if len(src) == 0:
+            return cls(nodes, [], [], [], [])
+        return cls(nodes, np.concatenate(src), np.concatenate(dst),
+                   np.concatenate(scores), np.concatenate(pvalues))
+
+    def write_hdf5(self, path):
+        """
+        Writes the sorted scores to an HDF5 file.
+
+        :param path: Filepath
+        :return:
+        """
+        with h5py.File(path, 'w') as file:
+            file.create_dataset('nodes', data=[str(node) for node in self.nodes],
+                                dtype=h5py.string_dtype())
+            file.create_dataset('src', data=self.src)
+            file.create_dataset('dst', data=self.dst)
+            file.create_dataset('score', data=self.score)
+            file.create_dataset('pval', data=self.pval)
+
+    @classmethod
+    def read_hdf5(cls, path):
+        """
+        Reads scores written by write_hdf5.
+        The arrays are already sorted, so they are not sorted again.
+
+        :param path: Filepath
+        :return: EdgeScores
+        """
+        scores = cls.__new__(cls)
+        with h5py.File(path, 'r') as file:
+            scores.nodes = file['nodes'].asstr()[()].tolist()
+            scores.src = file['src'][()]
+            scores.dst = file['dst'][()]
+            scores.score = file['score'][()]
+            scores.pval = file['pval'][()]
+        return scores
+
+
+class EdgeSelector(object):
+
+    """Selects the pairs with the highest or lowest scores
+    from blocks of pairs that are added one at a time.
+
+    Parameters
+    ----------
+    number : int
+        Maximum number of selected pairs
+    largest : bool
+        If True, the highest scores are selected, otherwise the lowest
+
+    """
+
+    def __init__(self, number, largest=True):
+        """
+        Initializes the selector without pairs.
+
+        :param number: Maximum number of selected pairs
+        :param largest: If True, selects the highest scores, otherwise the lowest
+        """
+        self.number = int(number)
+        self.largest = largest
+        # min-heap of (key, row, col, score), where the key is higher for stronger pairs
+        self._heap = list()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, rows, cols, scores):
+        """
+        Adds a block of pairs.
+        Only the strongest pairs of the block are compared to the heap;
+        pairs with missing scores are never selected.
+
+        :param rows: Array of first node indices
+        :param cols: Array of second node indices
+        :param scores: Array of scores
+        :return:
+        """
+        if self.number <= 0:
+            return
+        scores = np.asarray(scores, dtype=float)
+        index = top_pairs(scores, self.number, self.largest)
+        keys = scores[index] if self.largest else -scores[index]
+        if len(self._heap) == self.number:
+            # pairs that are not stronger than the weakest selected pair are skipped
+            stronger = keys > self._heap[0][0]
+            index, keys = index[stronger], keys[stronger]
+        rows = np.asarray(rows)[index].tolist()
+        cols = np.asarray(cols)[index].tolist()
+        for item in zip(keys.tolist(), rows, cols, scores[index].tolist()):
+            if len(self._heap) < self.number:
+                heapq.heappush(self._heap, item)
+            else:
+                heapq.heappushpop(self._heap, item)
+
+    def threshold(self):
+        """
+        :return: Score of the weakest selected pair, or None if no pairs were selected
+        """
+        if len(self._heap) == 0:
+            return None
+        return self._heap[0][3]
+
+    def edges(self):
+        """
+        :return: Tuple of first node indices, second node indices and scores
+                 of the selected pairs, strongest first
+        """
+        items = sorted(self._heap, reverse=True)
+        return (np.array([item[1] for item in items], dtype=np.int32),
+                np.array([item[2] for item in items], dtype=np.int32),
+                np.array([item[3] for item in items], dtype=float))
+
+
+def top_pairs(scores, number, largest=True):
+    """
+    Returns the indices of the highest or lowest scores with a partial sort.
+    The indices are not sorted by score.
+
+    :param scores: Array of scores; missing scores (nan) are never selected
+    :param number: Maximum number of indices
+    :param largest: If True, selects the highest scores, otherwise the lowest
+    :return: Array of indices into the flattened scores
+    """
+    keys = np.asarray(scores, dtype=float).ravel()
+    keys = keys if largest else -keys
+    keys = np.where(np.isnan(keys), -np.inf, keys)
+    if number <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if len(keys) > number:
+        index = np.argpartition(keys, len(keys) - number)[len(keys) - number:]
+    else:
+        index = np.arange(len(keys))
+    return index[keys[index] > -np.inf]
+
+
+def scores_path(filepath, name):
+    """
+    :param filepath: Output folder
+    :param name: Network name
+    :return: Filepath to the scores of the network
+    """
+    return os.path.join(filepath, name + '_scores.h5')
+
+
+def threshold_sweep(filepath, names, thresholds):
+    """
+    Reports edge counts and densities of networks at multiple thresholds,
+    using the scores written to the output folder during network inference.
+    The report is written to threshold_sweep.txt in the output folder.
+
+    :param filepath: Output folder
+    :param names: List of network names
+    :param thresholds: List of p-value thresholds
+    :return: Dictionary with network names as keys and sweep results as values
+    """
+    results = dict()
+    for name in names:
+        try:
+            results[name] = EdgeScores.read_hdf5(scores_path(filepath, name)).sweep(thresholds)
+        except (FileNotFoundError, OSError):
+            logger.warning('No scores available for ' + name + '. ')
+    with open(os.path.join(filepath, 'threshold_sweep.txt'), 'w') as file:
+        file.write('network\tthreshold\tedges\tdensity\n')
+        for name in results:
+            for row in results[name]:
+                file.write(name + '\t' + str(row['threshold']) + '\t' +
+                           str(row['edges']) + '\t' + str(row['density']) + '\n')
+    for name in results:
+        logger.info(name + ': ' + ', '.join([str(row['threshold']) + ' -> ' + str(row['edges']) +
+                                              ' edges (density ' + str(round(row['density'], 4)) + ')'
+                                              for row in results[name]]))
+    return results
@@ -0,0 +1,329 @@
+"""
+The networker module keeps network inference tools running between jobs.
+Starting a JVM for CoNet or loading the R packages for SPIEC-EASI
+takes several seconds, which is repeated for every taxonomic level and BIOM file.
+Instead, a warm worker starts the tool once and receives jobs over stdin.
+
+The protocol is line-based and tab-separated, so it can be implemented
+in any language without additional libraries:
+the worker writes '@massoc<TAB>ready' when it has started,
+each job is a line '<id><TAB><argument><TAB>...',
+and the worker answers with '@massoc<TAB><id><TAB>ok'
+or '@massoc<TAB><id><TAB>error<TAB><message>'.
+Other output of the worker is written to the log.
+
+Workers that crash or are stopped by the job supervisor
+are started again for the next job.
+If a worker stops before it answers a job, e.g. because the tool
+exits the process, run_warm runs that job again without the worker,
+so the job does not fail because of the worker.
+Workers that keep stopping during jobs are no longer used.
+
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import queue
+import subprocess
+import threading
+from multiprocessing.util import Finalize
+from massoc.scripts.netexec import ToolError, kill_tree
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+MARKER = '@massoc'
+
+
+class WorkerExit(ToolError):
+
+    """Raised when a warm worker stops before it answers a job.
+    The job may not have run, so it can be run again without the worker.
+
+    Parameters
+    ----------
+    reason : str
+        Always 'exit'
+    command : str
+        Command that started the worker
+
+    """
+
+    def __init__(self, message, command=None):
+        super(WorkerExit, self).__init__(message, 'exit', command)
+
+
+class WarmWorker(object):
+
+    """Long-lived tool process that receives jobs on stdin
+    and reports the result of each job on stdout.
+
+    Parameters
+    ----------
+    cmd : list
+        Argument list that starts the worker
+    name : str
+        Name of the worker, added to each logged line
+    startup : float
+        Maximum number of seconds for the worker to become ready
+    restarts : int
+        Number of times the worker has been started again
+    exits : int
+        Number of jobs during which the worker stopped
+    max_exits : int
+        Number of jobs during which the worker can stop before it is no longer used
+
+    """
+
+    def __init__(self, cmd, name, startup=600, cwd=None, log=None, max_exits=2):
+        """
+        Initializes the worker; the process is started by the first job.
+
+        :param cmd: Argument list that starts the worker
+        :param name: Name of the worker
+        :param startup: Maximum number of seconds for the worker to become ready
+        :param cwd: Working directory of the worker
+        :param log: Logger for the output of the worker; by default, the logger of this module
+        :param max_exits: Number of jobs during which the worker can stop before it is no longer used
+        """
+        self.cmd = cmd
+        self.name = name
+        self.startup = startup
+        self.cwd = cwd
+        self.log = log if log is not None else logger
+        self.restarts = -1
+        self.exits = 0
+        self.max_exits = max_exits
+        self.process = None
+        self._messages = None
+        self._jobs = 0
+        # jobs from different threads are sent to the worker one at a time
+        self._lock = threading.Lock()
+
+    def alive(self):
+        """
+        :return: True if the worker process is running
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """
+        Starts the worker process and waits until it is ready.
+
+        :return:
+        """
+        self.stop()
+        self.restarts += 1
+        self._messages = queue.Queue()
+        if sys.platform == 'win32':
+            options = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            options = {'start_new_session': True}
+        self.process = subprocess.Popen(self.cmd, cwd=self.cwd, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        universal_newlines=True, bufsize=1, **options)
+        for stream, label in [(self.process.stdout, ''), (self.process.stderr, 'stderr: ')]:
+            thread = threading.Thread(target=self._read, args=(stream, label, self._messages))
+            thread.daemon = True
+            thread.start()
+        message = self._wait(None, self.startup)
+        if message[0] != 'ready':
+            self.stop()
+            raise ToolError("Worker " + self.name + " did not start.", 'exit', self.cmd)
+        self.log.info('Started worker ' + self.name + '. ')
+
+    def request(self, args, supervisor=None):
+        """
+        Sends a job to the worker and waits for the result.
+        If the worker is not running, it is started first.
+        The limits of the job supervisor are checked while the worker runs the job;
+        if a limit is exceeded, the worker is stopped.
+        If the worker stops before it answers, a WorkerExit is raised.
+
+        :param args: List of arguments for the job
+        :param supervisor: JobSupervisor of the job
+        :return:
+        """
+        with self._lock:
+            self._request(args, supervisor)
+
+    def _request(self, args, supervisor):
+        """
+        Sends a job to the worker while holding the lock of the worker.
+
+        :param args: List of arguments for the job
+        :param supervisor: JobSupervisor of the job
+        :return:
+        """
+        if supervisor is not None:
+            supervisor.check(self.cmd)
+        if self.exits >= self.max_exits:
+            raise WorkerExit("Worker " + self.name + " stopped during " + str(self.exits) +
+                             " jobs and is no longer used.", self.cmd)
+        self._jobs += 1
+        job = str(self._jobs)
+        try:
+            if not self.alive():
+                self.start()
+            self.process.stdin.write('\t'.join([job] + [str(arg) for arg in args]) + '\n')
+            self.process.stdin.flush()
+            message = self._wait(supervisor, None)
+        except WorkerExit:
+            self.exits += 1
+            self.stop()
+            raise
+        except ToolError:
+            self.stop(kill=True)
+            raise
+        except (BrokenPipeError, OSError):
+            self.exits += 1
+            self.stop()
+            raise WorkerExit("Worker " + self.name + " stopped unexpectedly.", self.cmd)
+        if message[0] != job:
+            self.stop()
+            raise ToolError("Worker " + self.name + " answered the wrong job.", 'exit', self.cmd)
+        if message[1] != 'ok':
+            raise ToolError("Worker " + self.name + " failed: " + ' '.join(message[2:]), 'exit', self.cmd)
+
+    def stop(self, kill=False):
+        """
+        Stops the worker by closing its stdin,
+        and kills it if it does not stop.
+
+        :param kill: If True, kills the worker without waiting
+        :return:
+        """
+        if self.process is None:
+            return
+        if not kill:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        if self.process.poll() is None:
+            kill_tree(self.process.pid)
+            self.process.wait()
+        self.process = None
+
+    def _wait(self, supervisor, timeout):
+        """
+        Waits for a protocol message from the worker.
+
+        :param supervisor: JobSupervisor that checks the limits of the job, or None
+        :param timeout: Maximum number of seconds to wait, or None
+        :return: List of message fields
+        """
+        interval = supervisor.interval if supervisor is not None else 0.5
+        waited = 0
+        while True:
+            try:
+                return self._messages.get(timeout=interval)
+            except queue.Empty:
+                pass
+            if supervisor is not None:
+                supervisor.check(self.cmd, self.process)
+            if self.process.poll() is not None and self._messages.empty():
+                raise WorkerExit("Worker " + self.name + " exited with code " +
+                                 str(self.process.returncode) + ".", self.cmd)
+            waited += interval
+            if timeout is not None and waited > timeout:
+                raise ToolError("Worker " + self.name + " did not respond.", 'timeout', self.cmd)
+
+    def _read(self, stream, label, messages):
+        """
+        Reads the output of the worker in a separate thread.
+        Protocol messages are queued, other lines are logged.
+
+        :param stream: stdout or stderr of the worker
+        :param label: Label added to logged lines
+        :param messages: Queue for protocol messages
+        :return:
+        """
+        for line in stream:
+            line = line.rstrip('\r\n')
+            fields = line.split('\t')
+            if fields[0] == MARKER and len(fields) > 1:
+                messages.put(fields[1:])
+            else:
+                self.log.info('[' + self.name + '] ' + label + line)
+
+
+# warm workers of this process, by name
+_workers = dict()
+_workers_lock = threading.Lock()
+
+
+def get_worker(name, cmd, log=None):
+    """
+    Returns the warm worker with a name, creating it if necessary.
+    Workers are stopped when the process exits.
+
+    :param name: Name of the worker
+    :param cmd: Argument list that starts the worker
+    :param log: Logger for the output of the worker
+    :return: WarmWorker
+    """
+    with _workers_lock:
+        if name not in _workers or _workers[name].cmd != cmd:
+            if name in _workers:
+                _workers[name].stop()
+            else:
+                # pool workers exit without running atexit handlers, but with finalizers
+                Finalize(None, stop_workers, exitpriority=10)
+            _workers[name] = WarmWorker(cmd, name, log=log)
+        return _workers[name]
+
+
+def run_warm(worker, requests, supervisor, cold):
+    """
+    Runs a job as one or more requests to a warm worker.
+    If the worker stops before it answers, the job is run again with a cold start instead,
+    e.g. with the script that starts the tool for each job.
+
+    :param worker: WarmWorker, or None to only run the cold start
+    :param requests: List of argument lists, sent to the worker in order
+    :param supervisor: JobSupervisor of the job
+    :param cold: Function without arguments that runs the job without the worker
+    :return:
+    """
+    if worker is not None:
+        try:
+            for args in requests:
+                worker.request(args, supervisor)
+            return
+        except WorkerExit as e:
+            worker.log.warning(str(e) + ' Running the job without the worker. ')
+    cold()
+
+
+def stop_workers():
+    """
+    Stops all warm workers of this process.
+
+    :return:
+    """
+    for name in list(_workers):
+        _workers.pop(name).stop()
+
+
+def worker_script(name):
+    """
+    :param name: Filename of worker script
+    :return: Filepath to worker script in the massoc data folder
+    """
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', name)
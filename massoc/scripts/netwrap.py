@@ -40,18 +40,33 @@ __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
 import ast
+import asyncio
 import csv
 import statistics
-import massoc
+import json
+import mmap
+import pickle
+import tempfile
+import traceback
 import biom
 import networkx as nx
-import pandas
+import numpy
 import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from functools import partial
+from time import sleep, time
 from massoc.scripts.batch import Batch
+from massoc.scripts.netarray import read_triplets, NetArray, consensus, isin_sorted
+from massoc.scripts.netcache import NetCache
+from massoc.scripts.netcorr import CorrStats, stats_path, correlation_network, rho_cutoff, edge_number_network
+from massoc.scripts.netsweep import EdgeScores, scores_path
+from massoc.scripts.netstable import EdgeStability
+from massoc.scripts.netexec import JobSupervisor, ToolError, cancel_path, clear_cancel, scratch_root
+from massoc.scripts.networker import get_worker, run_warm, worker_script
+from massoc.scripts.netqueue import FileQueue, work
 import multiprocessing as mp
-from functools import partial
-from subprocess import call
 import os
 import logging.handlers
 
@@ -66,6 +81,13 @@ sh.setFormatter(formatter)
 logger.addHandler(sh)
 
 
+# names of all network inference tools, used as prefix of network names
+_tools = ['sparcc', 'conet', 'spiec-easi', 'pearson', 'spearman', 'rho']
+
+# tools that run as external programs
+_external_tools = ['sparcc', 'conet', 'spiec-easi']
+
+
 class Nets(Batch):
 
     """Container for multiple network files.
@@ -92,7 +114,9 @@ class Nets(Batch):
         Dictionary of phylum-agglomerated biom files
 
     networks: dict
-        Dictionary of network files
+        Dictionary of networks stored as NetArray objects
+    checkpoints: dict
+        Networks that are stored in the output folder as HDF5 files, by name
 
     """
 
@@ -120,6 +144,8 @@ class Nets(Batch):
                 otu[value] = otutab
             self.otu = otu
         self.networks = dict()
+        self.checkpoints = dict()
+        self._id_index = None
         if self.inputs:
             _create_logger(self.inputs['fp'])
         if type(self.otu) is not dict:
@@ -127,16 +153,49 @@ class Nets(Batch):
             raise ValueError("Please supply a dictionary of biom files.")
 
 
-    def write_networks(self):
+    def get_network(self, name):
+        """
+        Returns a network as NetworkX object.
+        Networks are stored as NetArray objects and only converted when requested.
+
+        :param name: Network name
+        :return: NetworkX object
+        """
+        network = self.networks[name]
+        if isinstance(network, NetArray):
+            network = network.to_networkx()
+        return network
+
+    def write_networks(self, fmt='h5'):
         """
-        Writes all networks in a Nets file to graphml files.
+        Writes all networks in a Nets file to disk.
+        By default, networks are written to binary HDF5 files,
+        which are read by the other massoc steps.
+        Networks that were written as checkpoints during network inference
+        and have not been replaced since are not written again.
+        Weighted edge lists and graphml files can be written for use in other software.
+        Files are written to a temporary file first and then replace the existing file.
 
+        :param fmt: Format for writing; 'h5', 'txt' or 'graphml'.
         :return:
         """
         try:
             for network in self.networks:
-                path = self.inputs['fp'] + '/' + network + '.txt'
-                nx.write_weighted_edgelist(G=self.networks[network], path=path)
+                path = self.inputs['fp'] + '/' + network + '.' + fmt
+                netarray = self.networks[network]
+                if fmt == 'h5' and self.checkpoints.get(network) is netarray and os.path.isfile(path):
+                    continue
+                if not isinstance(netarray, NetArray):
+                    netarray = NetArray.from_networkx(netarray)
+                if fmt == 'h5':
+                    netarray.write_hdf5(path)
+                elif fmt == 'txt':
+                    _write_atomic(path, netarray.write_edgelist)
+                elif fmt == 'graphml':
+                    graph = self.get_network(network)
+                    _write_atomic(path, lambda temp: nx.write_graphml(graph, temp))
+                else:
+                    raise ValueError("Please specify h5, txt or graphml as network format.")
         except Exception:
             logger.error("Unable to write networks to disk. ", exc_info=True)
 
@@ -145,30 +204,94 @@ class Nets(Batch):
         In case users want to manually import a network,
         this function adds the network file to the Nets object and checks
         whether the identifiers specified in the file match those in included BIOM files.
+        The identifiers of the BIOM files are indexed once,
+        so importing many networks does not require repeated searches through all identifiers.
         Currently, only edge lists are supported.
 
-        :param network: NetworkX object
+        :param network: NetworkX or NetArray object
         :param name: Network name
-        :return:
+        :return: Dictionary with number of nodes, matched nodes per taxonomic level and unmatched nodes
         """
         try:
             network_nodes = list(network.nodes)
-        except TypeError:
+        except (TypeError, AttributeError):
             logger.error("Unable to read edge list. ", exc_info=True)
-        taxon_ids = list()
+            return
+        report = {'nodes': len(network_nodes), 'matched': dict(), 'unmatched': list()}
         if len(self.otu) > 0:
-            biomfiles = [self.otu, self.species, self.genus,
-                         self.family, self.order, self.class_, self.phylum]
-            biomlist = list()
-            for subset in biomfiles:
-                for file in subset:
-                    biomlist.append(subset[file])
-            for biomfile in biomlist:
-                taxon_ids.extend(list(biomfile.ids(axis='observation')))
-            missing_node = any(x not in taxon_ids for x in network_nodes)
-            if missing_node:
-                logger.error("Imported network node not found in taxon identifiers. ", exc_info=True)
+            nodes = numpy.array([str(node) for node in network_nodes])
+            found = numpy.zeros(len(nodes), dtype=bool)
+            index = self._get_id_index()
+            for level in index:
+                matched = isin_sorted(nodes, index[level])
+                report['matched'][level] = int(matched.sum())
+                found |= matched
+            report['unmatched'] = nodes[~found].tolist()
+            if len(report['unmatched']) > 0:
+                logger.error(str(len(report['unmatched'])) + " imported network nodes of " + name +
+                             " not found in taxon identifiers: " +
+                             ", ".join(report['unmatched'][:10]) + " ")
+        if not isinstance(network, NetArray):
+            network = NetArray.from_networkx(network)
         self.networks[name] = network
+        return report
+
+    def consensus(self, thresholds=None):
+        """
+        Constructs consensus networks from the networks inferred
+        by different tools for the same taxonomic level and BIOM file.
+        Edges are included if they are present with the same sign
+        in at least the specified number of networks.
+        The consensus networks are added to the Nets object
+        as consensus-<threshold>_<level>_<name>.
+
+        :param thresholds: List of minimum numbers of networks; by default, edges need to be in all networks.
+        :return: Dictionary of consensus networks
+        """
+        groups = group_networks(self.networks)
+        results = dict()
+        for level, name in groups:
+            members = groups[(level, name)]
+            netarrays = list()
+            for network in members:
+                if isinstance(self.networks[network], NetArray):
+                    netarrays.append(self.networks[network])
+                else:
+                    netarrays.append(NetArray.from_networkx(self.networks[network]))
+            level_thresholds = thresholds
+            if not level_thresholds:
+                level_thresholds = [len(members)]
+            networks = consensus(netarrays, level_thresholds)
+            for threshold in networks:
+                network_name = 'consensus-' + str(threshold) + '_' + level + '_' + name
+                try:
+                    _add_tax(networks[threshold], self.inputs['procbioms'][level][name])
+                except (KeyError, TypeError):
+                    pass
+                results[network_name] = networks[threshold]
+                logger.info('Consensus network ' + network_name + ' has ' +
+                            str(networks[threshold].number_of_edges()) + ' edges. ')
+        self.networks.update(results)
+        return results
+
+    def _get_id_index(self):
+        """
+        Returns the observation identifiers of the BIOM files per taxonomic level,
+        as sorted arrays that can be searched with numpy.searchsorted.
+        The index is built the first time it is needed and then reused.
+
+        :return: Dictionary with taxonomic levels as keys and sorted identifier arrays as values
+        """
+        if self._id_index is None:
+            biomfiles = {'otu': self.otu, 'species': self.species, 'genus': self.genus,
+                         'family': self.family, 'order': self.order,
+                         'class': self.class_, 'phylum': self.phylum}
+            self._id_index = dict()
+            for level in biomfiles:
+                ids = [biomfiles[level][file].ids(axis='observation') for file in biomfiles[level]]
+                if len(ids) > 0:
+                    self._id_index[level] = numpy.unique(numpy.concatenate(ids).astype(str))
+        return self._id_index
 
     def _prepare_conet(self):
         """
@@ -187,20 +310,7 @@ class Nets(Batch):
             ids[x] = dict()
             obs_ids[x] = dict()
             for y in filenames[x]:
-                tempname = filenames[x][y][:-5] + '_counts_conet.txt'
-                file = biom.load_table(filenames[x][y])
-                obs_ids[x][y] = deepcopy(file._observation_ids)
-                # code below is necessary to fix an issue where CoNet cannot read numerical OTU ids
-                orig_ids = dict()
-                for i in range(len(file.ids(axis='observation'))):
-                    id = file.ids(axis='observation')[i]
-                    orig_ids[("otu-" + str(i))] = id
-                    file.ids(axis='observation')[i] = "otu_" + str(i)
-                otu = file.to_tsv()
-                text_file = open(tempname, 'w')
-                text_file.write(otu[34:])
-                text_file.close()
-                ids[x][y] = orig_ids
+                _, _, ids[x][y], obs_ids[x][y] = _prepare_inputs((filenames[x][y], ['conet_table']))
         return ids, obs_ids
 
     def _prepare_spar(self):
@@ -216,24 +326,128 @@ class Nets(Batch):
         filenames = self.get_filenames()
         for x in filenames:
             for y in filenames[x]:
-                file = biom.load_table(filenames[x][y])
-                otu = file.to_tsv()
-                tempname = filenames[x][y][:-5] + '_otus_sparcc.txt'
-                text_file = open(tempname, 'w')
-                text_file.write(otu[29:])
-                text_file.close()
+                _prepare_inputs((filenames[x][y], ['sparcc_table']))
+
+
+def _prepare_inputs(item):
+    """
+    Loads a BIOM file once and writes the inputs of all tools that need it.
+    Each row of counts is formatted once and written to every count table;
+    only the first column and header differ between the tools.
+    CoNet cannot read numerical OTU ids, so its table uses otu_0, otu_1, ...
+    and the original ids are returned to translate the network back.
+
+    :param item: Tuple of the location of the BIOM file and list of task kinds
+    :return: Tuple of location, taxonomy (or None), original OTU ids and OTU ids (or None)
+    """
+    filename, kinds = item
+    table = biom.load_table(filename)
+    obs_ids = table.ids(axis='observation')
+    samples = '\t'.join([str(sample) for sample in table.ids(axis='sample')])
+    tables = list()
+    if 'sparcc_table' in kinds:
+        tables.append((open(filename[:-5] + '_otus_sparcc.txt', 'w'), '#OTU ID', False))
+    if 'conet_table' in kinds:
+        tables.append((open(filename[:-5] + '_counts_conet.txt', 'w'), 'ID', True))
+    try:
+        for file, column, _ in tables:
+            file.write(column + '\t' + samples + '\n')
+        if len(tables) > 0:
+            for i, values in enumerate(table.iter_data(axis='observation', dense=True)):
+                row = '\t'.join(map(str, values)) + '\n'
+                for file, _, numbered in tables:
+                    file.write(('otu_' + str(i) if numbered else str(obs_ids[i])) + '\t' + row)
+    finally:
+        for file, _, _ in tables:
+            file.close()
+    orig_ids = None
+    ids = None
+    if 'conet_table' in kinds:
+        orig_ids = {('otu-' + str(i)): obs_ids[i] for i in range(len(obs_ids))}
+        ids = deepcopy(obs_ids)
+    taxonomy = None
+    if 'taxonomy' in kinds:
+        taxonomy = _table_taxonomy(table)
+    return filename, taxonomy, orig_ids, ids
+
+
+def group_networks(names):
+    """
+    Groups inferred networks by taxonomic level and BIOM file,
+    using the tool_level_name format of network names.
+    Other networks are ignored.
+
+    :param names: List of network names or filepaths
+    :return: Dictionary with (level, name) tuples as keys and lists of network names as values
+    """
+    groups = dict()
+    for network in names:
+        basename = os.path.basename(network).split('.')[0]
+        parts = basename.split('_', 2)
+        if len(parts) == 3 and parts[0] in _tools:
+            groups.setdefault((parts[1], parts[2]), list()).append(network)
+    return groups
+
 
 def _add_tax(network, file):
     """
     Adds taxon names from filename.
+    The taxonomy of each file is only read once per run,
+    and all ranks are added to the network in a single call.
 
-    :param network: NetworkX object
+    :param network: NetArray or NetworkX object
     :param file: File with taxonomy
     :return: Taxonomically annotated network
     """
-    file = biom.load_table(file)
-    tax = file._observation_metadata
+    if isinstance(network, NetArray):
+        network.set_node_attributes(_get_taxonomy(file))
+    else:
+        nx.set_node_attributes(network, values=_get_taxonomy(file))
+    return network
+
+
+# taxonomy per BIOM file, shared with the workers by run_parallel
+_taxonomy = dict()
+
+
+def _get_taxonomy(file):
+    """
+    Returns the taxonomy of a BIOM file from the taxonomy cache,
+    reading the file only if it is not in the cache yet.
+
+    :param file: File with taxonomy
+    :return: Dictionary with node names as keys and dictionaries of ranks as values
+    """
+    if file not in _taxonomy:
+        _taxonomy[file] = _read_taxonomy(file)
+    return _taxonomy[file]
+
+
+def _read_taxonomy(file):
+    """
+    Reads the taxonomy of a BIOM file.
+
+    :param file: File with taxonomy
+    :return: Dictionary with node names as keys and dictionaries of ranks as values
+    """
+    try:
+        table = biom.load_table(file)
+    except Exception:
+        logger.error("Unable to collect taxonomy for agglomerated files. ", exc_info=True)
+        return dict()
+    return _table_taxonomy(table)
+
+
+def _table_taxonomy(file):
+    """
+    Collects the taxonomy of a BIOM file that is already loaded.
+
+    :param file: BIOM file
+    :return: Dictionary with node names as keys and dictionaries of ranks as values
+    """
+    taxonomy = dict()
     try:
+        tax = file._observation_metadata
         if tax is not None:
             for species in tax:
                 species.pop('Genus (Aggregated)', None)
@@ -246,20 +460,59 @@ def _add_tax(network, file):
                 taxdict[name] = taxnames[i]
                 i = i + 1
             tax = tax.rename(index=str, columns=taxdict)
-            for column in tax.columns:
-                taxdict = tax[column].to_dict()
-                nx.set_node_attributes(network, values=taxdict, name=column)
+            taxonomy = tax.to_dict(orient='index')
     except Exception:
         logger.error("Unable to collect taxonomy for agglomerated files. ", exc_info=True)
-    return network
+    return taxonomy
+
+
+def _conet_arguments(script, input, output, prefix, guessingparam):
+    """
+    Returns the CooccurrenceAnalyser arguments of the calls in a CoNet script,
+    so they can be sent to a warm CoNet worker.
+    The script is the only definition of the CoNet settings,
+    so a warm worker runs the same calls as the script.
+
+    :param script: Filepath to CoNet script
+    :param input: Filepath to CoNet count table
+    :param output: Filepath to CoNet network
+    :param prefix: Prefix of threshold and permutation files
+    :param guessingparam: Number of edges for threshold guessing
+    :return: List of argument lists
+    """
+    values = {'$1': input, '$2': output, '$5': guessingparam,
+              '$thresh': prefix + '_threshold', '$perm': prefix + '_permnet'}
+    calls = list()
+    with open(script, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) > 2 and fields[0] == 'java' and fields[1].endswith('.CooccurrenceAnalyser'):
+                calls.append([values.get(field, field) for field in fields[2:]])
+    return calls
+
+
+def _runs_warm(settings, default):
+    """
+    Warm workers use the settings of the scripts included with massoc,
+    so they are only used if no other script was supplied.
+
+    :param settings: Filepath to script supplied by the user, or None
+    :param default: Filename of script included with massoc
+    :return: True if the tool can run in a warm worker
+    """
+    if not settings:
+        return True
+    return os.path.basename(settings.replace('\\', '/')).lower() == default.lower()
 
 
-def run_conet(filenames, conet, orig_ids, obs_ids, settings=None):
+def run_conet(filenames, conet, orig_ids, obs_ids, settings=None, supervisor=None, warm=False):
     """
     Runs a Bash script containing the CoNet Bash commands.
-    Unfortunately, errors produced by CoNet cannot be caught,
-    because the exit status of the script is 0 regardless
-    of CoNet producing a network or not.
+    The exit status of the script is 0 regardless
+    of CoNet producing a network or not,
+    so the job fails if the network file is not written.
+    With warm set to True, the commands are sent to a CoNet worker
+    that keeps the JVM running between jobs instead.
     conet = nets.inputs['conet']
 
     :param filenames: Location of BIOM files written to disk.
@@ -267,8 +520,13 @@ def run_conet(filenames, conet, orig_ids, obs_ids, settings=None):
     :param orig_ids: OTU ids before annotation
     :param obs_ids: OTU ids with forbidden characters removed
     :param settings: Dictionary containing settings for CoNet
-    :return: CoNet networks as NetworkX objects
+    :param supervisor: JobSupervisor that enforces time and memory limits
+    :param warm: If True, runs CoNet in a warm worker
+    :return: CoNet networks as NetArray objects
     """
+    if supervisor is None:
+        supervisor = JobSupervisor()
+    worker = None
     if settings:
         path = settings
         if path[-3:] != '.sh':
@@ -277,94 +535,118 @@ def run_conet(filenames, conet, orig_ids, obs_ids, settings=None):
 
     else:
         path = resource_path('CoNet.sh')
-    path = path.replace('\\', '/')
+    # tools run in a scratch folder, so relative paths are resolved first
+    path = os.path.abspath(path.replace('\\', '/'))
     libpath = conet + '\\lib\\CoNet.jar'
-    libpath = libpath.replace('\\', '/')
+    libpath = os.path.abspath(libpath.replace('\\', '/'))
+    if warm and _runs_warm(settings, 'CoNet.sh'):
+        worker = get_worker('conet', ['java', '-cp', libpath, worker_script('CoNetWorker.java')],
+                            log=supervisor.log)
     results = dict()
     for x in filenames:
         for y in filenames[x]:
-            graphname = filenames[x][y][:-5] + '_conet.tsv'
-            tempname = filenames[x][y][:-5] + '_counts_conet.txt'
-            # Code below removed because taxonomic information is not necessary
-            # tax = file._observation_metadata
-            # for species in tax:
-            #    species.pop('Genus (Aggregated)', None)
-            #    species.pop('collapsed_ids', None)
-            # tax = file.metadata_to_dataframe('observation')
-            # num = tax.shape[1]
-            # for i in range(num, 7):
-            #    level = 'taxonomy_' + str(i)
-            #    tax[level] = 'Merged'
-            #tax.to_csv(taxname, sep="\t")
-            #f = open(taxname, 'r')
-            #lines = f.read()
-            #f.close()
-            #lines = 'id' + lines
-            #f = open(taxname, 'w')
-            #f.write(lines)
-            #f.close()
-            # solving issue where guessingparam is higher than maximum edge number
-            n_otus = len(orig_ids[x][y])
-            guessingparam = str(n_otus * n_otus -1)
-            if int(guessingparam) > 1000:
-                guessingparam = str(1000)
-            cmd = path + ' ' + tempname + ' ' + ' ' + graphname + ' ' + libpath + \
-                  ' ' + resource_path("") + str(x) + '_' + str(y) + ' ' + guessingparam
-            call(cmd, shell=True)
-            call("rm " + tempname, shell=True)
-            call("rm " + resource_path("") + str(x) + '_' + str(y) + "_threshold", shell=True)
-            call("rm " + resource_path("") + str(x) + '_' + str(y) + "_permnet", shell=True)
-            try:
-                with open(graphname, 'r') as fin:
-                    data = fin.read().splitlines(True)
-                    fin.close()
-                with open(graphname, 'w') as fout:
-                    fout.writelines(data[2:])
-                    fout.close()
-            except FileNotFoundError:
-                logger.error("Warning: CoNet did not complete network inference on: " + str(x) + "_" + str(y) + ' ', exc_info=True)
-            signs = [b[0] for b in csv.reader(open(graphname, 'r'), delimiter='\t')]
-            signs = [word.replace('mutualExclusion', '-1') for word in signs]
-            signs = [word.replace('copresence', '1') for word in signs]
-            signs = [word.replace('unknown', 'None') for word in signs]
-            signs = [ast.literal_eval(b) for b in signs]
-            clean_signs = list()  # None values need to be removed to make sure median is not 0.5.
-            for sublist in signs:
-                cleaned = [elem for elem in sublist if elem is not None]
-                clean_signs.append(cleaned)
-            signs = [statistics.median(x) for x in clean_signs]
-            # methods = [x[2] for x in csv.reader(open(graphname, 'r'), delimiter='\t')]
-            names = [b[15] for b in csv.reader(open(graphname, 'r'), delimiter='\t')]
-            names = [b.split('->') for b in names]
-            new_names = list()
-            for item in names:
-                new_item = [y.replace(y, orig_ids[x][y][b]) for b in item]
-                new_names.append(new_item)
-            i = 0
-            adj = pandas.DataFrame(index=obs_ids[x][y], columns=obs_ids[x][y])
-            adj = adj.fillna(0)
-            for name in new_names:
-                id1 = adj.columns.get_loc(name[0])
-                id2 = adj.columns.get_loc(name[1])
-                sign = signs[i]
-                i = i+1
-                adj.iloc[id1, id2] = sign
-                adj.iloc[id2, id1] = sign
-            net = nx.from_pandas_adjacency(adj)
-            net = _add_tax(net, filenames[x][y])
-            results[("conet_" + x + "_" + y)] = net
-            call("rm " + graphname, shell=True)
+            with supervisor.scratch_dir('conet_' + x + '_' + y) as scratch:
+                graphname = os.path.join(scratch, 'conet.tsv')
+                tempname = os.path.abspath(filenames[x][y][:-5] + '_counts_conet.txt')
+                # Code below removed because taxonomic information is not necessary
+                # tax = file._observation_metadata
+                # for species in tax:
+                #    species.pop('Genus (Aggregated)', None)
+                #    species.pop('collapsed_ids', None)
+                # tax = file.metadata_to_dataframe('observation')
+                # num = tax.shape[1]
+                # for i in range(num, 7):
+                #    level = 'taxonomy_' + str(i)
+                #    tax[level] = 'Merged'
+                #tax.to_csv(taxname, sep="\t")
+                #f = open(taxname, 'r')
+                #lines = f.read()
+                #f.close()
+                #lines = 'id' + lines
+                #f = open(taxname, 'w')
+                #f.write(lines)
+                #f.close()
+                # solving issue where guessingparam is higher than maximum edge number
+                n_otus = len(orig_ids[x][y])
+                guessingparam = str(n_otus * n_otus -1)
+                if int(guessingparam) > 1000:
+                    guessingparam = str(1000)
+                # threshold and permutation files are written to the scratch directory
+                prefix = os.path.join(scratch, str(x) + '_' + str(y))
+                cmd = [path, tempname, graphname, libpath, prefix, guessingparam]
+                requests = list()
+                if worker is not None:
+                    # the warm worker runs the calls of the same script
+                    script = path if os.path.isfile(path) else worker_script('CoNet.sh')
+                    requests = _conet_arguments(script, tempname, graphname, prefix, guessingparam)
+                run_warm(worker, requests, supervisor,
+                         partial(supervisor.run, cmd, cwd=scratch, tag='conet_' + x + '_' + y,
+                                 artifacts=[graphname]))
+                if not os.path.isfile(graphname):
+                    raise ToolError("CoNet did not write " + graphname + ".", 'output', cmd)
+                _remove_file(tempname)
+                try:
+                    with open(graphname, 'r') as fin:
+                        data = fin.read().splitlines(True)
+                        fin.close()
+                    with open(graphname, 'w') as fout:
+                        fout.writelines(data[2:])
+                        fout.close()
+                except FileNotFoundError:
+                    logger.error("Warning: CoNet did not complete network inference on: " + str(x) + "_" + str(y) + ' ', exc_info=True)
+                signs = [b[0] for b in csv.reader(open(graphname, 'r'), delimiter='\t')]
+                signs = [word.replace('mutualExclusion', '-1') for word in signs]
+                signs = [word.replace('copresence', '1') for word in signs]
+                signs = [word.replace('unknown', 'None') for word in signs]
+                signs = [ast.literal_eval(b) for b in signs]
+                clean_signs = list()  # None values need to be removed to make sure median is not 0.5.
+                for sublist in signs:
+                    cleaned = [elem for elem in sublist if elem is not None]
+                    clean_signs.append(cleaned)
+                signs = [statistics.median(x) for x in clean_signs]
+                # methods = [x[2] for x in csv.reader(open(graphname, 'r'), delimiter='\t')]
+                names = [b[15] for b in csv.reader(open(graphname, 'r'), delimiter='\t')]
+                names = [b.split('->') for b in names]
+                new_names = list()
+                for item in names:
+                    new_item = [y.replace(y, orig_ids[x][y][b]) for b in item]
+                    new_names.append(new_item)
+                # edges are stored as COO triplets instead of a dense adjacency matrix
+                nodes = list(obs_ids[x][y])
+                node_index = {node: i for i, node in enumerate(nodes)}
+                edges = dict()
+                for name, sign in zip(new_names, signs):
+                    id1 = node_index[name[0]]
+                    id2 = node_index[name[1]]
+                    edges[(min(id1, id2), max(id1, id2))] = sign
+                edges = {key: edges[key] for key in edges if edges[key] != 0}
+                rows = numpy.array([key[0] for key in edges], dtype=numpy.int32)
+                cols = numpy.array([key[1] for key in edges], dtype=numpy.int32)
+                weights = numpy.array(list(edges.values()), dtype=float)
+                net = NetArray(nodes, rows, cols, weights)
+                net = _add_tax(net, filenames[x][y])
+                results[("conet_" + x + "_" + y)] = net
     return results
 
 
-def run_spiec(filenames, settings=None):
+def run_spiec(filenames, settings=None, supervisor=None, warm=False):
     """
     Runs a R executable containing settings for SPIEC-EASI network inference.
+    With warm set to True, the networks are inferred by a SPIEC-EASI worker
+    that keeps R and the packages loaded between jobs instead.
 
     :param filenames: Location of BIOM files written to disk.
     :param settings: Dictionary containing settings for SPIEC-EASI
-    :return: SPIEC-EASI networks as NetworkX objects
+    :param supervisor: JobSupervisor that enforces time and memory limits
+    :param warm: If True, runs SPIEC-EASI in a warm worker
+    :return: SPIEC-EASI networks as NetArray objects
     """
+    if supervisor is None:
+        supervisor = JobSupervisor()
+    worker = None
+    if warm and _runs_warm(settings, 'spieceasi.R'):
+        worker = get_worker('spiec-easi', ['Rscript', worker_script('spieceasi_worker.R')],
+                            log=supervisor.log)
     results = dict()
     if settings:
         path = settings
@@ -373,92 +655,318 @@ def run_spiec(filenames, settings=None):
             raise ValueError("Please supply an R executable to run SPIEC-EASI.")
     else:
         path = resource_path('spieceasi.r')
-    path = path.replace('\\', '/')
+    # tools run in a scratch folder, so relative paths are resolved first
+    path = os.path.abspath(path.replace('\\', '/'))
     for x in filenames:
         for y in filenames[x]:
-            graphname = filenames[x][y][:-5] + '_spiec'
-            cmd = "Rscript " + path + " -i " + filenames[x][y] + " -o " + graphname
-            call(cmd, shell=True)
-            try:
-                corrtab = pandas.read_csv(graphname, sep='\t', index_col=0)
-            except FileNotFoundError:
-                logger.error("Warning: SPIEC-EASI did not complete network inference. " + str(x) + "_" + str(y) + ' ', exc_info=True)
-                exit(1)
-            corrtab.columns = corrtab.index
-            corrtab[corrtab > 0] = 1
-            corrtab[corrtab < 0] = -1
-            net = nx.from_pandas_adjacency(corrtab)
+            with supervisor.scratch_dir('spiec-easi_' + x + '_' + y) as scratch:
+                graphname = os.path.join(scratch, 'spiec')
+                cmd = ['Rscript', path, '-i', os.path.abspath(filenames[x][y]), '-o', graphname]
+                run_warm(worker, [[os.path.abspath(filenames[x][y]), graphname]], supervisor,
+                         partial(supervisor.run, cmd, cwd=scratch, tag='spiec-easi_' + x + '_' + y,
+                                 artifacts=[graphname]))
+                try:
+                    nodes, rows, cols, weights = read_triplets(graphname)
+                except FileNotFoundError:
+                    logger.error("Warning: SPIEC-EASI did not complete network inference. " + str(x) + "_" + str(y) + ' ', exc_info=True)
+                    exit(1)
+            net = NetArray(nodes, rows, cols, numpy.sign(weights))
             net = _add_tax(net, filenames[x][y])
             results[("spiec-easi_" + x + "_" + y)] = net
-            call("rm " + graphname, shell=True)
     return results
 
 
-def run_spar(filenames, spar, boots=100, pval_threshold=0.001):
+def run_spar(filenames, spar, boots=100, pval_threshold=0.001, supervisor=None, sweep=None):
     """
     Runs python 2.7 SparCC code.
     spar = nets.inputs['spar'][0]
+    If a sweep folder is given, the correlations and pseudo p-values of all pairs
+    are written to that folder, so networks at other thresholds can be derived later.
 
     :param filenames: Location of BIOM files written to disk.
     :param spar: Location of SparCC Python code
     :param boots: Number of bootstraps
     :param pval_threshold: p-value threshold for SparCC
-    :return: SparCC networks as NetworkX objects
+    :param supervisor: JobSupervisor that enforces time and memory limits
+    :param sweep: Folder for writing scores of all pairs
+    :return: SparCC networks as NetArray objects
     """
+    if supervisor is None:
+        supervisor = JobSupervisor()
     path = list()
     path.append(spar + '\\SparCC.py')
     path.append(spar + '\\MakeBootstraps.py')
     path.append(spar + '\\PseudoPvals.py')
-    path = [x.replace('\\', '/') for x in path]
+    # tools run in a scratch folder, so relative paths are resolved first
+    path = [os.path.abspath(x.replace('\\', '/')) for x in path]
     results = dict()
     for x in filenames:
         for y in filenames[x]:
-            tempname = filenames[x][y][:-5] + '_otus_sparcc.txt'
-            corrs = filenames[x][y][:-5] + '_spar_corrs.tsv'
-            cov = filenames[x][y][:-5] + '_spar_cov.tsv'
-            pvals = filenames[x][y][:-5] + '_spar_pvals.tsv'
-            bootstraps = filenames[x][y][:-(5 + len(x))] + 'bootstraps'
-            cmd = "python2 " + path[0] + " " + tempname + " -i 5 " +\
-                  " --cor_file " + corrs + " --cov_file " + cov
-            call(cmd, shell=True)
-            call("mkdir " + bootstraps, shell=True)
-            n_bootstraps = str(boots)
-            cmd = "python2 " + path[1] + " " + tempname + " -n " + n_bootstraps + \
-                  " -t /permutation_#.txt -p " + bootstraps
-            call(cmd, shell=True)
-            for i in range(0, int(n_bootstraps)):
-                permpath = bootstraps + '/permutation_' + str(i) + '.txt'
-                pvalpath = bootstraps + '/perm_cor_' + str(i) + '.txt'
-                cmd = "python2 " + path[0] + " " + permpath + " -i 5 " + \
-                      " --cor_file " + pvalpath + " --cov_file " + cov
-                call(cmd, shell=True)
-            cmd = "python2 " + path[2] + ' ' + corrs + ' ' + bootstraps + \
-                  '/perm_cor_#.txt 5 -o ' + pvals + ' -t two_sided'
-            call(cmd, shell=True)
-            call("rm -rf " + bootstraps, shell=True)
-            call("rm " + tempname, shell=True)
-            call("rm " + cov, shell=True)
-            try:
-                corrtab = pandas.read_csv(corrs, sep='\t', index_col=0)
-            except FileNotFoundError:
-                logger.error("Warning: SparCC did not complete network inference. " + str(x) + "_" + str(y) + ' ', exc_info=True)
-                exit(1)
-            corrtab.columns = corrtab.index
-            pvaltab = pandas.read_csv(pvals, sep='\t', index_col=0)
-            pvaltab = pvaltab < pval_threshold  # p value threshold for SparCC pseudo p-values
-            corrtab = corrtab.where(pvaltab)
-            corrtab = corrtab.fillna(0)
-            corrtab[corrtab > 0] = 1
-            corrtab[corrtab < 0] = -1
-            net = nx.from_pandas_adjacency(corrtab)
+            tempname = os.path.abspath(filenames[x][y][:-5] + '_otus_sparcc.txt')
+            # SparCC writes cov_mat_SparCC.out to its working directory,
+            # so the scratch directory is used as working directory
+            with supervisor.scratch_dir('sparcc_' + x + '_' + y) as scratch:
+                corrs = os.path.join(scratch, 'spar_corrs.tsv')
+                cov = os.path.join(scratch, 'spar_cov.tsv')
+                pvals = os.path.join(scratch, 'spar_pvals.tsv')
+                bootstraps = os.path.join(scratch, 'bootstraps')
+                tag = 'sparcc_' + x + '_' + y
+                cmd = ['python2', path[0], tempname, '-i', '5', '--cor_file', corrs, '--cov_file', cov]
+                supervisor.run(cmd, cwd=scratch, tag=tag, artifacts=[corrs])
+                os.mkdir(bootstraps)
+                n_bootstraps = str(boots)
+                cmd = ['python2', path[1], tempname, '-n', n_bootstraps,
+                       '-t', '/permutation_#.txt', '-p', bootstraps]
+                supervisor.run(cmd, cwd=scratch, tag=tag)
+                # bootstraps are independent, so they can run at the same time;
+                # each gets its own working directory and covariance file
+                commands = list()
+                for i in range(0, int(n_bootstraps)):
+                    permpath = bootstraps + '/permutation_' + str(i) + '.txt'
+                    pvalpath = bootstraps + '/perm_cor_' + str(i) + '.txt'
+                    folder = os.path.join(bootstraps, 'run_' + str(i))
+                    os.mkdir(folder)
+                    cmd = ['python2', path[0], permpath, '-i', '5', '--cor_file', pvalpath,
+                           '--cov_file', os.path.join(folder, 'cov.txt')]
+                    commands.append({'cmd': cmd, 'cwd': folder, 'tag': tag + '_' + str(i),
+                                     'artifacts': [pvalpath]})
+                supervisor.run_many(commands)
+                cmd = ['python2', path[2], corrs, bootstraps + '/perm_cor_#.txt', '5',
+                       '-o', pvals, '-t', 'two_sided']
+                supervisor.run(cmd, cwd=scratch, tag=tag, artifacts=[pvals])
+                _remove_file(tempname)
+                try:
+                    if sweep:
+                        # scores are sorted once, the network is a prefix of the sorted pairs
+                        scores = EdgeScores.read_matrices(corrs, pvals)
+                        _write_atomic(scores_path(sweep, 'sparcc_' + x + '_' + y), scores.write_hdf5)
+                        net = scores.network(pval_threshold)
+                    else:
+                        # p value threshold for SparCC pseudo p-values
+                        nodes, rows, cols, weights = read_triplets(corrs, mask=pvals,
+                                                                   threshold=pval_threshold)
+                        net = NetArray(nodes, rows, cols, numpy.sign(weights))
+                except FileNotFoundError:
+                    logger.error("Warning: SparCC did not complete network inference. " + str(x) + "_" + str(y) + ' ', exc_info=True)
+                    exit(1)
             net = _add_tax(net, filenames[x][y])
             results[("sparcc_" + x + "_" + y)] = net
-            call("rm " + corrs + " " + pvals +
-                 " " + os.path.dirname(massoc.__file__)[:-6] +
-                 "\cov_mat_SparCC.out", shell=True)
     return results
 
 
+def run_pearson(filenames, pval_threshold=0.001, stats=None, derive=None):
+    """
+    Infers networks from Pearson correlations of clr-transformed abundances.
+    If a folder with statistics is given, statistics from a previous run
+    are updated with the samples that were added to the BIOM file,
+    and the updated statistics are written back.
+    If taxa were changed or samples were removed,
+    the statistics are computed from scratch.
+    If collapsed BIOM files are given, networks for their taxonomic levels
+    are derived from the OTU counts, summed per taxon of the collapsed file,
+    so they are the same as networks inferred from the collapsed counts.
+
+    :param filenames: Location of BIOM files written to disk.
+    :param pval_threshold: p-value threshold for correlations
+    :param stats: Folder for storing sufficient statistics
+    :param derive: Location of collapsed BIOM files of other taxonomic levels
+    :return: Pearson networks as NetArray objects
+    """
+    results = dict()
+    for x in filenames:
+        for y in filenames[x]:
+            name = 'pearson_' + x + '_' + y
+            table = biom.load_table(filenames[x][y])
+            corrstats = None
+            if stats:
+                os.makedirs(stats, exist_ok=True)
+                try:
+                    corrstats = CorrStats.read_hdf5(stats_path(stats, name))
+                except (FileNotFoundError, OSError, KeyError):
+                    pass
+            if corrstats is not None and corrstats.matches(table):
+                added = corrstats.update(table)
+                logger.info('Updated statistics for ' + name + ' with ' + str(added) + ' new samples. ')
+            else:
+                corrstats = CorrStats.from_table(table)
+            if stats:
+                _write_atomic(stats_path(stats, name), corrstats.write_hdf5)
+            net = corrstats.network(pval_threshold)
+            net = _add_tax(net, filenames[x][y])
+            results[name] = net
+            if derive:
+                for level in derive:
+                    if y not in derive[level]:
+                        continue
+                    collapsed = biom.load_table(derive[level][y])
+                    groups = [collapsed.metadata(node, axis='observation')['collapsed_ids']
+                              for node in collapsed.ids(axis='observation')]
+                    net = CorrStats.from_table(table, collapsed.ids(axis='observation'),
+                                               groups).network(pval_threshold)
+                    net = _add_tax(net, derive[level][y])
+                    results['pearson_' + level + '_' + y] = net
+    return results
+
+
+def run_correlation(filenames, method='spearman', pval_threshold=0.001, block=1000,
+                    cores=1, supervisor=None, boots=0, edges=None):
+    """
+    Infers networks from correlations of clr-transformed abundances,
+    computed in blocks of taxa so no taxa x taxa matrix is held in memory.
+    This function starts its own processes,
+    so it should not be run in a worker process.
+    If bootstraps are requested, the network is inferred again from
+    each resampled set of samples, and the stability of each edge
+    across the bootstraps is added as edge attributes.
+
+    :param filenames: Location of BIOM files written to disk.
+    :param method: Either 'pearson' or 'spearman'
+    :param pval_threshold: p-value threshold for correlations
+    :param block: Number of taxa per block
+    :param cores: Number of processes
+    :param supervisor: JobSupervisor that provides scratch directories
+    :param boots: Number of bootstraps for edge stability
+    :param edges: Number of edges; if given, replaces the p-value threshold
+    :return: Correlation networks as NetArray objects
+    """
+    if supervisor is None:
+        supervisor = JobSupervisor()
+    results = dict()
+    for x in filenames:
+        for y in filenames[x]:
+            name = method + '_' + x + '_' + y
+            table = biom.load_table(filenames[x][y])
+            with supervisor.scratch_dir(name) as scratch:
+                counts = table.matrix_data.toarray()
+                nodes = table.ids(axis='observation')
+                net = _score_network(counts, nodes, os.path.join(scratch, 'edges.h5'), scratch,
+                                     method=method, pval_threshold=pval_threshold, edges=edges,
+                                     block=block, cores=cores, name=name)
+                net = NetArray(net.nodes, net.src, net.dst, numpy.sign(net.weight))
+                if boots:
+                    stability = _bootstrap_stability(counts, nodes, scratch, boots, method=method,
+                                                     pval_threshold=pval_threshold, edges=edges,
+                                                     block=block, cores=cores)
+                    net = stability.annotate(net)
+            net = _add_tax(net, filenames[x][y])
+            results[name] = net
+    return results
+
+
+def run_rho(filenames, fdr=0.05, permutations=20, block=1000, cores=1, supervisor=None, edges=None):
+    """
+    Infers networks from proportionality (rho) of clr-transformed abundances.
+    Rho is computed from the variance of the log-ratio of two taxa,
+    so unlike correlations it is not affected by the compositional nature of the data.
+    The threshold is the smallest value of rho with a false discovery rate below fdr,
+    estimated from permutations of the data.
+    Only positive proportionality is kept, so all edges have a weight of 1.
+    Scores are computed in blocks of taxa, so this function starts its own processes
+    and should not be run in a worker process.
+
+    :param filenames: Location of BIOM files written to disk.
+    :param fdr: Maximum false discovery rate
+    :param permutations: Number of permutations for estimating the false discovery rate
+    :param block: Number of taxa per block
+    :param cores: Number of processes
+    :param supervisor: JobSupervisor that provides scratch directories
+    :param edges: Number of edges; if given, replaces the false discovery rate
+    :return: Proportionality networks as NetArray objects
+    """
+    if supervisor is None:
+        supervisor = JobSupervisor()
+    results = dict()
+    for x in filenames:
+        for y in filenames[x]:
+            name = 'rho_' + x + '_' + y
+            table = biom.load_table(filenames[x][y])
+            counts = table.matrix_data.toarray()
+            with supervisor.scratch_dir(name) as scratch:
+                if edges:
+                    net = _score_network(counts, table.ids(axis='observation'), None, scratch,
+                                         method='rho', edges=edges, block=block, cores=cores, name=name)
+                else:
+                    cutoff = rho_cutoff(counts, fdr=fdr, permutations=permutations, block=block,
+                                        cores=cores, folder=scratch)
+                    logger.info('Proportionality threshold for ' + name + ': ' + str(cutoff) + '. ')
+                    net = correlation_network(counts, table.ids(axis='observation'),
+                                              os.path.join(scratch, 'edges.h5'), method='rho',
+                                              threshold=cutoff, block=block, cores=cores, folder=scratch)
+            net = NetArray(net.nodes, net.src, net.dst, numpy.sign(net.weight))
+            net = _add_tax(net, filenames[x][y])
+            results[name] = net
+    return results
+
+
+def _score_network(counts, nodes, path, folder, method, pval_threshold=None, edges=None,
+                   block=1000, cores=1, name=None):
+    """
+    Computes a network of blocked correlations or proportionality,
+    either with a p-value threshold or with a fixed number of edges.
+
+    :param counts: Array of counts with taxa as rows and samples as columns
+    :param nodes: List of taxon names
+    :param path: Filepath for the network; not used with a number of edges
+    :param folder: Folder for temporary files
+    :param method: Either 'pearson', 'spearman' or 'rho'
+    :param pval_threshold: p-value threshold for correlations
+    :param edges: Number of edges; if given, replaces the p-value threshold
+    :param block: Number of taxa per block
+    :param cores: Number of processes
+    :param name: Network name; if given, the thresholds for the number of edges are logged
+    :return: NetArray with scores as weights
+    """
+    if edges:
+        net, lower, upper = edge_number_network(counts, nodes, int(edges), method=method,
+                                                block=block, cores=cores, folder=folder)
+        if name is not None:
+            logger.info('Score thresholds for ' + name + ': ' + str(lower) + ' and ' + str(upper) + '. ')
+        return net
+    return correlation_network(counts, nodes, path, method=method, pval_threshold=pval_threshold,
+                               block=block, cores=cores, folder=folder)
+
+
+def _bootstrap_stability(counts, nodes, scratch, boots, seed=None, **kwargs):
+    """
+    Infers a correlation network from each bootstrap of the samples
+    and adds it to the edge statistics.
+    Each bootstrap network is removed once it has been added,
+    so only one is held in memory or on disk at a time.
+
+    :param counts: Array of counts with taxa as rows and samples as columns
+    :param nodes: List of taxon names
+    :param scratch: Folder for bootstrap networks
+    :param boots: Number of bootstraps
+    :param seed: Seed for the random number generator
+    :param kwargs: Settings passed to _score_network
+    :return: EdgeStability object
+    """
+    rng = numpy.random.default_rng(seed)
+    stability = EdgeStability(nodes)
+    path = os.path.join(scratch, 'bootstrap.h5')
+    for i in range(int(boots)):
+        samples = rng.integers(0, counts.shape[1], counts.shape[1])
+        net = _score_network(counts[:, samples], nodes, path, scratch, **kwargs)
+        stability.update(net)
+        del net
+        if os.path.isfile(path):
+            os.remove(path)
+    return stability
+
+
+def _remove_file(path):
+    """
+    Removes a tool input file once the tool has finished.
+
+    :param path: Filepath
+    :return:
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
 def resource_path(relative_path):
     """
      Get absolute path to resource, works for dev and for PyInstaller.
@@ -476,111 +984,843 @@ def resource_path(relative_path):
 
 
 def run_jobs(job, spar, conet, orig_ids, obs_ids, filenames,
-             spiec_settings=None, conet_settings=None):
+             limits=None, sweep=None, stats=None, block=None, cores=1, derive=None, warm=False):
     """
     Accepts a job from a joblist to run network inference in parallel.
+    Settings of the tool are taken from the job.
 
-    :param job: dictionary of dictionary with tools as keys and taxonomic levels as second-layer keys
+    :param job: Job generated by get_joblist
     :param spar: Location of SparCC folder
     :param conet: Location of CoNet folder
     :param orig_ids: Original OTU IDs
     :param obs_ids: OTU IDs with forbidden characters removed
     :param filenames: Locations of BIOM files
-    :param spiec_settings: Location of alternative Rscript for SPIEC-EASI
-    :param conet_settings: Location of alternative Bash script for CoNet
-    :return: NetworkX networks
+    :param limits: Dictionary with time limit, memory limit, cancellation file and scratch folder for JobSupervisor
+    :param sweep: Folder for writing SparCC scores of all pairs
+    :param stats: Folder for storing sufficient statistics of in-process tools
+    :param block: Number of taxa per block for blocked correlations
+    :param cores: Number of processes for blocked correlations
+    :param derive: List of taxonomic levels derived from OTU-level counts by the Pearson job
+    :param warm: If True, runs CoNet and SPIEC-EASI in warm workers
+    :return: NetArray networks
     """
-    select_filenames = {job[0]: {job[2]: filenames[job[0]][job[2]]}}
+    if limits is None:
+        limits = dict()
+    supervisor = JobSupervisor(log=logger, **limits)
+    settings = job.settings
     # only filenames with the same taxonomic level are included
-    if 'spiec-easi' in job:
+    select_filenames = {job.level: {job.name: filenames[job.level][job.name]}}
+    if job.tool == 'spiec-easi':
         logger.info('Running SPIEC-EASI... ')
-        networks = run_spiec(select_filenames, settings=spiec_settings)
-    if 'sparcc' in job:
+        networks = run_spiec(select_filenames, settings=settings.get('settings'), supervisor=supervisor,
+                             warm=warm)
+    elif job.tool == 'sparcc':
         logger.info('Running SparCC... ')
-        if 'spar_setting' in job['sparcc']:
-            if len(job['spar_setting'][1]) == 2:
-                networks = run_spar(spar=spar, filenames=select_filenames,
-                                    boots=job['spar_setting'][1]['spar_boot'],
-                                    pval_threshold=job['spar_setting'][1]['spar_pval'])
-            else:
-                if 'spar_boot' in job['spar_setting'][1]:
-                    networks = run_spar(spar=spar, filenames=select_filenames,
-                                        boots=job['spar_setting'][1]['spar_boot'])
-                if 'spar_pval' in job['spar_setting'][1]:
-                    networks = run_spar(spar=spar, filenames=select_filenames,
-                                        pval_threshold=job['spar_setting'][1]['spar_pval'])
+        networks = run_spar(spar=spar, filenames=select_filenames,
+                            boots=settings.get('boots', 100),
+                            pval_threshold=settings.get('pval_threshold', 0.001),
+                            supervisor=supervisor, sweep=sweep)
+    elif job.tool == 'pearson':
+        logger.info('Running Pearson correlation... ')
+        if block or settings.get('boots') or settings.get('edges'):
+            # bootstraps and edge numbers are not supported by stored statistics
+            networks = run_correlation(select_filenames, method='pearson',
+                                       pval_threshold=settings.get('pval_threshold', 0.001),
+                                       block=block or 1000, cores=cores, supervisor=supervisor,
+                                       boots=settings.get('boots', 0), edges=settings.get('edges'))
         else:
-            networks = run_spar(spar=spar, filenames=select_filenames)
-    if 'conet' in job:
+            if derive and job.level == 'otu':
+                derive = {level: filenames[level] for level in derive}
+            else:
+                derive = None
+            networks = run_pearson(select_filenames, pval_threshold=settings.get('pval_threshold', 0.001),
+                                   stats=stats, derive=derive)
+    elif job.tool == 'spearman':
+        logger.info('Running Spearman correlation... ')
+        networks = run_correlation(select_filenames, method='spearman',
+                                   pval_threshold=settings.get('pval_threshold', 0.001),
+                                   block=block or 1000, cores=cores, supervisor=supervisor,
+                                   boots=settings.get('boots', 0), edges=settings.get('edges'))
+    elif job.tool == 'rho':
+        logger.info('Running proportionality... ')
+        networks = run_rho(select_filenames, fdr=settings.get('fdr', 0.05),
+                           permutations=settings.get('permutations', 20),
+                           block=block or 1000, cores=cores, supervisor=supervisor,
+                           edges=settings.get('edges'))
+    elif job.tool == 'conet':
         logger.info('Running CoNet... ')
         networks = run_conet(conet=conet, filenames=select_filenames,
-                             orig_ids=orig_ids, obs_ids=obs_ids, settings=conet_settings)
+                             orig_ids=orig_ids, obs_ids=obs_ids, settings=settings.get('settings'),
+                             supervisor=supervisor, warm=warm)
+    else:
+        raise ValueError("Unknown network inference tool: " + str(job.tool))
+    return networks
+
+
+def _run_job_safe(job, **kwargs):
+    """
+    Runs a job with run_jobs, but catches any errors.
+    This way, a failing job does not prevent the results
+    of the other jobs from being collected.
+    The network inference functions exit when a tool does not produce output,
+    so SystemExit is caught as well.
+
+    :param job: Job generated by get_joblist
+    :param kwargs: Keyword arguments for run_jobs
+    :return: Tuple of job, dictionary of networks and failure record (None if successful)
+    """
+    try:
+        return job, run_jobs(job, **kwargs), None
+    except ToolError as e:
+        logger.error('Stopped job ' + _job_name(job) + ': ' + str(e) + ' ')
+        return job, dict(), {'reason': e.reason, 'message': str(e), 'command': e.command}
+    except (Exception, SystemExit):
+        logger.error('Failed to run job: ' + _job_name(job) + ' ', exc_info=True)
+        return job, dict(), {'reason': 'error', 'message': traceback.format_exc(), 'command': None}
+
+
+# job context of a worker process, set by _init_worker
+_job_context = dict()
+
+
+def _write_context(context, folder=None):
+    """
+    Writes the context shared by all jobs to a temporary file,
+    so it is sent to each worker once instead of with every job.
+
+    :param context: Dictionary with keyword arguments for run_jobs and the taxonomy cache
+    :param folder: Folder for the temporary file
+    :return: Filepath to context file
+    """
+    handle, path = tempfile.mkstemp(prefix='massoc_context_', suffix='.pickle', dir=folder)
+    with os.fdopen(handle, 'wb') as file:
+        pickle.dump(context, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _init_worker(path):
+    """
+    Initializes a worker process by reading the job context
+    from a memory-mapped file.
+    The taxonomy cache is copied as well,
+    so workers do not need to read the BIOM files again.
+
+    :param path: Filepath to context file written by _write_context
+    :return:
+    """
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            context = pickle.loads(data)
+    _taxonomy.clear()
+    _taxonomy.update(context.pop('taxonomy'))
+    _job_context.clear()
+    _job_context.update(context)
+
+
+def _run_job_worker(job):
+    """
+    Runs a job in a worker process initialized by _init_worker.
+    Only the job itself is sent to the worker.
+
+    :param job: Job generated by get_joblist
+    :return: Tuple of job, dictionary of networks and failure record (None if successful)
+    """
+    return _run_job_safe(job, **_job_context)
+
+
+def _job_name(job):
+    """
+    Returns a name for a job that is used in the job journal.
+
+    :param job: Job generated by get_joblist
+    :return: Job name
+    """
+    return job.tool + '_' + job.level + '_' + job.name
+
+
+def _read_journal(path):
+    """
+    Reads the job journal that keeps track of completed and failed jobs.
+
+    :param path: Filepath to job journal
+    :return: Dictionary with job names as keys
+    """
+    try:
+        with open(path, 'r') as file:
+            journal = json.load(file)
+    except (FileNotFoundError, ValueError):
+        journal = dict()
+    return journal
+
+
+def _write_atomic(path, write):
+    """
+    Writes a file by first writing to a temporary file in the same folder,
+    and then replacing the original file.
+    If massoc is killed while writing, the previous file is left intact.
+
+    :param path: Filepath
+    :param write: Function that accepts a filepath and writes to it
+    :return:
+    """
+    handle, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    os.close(handle)
+    try:
+        write(temp)
+        os.replace(temp, path)
+    finally:
+        if os.path.isfile(temp):
+            os.remove(temp)
+
+
+def _write_journal(path, journal):
+    """
+    Writes the job journal to disk.
+
+    :param path: Filepath to job journal
+    :param journal: Dictionary with job names as keys
+    :return:
+    """
+    def write(temp):
+        with open(temp, 'w') as file:
+            file.write(json.dumps(journal))
+    _write_atomic(path, write)
+
+
+def _write_checkpoint(filepath, name, network):
+    """
+    Writes a network to the output folder as soon as it has been inferred.
+
+    :param filepath: Output folder
+    :param name: Network name
+    :param network: NetArray object
+    :return:
+    """
+    network.write_hdf5(filepath + '/' + name + '.h5')
+
+
+def _read_checkpoints(nets, job, names):
+    """
+    Reads the networks of a job from the output folder.
+    Networks are loaded into memory, as the files can be replaced
+    by other workers or by write_networks.
+
+    :param nets: Nets object
+    :param job: Job generated by get_joblist
+    :param names: List of network names
+    :return: Dictionary with network names as keys and NetArray objects as values
+    """
+    networks = dict()
+    for network in names:
+        path = nets.inputs['fp'] + '/' + network + '.h5'
+        # jobs can return networks for other taxonomic levels
+        level = network.split('_', 2)[1]
+        networks[network] = _add_tax(NetArray.read_hdf5(path, mmap=False), nets.inputs['procbioms'][level][job.name])
     return networks
 
 
+def _resume_jobs(nets, jobs, journal):
+    """
+    Reads networks of jobs that were completed in a previous run
+    and returns only the jobs that still need to be run.
+    The networks are loaded into memory, so write_networks can
+    replace their checkpoints in the same output folder.
+
+    :param nets: Nets object
+    :param jobs: List of jobs generated by get_joblist
+    :param journal: Dictionary with job names as keys
+    :return: Jobs that were not completed
+    """
+    remaining = list()
+    for job in jobs:
+        entry = journal.get(_job_name(job))
+        completed = entry is not None and entry['status'] == 'completed'
+        if completed:
+            paths = [nets.inputs['fp'] + '/' + network + '.h5' for network in entry['networks']]
+            completed = all([os.path.isfile(path) for path in paths])
+        if completed:
+            networks = _read_checkpoints(nets, job, entry['networks'])
+            nets.networks.update(networks)
+            nets.checkpoints.update(networks)
+            logger.info('Resumed ' + _job_name(job) + ' from previous run. ')
+        else:
+            remaining.append(job)
+    return remaining
+
+
+class Job(namedtuple('Job', ['level', 'tool', 'name', 'params', 'requires'])):
+
+    """Network inference job for one tool, taxonomic level and BIOM file.
+    Jobs are tuples, so they can be sent to worker processes and compared.
+
+    Parameters
+    ----------
+    level : str
+        Taxonomic level
+    tool : str
+        Network inference tool
+    name : str
+        Name of the BIOM file
+    params : tuple
+        Settings of the tool as sorted (key, value) pairs
+    requires : tuple
+        Tasks that need to be carried out before the job can run
+
+    """
+
+    __slots__ = ()
+
+    @property
+    def settings(self):
+        """
+        :return: Dictionary with the settings of the tool
+        """
+        return dict(self.params)
+
+
+# task that prepares the BIOM file of a level and name for one or more jobs;
+# kind is 'taxonomy', 'conet_table' or 'sparcc_table'
+Task = namedtuple('Task', ['kind', 'level', 'name'])
+
+
+def _first(value):
+    """
+    Settings read from a settings file or the GUI can be lists.
+
+    :param value: Setting
+    :return: First value of a list, or the setting itself
+    """
+    if type(value) is list:
+        return value[0] if len(value) > 0 else None
+    return value
+
+
+def _tool_params(inputs, tool):
+    """
+    Collects the settings of a tool from the inputs.
+    Only settings that were supplied are included,
+    so the tool uses its default for the others.
+
+    :param inputs: Dictionary of inputs
+    :param tool: Network inference tool
+    :return: Tuple of sorted (key, value) pairs
+    """
+    if tool == 'sparcc':
+        params = {'boots': _first(inputs.get('spar_boot')),
+                  'pval_threshold': _first(inputs.get('spar_pval'))}
+    elif tool == 'spiec-easi':
+        params = {'settings': _first(inputs.get('spiec'))}
+    elif tool == 'conet':
+        params = {'settings': _first(inputs.get('conet_bash'))}
+    elif tool == 'rho':
+        params = {'fdr': _first(inputs.get('rho_fdr')),
+                  'permutations': _first(inputs.get('rho_perm')),
+                  'edges': _first(inputs.get('corr_edges'))}
+    else:
+        params = {'pval_threshold': _first(inputs.get('corr_pval')),
+                  'boots': _first(inputs.get('corr_boot')),
+                  'edges': _first(inputs.get('corr_edges'))}
+    return tuple(sorted((key, value) for key, value in params.items() if value is not None))
+
+
 def get_joblist(nets):
     """
     Creates a list of jobs that can be distributed over multiple processes.
-    Note: should be appended to handle multiple taxonomic levels + files!
-    Each job is a tuple of the taxonomic level, tool and name.
+    There is one job per tool, taxonomic level and name;
+    tools, levels and names that were supplied more than once are only included once.
+    Each job lists the preparation tasks it requires,
+    so tasks shared by several jobs are only carried out once by run_tasks.
 
     :param nets: Nets object
-    :return: Dictionary of dictionary of jobs
+    :return: List of Job tuples
     """
     joblist = list()
-    for name in nets.inputs['name']:
-        for level in nets.inputs['levels']:
-            sublist = dict()
-            if nets.inputs['tools']:
-                for i in nets.inputs['tools']:
-                    sublist[i] = level
-            if nets.inputs['spiec'] is not None:
-                sublist['spiec_setting'] = [level, nets.inputs['spiec']]
-            if nets.inputs['spar_boot'] or nets.inputs['spar_pval'] is not None:
-                sublist['spar_setting'] = [level, {'spar_boot': nets.inputs['spar_boot'],
-                'spar_pval': nets.inputs['spar_pval']}]
-            for value in sublist:
-                joblist.append((sublist[value], value, name))
+    tools = list(dict.fromkeys(nets.inputs['tools'] or []))
+    for name in dict.fromkeys(nets.inputs['name']):
+        for level in dict.fromkeys(nets.inputs['levels']):
+            for tool in tools:
+                requires = [Task('taxonomy', level, name)]
+                if tool == 'conet':
+                    requires.append(Task('conet_table', level, name))
+                elif tool == 'sparcc':
+                    requires.append(Task('sparcc_table', level, name))
+                joblist.append(Job(level, tool, name, _tool_params(nets.inputs, tool), tuple(requires)))
     return joblist
 
 
-def run_parallel(nets):
+def run_tasks(nets, jobs, cores=1):
     """
-    Creates partial function to run as pool.
+    Carries out the preparation tasks required by a list of jobs.
+    Each task is only carried out once, even if multiple jobs require it,
+    and all tasks of a BIOM file are carried out after loading it once.
+    BIOM files are prepared in parallel, and the results are collected
+    in the main process before the jobs are distributed.
 
     :param nets: Nets object
+    :param jobs: List of jobs generated by get_joblist
+    :param cores: Number of processes
+    :return: Original OTU IDs and OTU IDs with forbidden characters removed for CoNet
+    """
+    filenames = nets.inputs['procbioms']
+    tasks = dict()
+    for job in jobs:
+        for task in job.requires:
+            if task.kind not in ['taxonomy', 'conet_table', 'sparcc_table']:
+                raise ValueError("Unknown preparation task: " + str(task.kind))
+            kinds = tasks.setdefault((task.level, task.name), list())
+            if task.kind not in kinds:
+                kinds.append(task.kind)
+    keys = list(tasks)
+    items = [(filenames[level][name], tasks[(level, name)]) for level, name in keys]
+    if cores and cores > 1 and len(items) > 1:
+        pool = mp.Pool(min(cores, len(items)))
+        try:
+            results = pool.map(_prepare_inputs, items)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_prepare_inputs(item) for item in items]
+    orig_ids = dict()
+    obs_ids = dict()
+    for (level, name), (filename, taxonomy, ids, observations) in zip(keys, results):
+        if taxonomy is not None:
+            _taxonomy[filename] = taxonomy
+        if ids is not None:
+            orig_ids.setdefault(level, dict())[name] = ids
+            obs_ids.setdefault(level, dict())[name] = observations
+    if len(orig_ids) == 0:
+        return None, None
+    return orig_ids, obs_ids
+
+
+def _get_table(nets, level, name):
+    """
+    Returns the BIOM file for a taxonomic level and name.
+    If the Nets object does not contain the file,
+    it is read from the processed BIOM files.
+
+    :param nets: Nets object
+    :param level: Taxonomic level
+    :param name: Name of BIOM file
+    :return: BIOM file
+    """
+    tables = {'otu': nets.otu, 'species': nets.species, 'genus': nets.genus,
+              'family': nets.family, 'order': nets.order,
+              'class': nets.class_, 'phylum': nets.phylum}
+    try:
+        table = tables[level][name]
+    except KeyError:
+        table = biom.load_table(nets.inputs['procbioms'][level][name])
+    return table
+
+
+def _cache_location(nets):
+    """
+    :param nets: Nets object
+    :return: Folder of the network cache
+    """
+    location = nets.inputs.get('cache')
+    if location is None:
+        location = nets.inputs['fp'] + '/network_cache'
+    return location
+
+
+def _check_cache(nets, jobs):
+    """
+    Looks up the networks for a list of jobs in the network cache.
+    Networks found in the cache are added to the Nets object,
+    and the remaining jobs are returned together with their cache keys.
+    The cache keys are stored in the inputs, so they are written to the settings file.
+
+    :param nets: Nets object
+    :param jobs: List of jobs generated by get_joblist
+    :return: Network cache, remaining jobs and dictionary of cache keys
+    """
+    cache = NetCache(_cache_location(nets), max_size=nets.inputs.get('cache_size', 1000))
+    keys = dict()
+    provenance = dict()
+    remaining = list()
+    for job in jobs:
+        level, tool, name = job.level, job.tool, job.name
+        settings = job.settings
+        if tool not in _external_tools:
+            remaining.append(job)
+            continue
+        if tool == 'sparcc':
+            files = [(nets.inputs['spar'] + '/' + script).replace('\\', '/') for script in
+                     ['SparCC.py', 'MakeBootstraps.py', 'PseudoPvals.py']]
+        elif tool == 'conet':
+            files = [settings.get('settings') or resource_path('CoNet.sh'),
+                     (nets.inputs['conet'] + '/lib/CoNet.jar').replace('\\', '/')]
+        else:
+            files = [settings.get('settings') or resource_path('spieceasi.r')]
+        network_name = _job_name(job)
+        key = cache.get_key(_get_table(nets, level, name), tool,
+                            settings=settings if tool == 'sparcc' else None, files=files)
+        network = cache.get(key)
+        provenance[network_name] = {'key': key, 'hit': network is not None}
+        if network is not None:
+            logger.info('Loaded ' + network_name + ' from network cache. ')
+            nets.networks[network_name] = _add_tax(network, nets.inputs['procbioms'][level][name])
+        else:
+            keys[network_name] = key
+            remaining.append(job)
+    nets.inputs['network_cache'] = {'location': cache.location, 'networks': provenance}
+    return cache, remaining, keys
+
+
+def _estimate_cost(job, nets):
+    """
+    Gives a rough estimate of the runtime of a job,
+    so the longest jobs can be dispatched first.
+    The estimate scales with the dimensions of the BIOM file,
+    and is multiplied by the number of bootstraps or iterations
+    that the tool carries out. Only the relative size of the estimates matters.
+
+    :param job: Job generated by get_joblist
+    :param nets: Nets object
+    :return: Estimated cost of the job
+    """
+    level, tool, name = job.level, job.tool, job.name
+    if tool not in _tools:
+        return 0
+    taxa, samples = _get_table(nets, level, name).shape
+    cost = taxa * taxa * samples
+    if tool == 'sparcc':
+        boots = job.settings.get('boots', 100)
+        # SparCC is run once on the data and once per bootstrap
+        cost = cost * (int(boots) + 1)
+    elif tool == 'conet':
+        # the CoNet script runs 100 permutations and 100 bootstraps
+        cost = cost * 200
+    elif tool == 'spiec-easi':
+        # graphical lasso scales with the cube of the taxa, StARS repeats this 20 times
+        cost = (cost + taxa * taxa * taxa) * 20
+    elif tool == 'rho':
+        # scores are computed once on the data and once per permutation
+        cost = cost * (int(job.settings.get('permutations', 20)) + 1)
+    elif job.settings.get('boots'):
+        # correlations are computed once on the data and once per bootstrap
+        cost = cost * (int(job.settings['boots']) + 1)
+    return cost
+
+
+def _runs_blocked(job, nets):
+    """
+    :param job: Job generated by get_joblist
+    :param nets: Nets object
+    :return: True if the job computes correlations in blocks
+    """
+    if job.tool in ['spearman', 'rho']:
+        return True
+    # stored Pearson statistics do not support blocks, bootstraps or edge numbers
+    return job.tool == 'pearson' and (bool(nets.inputs.get('corr_block')) or bool(job.settings.get('boots')) or
+                                      bool(job.settings.get('edges')))
+
+
+def _pool_results(nets, jobs, context, cores):
+    """
+    Runs jobs in a pool of worker processes on this machine.
+    Blocked correlations start their own processes, which worker processes cannot do,
+    so these jobs are run in the main process.
+    If there are several cores, the main process and the pool share them
+    and the blocked jobs run while the pool works on the other jobs;
+    otherwise, the blocked jobs run with all cores after the pool is finished.
+
+    :param nets: Nets object
+    :param jobs: List of jobs generated by get_joblist
+    :param context: Dictionary with keyword arguments for run_jobs and the taxonomy cache
+    :param cores: Number of processes
+    :return: Generator of job, networks, failure record and False, as networks are not written yet
+    """
+    context_path = _write_context(context, folder=context['limits'].get('scratch', scratch_root()))
+    local = [job for job in jobs if _runs_blocked(job, nets)]
+    pooled = [job for job in jobs if job not in local]
+    kwargs = {key: context[key] for key in context if key != 'taxonomy'}
+    cores = max(int(cores or 1), 1)
+    # the pool and the blocked jobs never use more processes than there are cores
+    overlap = len(local) > 0 and len(pooled) > 0 and cores > 1
+    local_cores = cores // 2 if overlap else cores
+    pool = mp.Pool(cores - local_cores if overlap else cores,
+                   initializer=_init_worker, initargs=(context_path,))
+    try:
+        # jobs are handed to the pool before the main process starts on its own jobs
+        results = pool.imap_unordered(_run_job_worker, iter(pooled))
+        if overlap:
+            for job in local:
+                yield _run_job_safe(job, cores=local_cores, **kwargs) + (False,)
+        for result in results:
+            yield result + (False,)
+        pool.close()
+        pool.join()
+        if not overlap:
+            for job in local:
+                yield _run_job_safe(job, cores=local_cores, **kwargs) + (False,)
+    finally:
+        pool.close()
+        pool.join()
+        os.remove(context_path)
+
+
+def _queue_results(nets, jobs, context, cores):
+    """
+    Submits jobs to a file queue, so they can be run by massoc workers on any machine
+    that shares the queue folder and output folder.
+    This process starts a worker for each core as well;
+    with 0 cores, all jobs are run by other workers.
+    Workers write networks to the output folder, where they are read from.
+
+    :param nets: Nets object
+    :param jobs: List of jobs generated by get_joblist
+    :param context: Dictionary with keyword arguments for run_jobs and the taxonomy cache
+    :param cores: Number of local workers
+    :return: Generator of job, networks, failure record and True, as networks are already written
+    """
+    folder = nets.inputs.get('queue') or nets.inputs['fp'] + '/queue'
+    queue = FileQueue(folder, **nets.inputs.get('queue_settings', dict()))
+    context_path = _write_context(context, folder=folder)
+    queue.start({'context': os.path.abspath(context_path),
+                 'store': os.path.abspath(nets.inputs['fp'])})
+    remaining = dict()
+    for job in jobs:
+        remaining[_job_name(job)] = job
+        queue.submit(_job_name(job), job)
+    logger.info('Submitted ' + str(len(jobs)) + ' jobs to ' + folder + '. ')
+    workers = list()
+    for i in range(int(cores or 0)):
+        worker = mp.Process(target=run_queue_worker, args=(folder,))
+        worker.start()
+        workers.append(worker)
+    cancel = context['limits'].get('cancel')
+    try:
+        while len(remaining) > 0:
+            if cancel is not None and os.path.isfile(cancel):
+                for name in queue.cancel():
+                    yield remaining.pop(name), dict(), {'reason': 'cancelled', 'command': None,
+                                                        'message': 'Network inference was cancelled.'}, True
+            for name, result in queue.collect().items():
+                if name not in remaining:
+                    continue
+                job = remaining.pop(name)
+                if result['error'] is not None:
+                    yield job, dict(), result['error'], True
+                else:
+                    yield job, _read_checkpoints(nets, job, result['networks']), None, True
+            queue.requeue_stalled()
+            if len(remaining) > 0:
+                sleep(1)
+    finally:
+        queue.cancel()
+        queue.finish()
+        for worker in workers:
+            worker.join()
+        os.remove(context_path)
+
+
+def _async_results(nets, jobs, context, cores):
+    """
+    Runs jobs of external tools from one asyncio event loop in this process.
+    These jobs mostly wait for their tool, so a semaphore sized to the number of cores
+    limits how many tools run at the same time, instead of a process per job.
+    Each job runs in a thread, as the tool functions block while their commands run.
+    Other jobs compute networks in Python, so they are run by the pool executor
+    once the tools are finished.
+
+    :param nets: Nets object
+    :param jobs: List of jobs generated by get_joblist
+    :param context: Dictionary with keyword arguments for run_jobs and the taxonomy cache
+    :param cores: Number of tools run at the same time
+    :return: Generator of job, networks, failure record and False, as networks are not written yet
+    """
+    external = [job for job in jobs if job.tool in _external_tools]
+    other = [job for job in jobs if job not in external]
+    cores = max(int(cores or 1), 1)
+    kwargs = {key: context[key] for key in context if key != 'taxonomy'}
+    loop = asyncio.new_event_loop()
+    threads = ThreadPoolExecutor(max_workers=cores)
+
+    async def start():
+        semaphore = asyncio.Semaphore(cores)
+
+        async def limited(job):
+            async with semaphore:
+                return await loop.run_in_executor(threads, partial(_run_job_safe, job, **kwargs))
+
+        return {asyncio.ensure_future(limited(job)) for job in external}
+
+    pending = set()
+    try:
+        pending = loop.run_until_complete(start())
+        while len(pending) > 0:
+            done, pending = loop.run_until_complete(asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+            for task in done:
+                yield task.result() + (False,)
+    finally:
+        # jobs that already started are stopped by their supervisor through the cancellation file
+        for task in pending:
+            task.cancel()
+        if len(pending) > 0:
+            loop.run_until_complete(asyncio.wait(pending))
+        threads.shutdown(wait=True)
+        loop.close()
+    if len(other) > 0:
+        yield from _pool_results(nets, other, context, cores)
+
+
+# executors accepted by run_parallel
+_executors = {'pool': _pool_results, 'queue': _queue_results, 'async': _async_results}
+
+
+def run_queue_worker(folder, cores=1, idle=None):
+    """
+    Runs network inference jobs from a file queue until the run is finished.
+    Networks are written to the output folder of the run.
+
+    :param folder: Queue folder
+    :param cores: Number of processes for jobs that start their own processes
+    :param idle: Number of seconds without jobs after which the worker stops, or None
+    :return: Number of jobs that were run
+    """
+    loaded = dict()
+
+    def execute(job, metadata):
+        if loaded.get('context') != metadata['context']:
+            _init_worker(metadata['context'])
+            loaded['context'] = metadata['context']
+        job, networks, error = _run_job_safe(job, cores=cores, **_job_context)
+        if error is not None:
+            return {'networks': list(), 'error': error}
+        for network in networks:
+            _write_checkpoint(metadata['store'], network, networks[network])
+        return {'networks': list(networks), 'error': None}
+
+    return work(folder, execute, idle=idle)
+
+
+def run_parallel(nets, publish=False, started=None):
+    """
+    Runs all network inference jobs in a pool of worker processes,
+    through a file queue if the 'queue' executor is selected,
+    or with the tools run from one event loop if the 'async' executor is selected.
+    Jobs are dispatched in order of their estimated cost,
+    so long jobs do not end up running alone at the end.
+    Completed jobs are reported as they arrive.
+
+    :param nets: Nets object
+    :param publish: If True, publishes messages to be received by GUI.
+    :param started: Time at which the run was started, in seconds since the epoch;
+    cancellation files written after this time cancel the run. By default, the time this function is called.
     :return:
     """
+    if started is None:
+        started = time()
     cores = nets.inputs['cores']
     jobs = get_joblist(nets)
+    # files may have been rewritten since a previous run
+    _taxonomy.clear()
+    derive = None
+    if nets.inputs.get('derive_levels') and not (nets.inputs.get('corr_block') or nets.inputs.get('corr_boot') or
+                                                 nets.inputs.get('corr_edges')):
+        if 'otu' in nets.inputs['levels']:
+            # Pearson networks of other levels are derived by the OTU-level job
+            derive = [level for level in nets.inputs['levels'] if level != 'otu']
+            jobs = [job for job in jobs if job.tool != 'pearson' or job.level == 'otu']
+            # the OTU-level job needs the taxonomy of the derived networks
+            jobs = [job._replace(requires=job.requires + tuple(Task('taxonomy', level, job.name)
+                                                               for level in derive))
+                    if job.tool == 'pearson' else job for job in jobs]
+        else:
+            logger.warning('Pearson networks can only be derived from OTU-level counts. ')
+    sweep = None
+    rerun = list()
+    if nets.inputs.get('spar_sweep'):
+        # scores are not cached, so SparCC jobs without scores need to be run again
+        sweep = nets.inputs['fp']
+        rerun = [job for job in jobs if job.tool == 'sparcc' and
+                 not os.path.isfile(scores_path(sweep, _job_name(job)))]
+        jobs = [job for job in jobs if job not in rerun]
+    journal_path = nets.inputs['fp'] + '/network_jobs.json'
+    journal = dict()
+    if nets.inputs.get('resume'):
+        journal = _read_journal(journal_path)
+        jobs = _resume_jobs(nets, jobs, journal)
+    cache = None
+    keys = dict()
+    if nets.inputs.get('cache_size', 1000):
+        cache, jobs, keys = _check_cache(nets, jobs)
+    jobs = jobs + rerun
+    jobs = sorted(jobs, key=lambda job: _estimate_cost(job, nets), reverse=True)
     filenames = nets.inputs['procbioms']
     logger.info('Collecting jobs... ')
-    pool = mp.Pool(cores)
-    # multiprocess supports passing objects
-    # multiprocessing does not
-    # however, multiprocess cannot be frozen
-    # need to rewrite netwrap as pickle-able objects!
-    orig_ids = None
-    obs_ids = None
-    if 'conet' in nets.inputs['tools']:
-        orig_ids, obs_ids = nets._prepare_conet()
-    if 'sparcc' in nets.inputs['tools']:
-        nets._prepare_spar()
-    func = partial(run_jobs, filenames=filenames, orig_ids=orig_ids,
-                   obs_ids=obs_ids, spar=nets.inputs['spar'], conet=nets.inputs['conet'],
-                   spiec_settings=nets.inputs['spiec'], conet_settings=nets.inputs['conet_bash'])
+    # tasks are carried out once in the main process, the taxonomy is copied to each worker
+    orig_ids, obs_ids = run_tasks(nets, jobs, cores=cores)
+    limits = {'cancel': cancel_path(nets.inputs['fp'])}
+    clear_cancel(nets.inputs['fp'], started)
+    if nets.inputs.get('timeout'):
+        limits['timeout'] = float(nets.inputs['timeout']) * 60
+    if nets.inputs.get('memory'):
+        limits['max_memory'] = float(nets.inputs['memory'])
+    if nets.inputs.get('scratch'):
+        limits['scratch'] = nets.inputs['scratch']
+    # cores that are not needed for separate jobs are used for commands within a job
+    limits['concurrency'] = max(1, int(cores) // max(len(jobs), 1))
+    # the context is loaded once by each worker, so jobs only contain their keys
+    context = {'filenames': filenames, 'orig_ids': orig_ids, 'obs_ids': obs_ids,
+               'spar': nets.inputs['spar'], 'conet': nets.inputs['conet'],
+               'limits': limits, 'sweep': sweep,
+               'stats': _cache_location(nets) + '/statistics', 'block': nets.inputs.get('corr_block'),
+               'derive': derive, 'warm': bool(nets.inputs.get('warm')), 'taxonomy': _taxonomy}
+    executor = nets.inputs.get('executor') or 'pool'
+    if executor not in _executors:
+        raise ValueError("Unknown executor: " + str(executor))
+    results = _executors[executor](nets, jobs, context, cores)
+    if publish:
+        from wx.lib.pubsub import pub
+    for job in jobs:
+        journal[_job_name(job)] = {'status': 'pending'}
+    _write_journal(journal_path, journal)
+    failed = dict()
+    completed = 0
     try:
         logger.info('Distributing jobs... ')
         # network_list = list()
         # for job in jobs:
             # result = run_jobs(nets, job)
             # network_list.append(result)
-        results = pool.map(func, iter(jobs))
+        for job, item, error, stored in results:
+            completed += 1
+            if error is not None:
+                failed[_job_name(job)] = error
+                journal[_job_name(job)] = {'status': 'failed', 'error': error}
+                msg = 'Failed ' + str(completed) + ' out of ' + str(len(jobs)) + \
+                      ' jobs: ' + _job_name(job) + ' (' + error['reason'] + ')'
+            else:
+                for network in item:
+                    # each network is written to disk as soon as it is available
+                    if not stored:
+                        _write_checkpoint(nets.inputs['fp'], network, item[network])
+                    nets.networks[network] = item[network]
+                    nets.checkpoints[network] = item[network]
+                    if network in keys:
+                        cache.put(keys[network], item[network])
+                journal[_job_name(job)] = {'status': 'completed', 'networks': list(item)}
+                msg = 'Completed ' + str(completed) + ' out of ' + str(len(jobs)) + \
+                      ' jobs: ' + ', '.join(item)
+            _write_journal(journal_path, journal)
+            logger.info(msg)
+            if publish:
+                pub.sendMessage('update', msg=msg)
     except Exception:
         logger.error('Failed to generate workers. ', exc_info=True)
-    for item in results:
-        for network in item:
-            nets.networks[network] = item[network]
+    finally:
+        results.close()
+    nets.inputs['failed_jobs'] = failed
+    if len(failed) > 0:
+        logger.warning('The following jobs failed and can be rerun with --resume: ' +
+                       ', '.join(failed) + ' ')
+    if os.path.isfile(limits['cancel']):
+        os.remove(limits['cancel'])
     # for i in range(1, len(jobs)):
     #    nets.networks = {**nets.networks, **results[i]}
     # clean up old written BIOM files
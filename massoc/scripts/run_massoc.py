@@ -19,7 +19,7 @@ __license__ = 'Apache 2.0'
 import sys
 import multiprocessing as mp
 from massoc.scripts.main import get_input, run_network, \
-    run_neo4j, run_netstats, run_metastats
+    run_neo4j, run_netstats, run_metastats, run_worker
 import os
 import argparse
 import logging.handlers
@@ -47,6 +47,9 @@ def massoc(massoc_args):
     if 'network' in massoc_args:
         logger.info('Running network inference module. ')
         run_network(massoc_args)
+    if 'worker' in massoc_args:
+        logger.info('Running network inference worker. ')
+        run_worker(massoc_args)
     if 'database' in massoc_args:
         logger.info('Working on Neo4j database. ')
         run_neo4j(massoc_args)
@@ -187,15 +190,17 @@ inputparser.set_defaults(input=True)
 networkparser = subparsers.add_parser('network', description='Runs network inference.',
                                       help='Given a settings file with preprocessed biom files,'
                                            'this module carries out network construction. '
-                                           'Currently, SPIEC-EASI, CoNet and SparCC are supported. '
+                                           'Currently, SPIEC-EASI, CoNet, SparCC, Pearson and Spearman '
+                                           'correlation and proportionality (rho) are supported. '
                                            'If you have difficulties running the tools through massoc, '
                                            'consider importing completed networks through the neo4j module. ')
 networkparser.add_argument('-tools', '--tool_names',
                            dest='tools',
                            required=False,
-                           choices=['spiec-easi', 'sparcc', 'conet'],
+                           choices=['spiec-easi', 'sparcc', 'conet', 'pearson', 'spearman', 'rho'],
                            nargs='+',
-                           help='Runs all listed tools with default settings.',
+                           help='Runs all listed tools with default settings: '
+                                'spiec-easi, sparcc, conet, pearson, spearman or rho (proportionality).',
                            default=None)
 networkparser.add_argument('-spiec_settings', '--SPIEC-EASI_settings',
                            dest='spiec',
@@ -223,6 +228,73 @@ networkparser.add_argument('-spar_pval', '--SparCC_pval',
                            help='Threshold for SparCC pseudo-pvalues. ',
                            type=float,
                            default=None)
+networkparser.add_argument('-spar_sweep', '--SparCC_sweep',
+                           dest='spar_sweep',
+                           required=False,
+                           nargs='+',
+                           help='Additional thresholds for SparCC pseudo-pvalues. \n'
+                                'Edge counts and densities at each threshold are reported \n'
+                                'without running SparCC again. ',
+                           type=float,
+                           default=None)
+networkparser.add_argument('-corr_pval', '--correlation_pval',
+                           dest='corr_pval',
+                           required=False,
+                           help='Threshold for p-values of Pearson and Spearman correlations. \n'
+                                'Pearson statistics are stored with the network cache, \n'
+                                'so networks are updated when samples are added. ',
+                           type=float,
+                           default=None)
+networkparser.add_argument('-corr_block', '--correlation_block',
+                           dest='corr_block',
+                           required=False,
+                           help='Number of taxa per block for Pearson and Spearman correlations \n'
+                                'and proportionality. \n'
+                                'If specified, Pearson correlations are computed in blocks \n'
+                                'across processes instead of from stored statistics; \n'
+                                'use this for tables with many taxa. ',
+                           type=int,
+                           default=None)
+networkparser.add_argument('-corr_boot', '--correlation_boot',
+                           dest='corr_boot',
+                           required=False,
+                           help='Number of bootstraps for Pearson and Spearman correlations. \n'
+                                'The network is inferred again from each bootstrap of the samples, \n'
+                                'and the fraction of bootstraps that contain each edge \n'
+                                'and the mean and standard deviation of its correlation \n'
+                                'are added as edge attributes. ',
+                           type=int,
+                           default=None)
+networkparser.add_argument('-corr_edges', '--correlation_edges',
+                           dest='corr_edges',
+                           required=False,
+                           help='Number of edges for Pearson, Spearman and proportionality networks. \n'
+                                'Like the edge number threshold guessing of CoNet, \n'
+                                'half of the edges have the highest scores and half the lowest scores. \n'
+                                'If specified, replaces the p-value threshold and false discovery rate. ',
+                           type=int,
+                           default=None)
+networkparser.add_argument('-rho_fdr', '--proportionality_fdr',
+                           dest='rho_fdr',
+                           required=False,
+                           help='Maximum false discovery rate for proportionality (rho). \n'
+                                'The threshold for rho is estimated from permutations. ',
+                           type=float,
+                           default=None)
+networkparser.add_argument('-rho_perm', '--proportionality_permutations',
+                           dest='rho_perm',
+                           required=False,
+                           help='Number of permutations for the false discovery rate of proportionality. ',
+                           type=int,
+                           default=None)
+networkparser.add_argument('-derive_levels', '--derive_levels',
+                           dest='derive_levels',
+                           required=False,
+                           action='store_true',
+                           help='If flagged, Pearson networks of higher taxonomic levels \n'
+                                'are computed by the OTU-level job from the summed OTU counts, \n'
+                                'instead of by a separate job for each collapsed BIOM file. ',
+                           default=None)
 networkparser.add_argument('-spar_boot', '--SparCC_boot',
                            dest='spar_boot',
                            required=False,
@@ -236,6 +308,90 @@ networkparser.add_argument('-cores', '--number_of_processes',
                                 'jobs across.',
                            type=int,
                            default=4)
+networkparser.add_argument('-cache', '--network_cache',
+                           dest='cache',
+                           required=False,
+                           help='Folder for storing inferred networks, '
+                                'so they do not need to be inferred again '
+                                'if the data and settings are unchanged. '
+                                'By default, a folder in the output filepath is used.',
+                           default=None)
+networkparser.add_argument('-cache_size', '--network_cache_size',
+                           dest='cache_size',
+                           required=False,
+                           help='Maximum size of the network cache in megabytes. '
+                                'Set to 0 to disable the cache.',
+                           type=float,
+                           default=1000)
+networkparser.add_argument('-timeout', '--job_timeout',
+                           dest='timeout',
+                           required=False,
+                           help='Maximum runtime of a single network inference job in minutes. '
+                                'Jobs that take longer are stopped and reported as failed.',
+                           type=float,
+                           default=None)
+networkparser.add_argument('-memory', '--job_memory',
+                           dest='memory',
+                           required=False,
+                           help='Maximum memory of a single network inference job in megabytes. '
+                                'Jobs that use more memory are stopped and reported as failed.',
+                           type=float,
+                           default=None)
+networkparser.add_argument('-scratch', '--scratch_filepath',
+                           dest='scratch',
+                           required=False,
+                           help='Folder for temporary files of network inference jobs. '
+                                'By default, /dev/shm is used if available. ',
+                           default=None)
+networkparser.add_argument('-warm', '--warm_workers',
+                           dest='warm',
+                           required=False,
+                           action='store_true',
+                           help='Keeps CoNet and SPIEC-EASI running between jobs, '
+                                'so the JVM and R packages are only loaded once per process. '
+                                'Uses the settings of the scripts included with massoc. ',
+                           default=False)
+networkparser.add_argument('-executor', '--job_executor',
+                           dest='executor',
+                           required=False,
+                           help='Runs jobs in a pool of processes on this machine, '
+                                'or submits them to a file queue that is processed by '
+                                'massoc workers on any machine sharing the filesystem. '
+                                'With the queue executor, this process starts a worker per core. '
+                                'The async executor runs the external tools from this process, '
+                                'with as many tools at the same time as there are cores. ',
+                           choices=['pool', 'queue', 'async'],
+                           default='pool')
+networkparser.add_argument('-queue', '--queue_filepath',
+                           dest='queue',
+                           required=False,
+                           help='Folder for the file queue. '
+                                'By default, a folder in the output filepath is used.',
+                           default=None)
+networkparser.add_argument('-resume', '--resume',
+                           dest='resume',
+                           required=False,
+                           action='store_true',
+                           help='Only runs jobs that did not complete in a previous run. '
+                                'Networks of completed jobs are read from the output filepath.',
+                           default=False)
+networkparser.add_argument('-consensus', '--consensus_support',
+                           dest='consensus',
+                           required=False,
+                           nargs='+',
+                           help='Constructs consensus networks from the networks of different tools, '
+                                'containing edges with the same sign in at least this number of networks. '
+                                'Multiple numbers can be provided.',
+                           type=int,
+                           default=None)
+networkparser.add_argument('-export', '--network_export',
+                           dest='net_export',
+                           required=False,
+                           help='Additionally writes networks as weighted edge lists (txt) '
+                                'or graphml files for use in other software. '
+                                'Networks are always written as binary .h5 files.',
+                           choices=['txt', 'graphml'],
+                           default=None)
 networkparser.add_argument('-fp', '--output_filepath',
                            dest='fp',
                            help='Filepath for saving output files and reading settings.',
@@ -243,6 +399,31 @@ networkparser.add_argument('-fp', '--output_filepath',
 networkparser.set_defaults(network=True)
 
 
+workerparser = subparsers.add_parser('worker', description='Runs network inference jobs from a file queue.',
+                                     help='The worker module runs network inference jobs that were '
+                                          'submitted by the network module with the queue executor. '
+                                          'Any number of workers can be started on machines '
+                                          'that share the queue folder and output filepath. ')
+workerparser.add_argument('-queue', '--queue_filepath',
+                          dest='queue',
+                          required=True,
+                          help='Folder for the file queue.')
+workerparser.add_argument('-cores', '--number_of_processes',
+                          dest='cores',
+                          required=False,
+                          help='Number of processes for jobs that compute correlations in blocks.',
+                          type=int,
+                          default=1)
+workerparser.add_argument('-idle', '--idle_time',
+                          dest='idle',
+                          required=False,
+                          help='Stops the worker after this number of seconds without jobs. '
+                               'By default, the worker waits until network inference is finished.',
+                          type=float,
+                          default=None)
+workerparser.set_defaults(worker=True)
+
+
 neo4jparser = subparsers.add_parser('neo4j', description='Sets up a Neo4j graph database.',
                                     help='If the user provides a settings file with '
                                          'filenames that need to be imported '
@@ -304,8 +485,8 @@ netstatsparser = subparsers.add_parser('netstats', description='Network analysis
                                        help='If the user has previously set up a Neo4j graph database,'
                                             'this module carries out cluster analysis and '
                                             'identifies central nodes. '
-                                            'In the future, the module will also generates null models'
-                                            ' for statistical analyses. ')
+                                            'The module also generates null models'
+                                            ' for statistical analyses of network overlap. ')
 netstatsparser.add_argument('-l', '--logic',
                             dest='logic',
                             required=False,
@@ -334,6 +515,13 @@ netstatsparser.add_argument('-n', '--num',
                             default=None,
                             help='If specified, the intersection is taken over a number of networks \n'
                                  'rather than all networks. Multiple numbers can be provided.')
+netstatsparser.add_argument('-null', '--null_models',
+                            dest='null',
+                            required=False,
+                            type=int,
+                            default=None,
+                            help='Number of degree-preserving randomizations used to test \n'
+                                 'whether networks of different tools overlap more than expected.')
 netstatsparser.add_argument('-fp', '--output_filepath',
                             dest='fp',
                             help='Filepath for saving output files and reading settings.',
@@ -0,0 +1,38 @@
+"""
+Stub worker that follows the warm worker protocol of networker,
+used in place of CoNet and SPIEC-EASI by test_networker.
+Jobs are 'write <file>', 'fail', 'crash', 'exit' and 'sleep <seconds>'.
+'crash' stops the worker without answering, 'exit' stops it after answering.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import time
+
+print('@massoc\tready', flush=True)
+for line in sys.stdin:
+    fields = line.rstrip('\n').split('\t')
+    job, args = fields[0], fields[1:]
+    print('running job ' + job + ' in ' + str(os.getpid()), flush=True)
+    if args[0] == 'write':
+        with open(args[1], 'w') as file:
+            file.write('network')
+        result = 'ok'
+    elif args[0] == 'sleep':
+        time.sleep(float(args[1]))
+        result = 'ok'
+    elif args[0] == 'crash':
+        sys.exit(3)
+    elif args[0] == 'exit':
+        print('@massoc\t' + job + '\tok', flush=True)
+        sys.exit(0)
+    else:
+        print('unknown job', file=sys.stderr, flush=True)
+        result = 'error\tunknown job'
+    print('@massoc\t' + job + '\t' + result, flush=True)
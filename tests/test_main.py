@@ -229,7 +229,7 @@ class TestMain(unittest.TestCase):
         get_input(inputs)
         inputs['settings'] = inputs['fp'] + '/settings.json'
         run_network(inputs)
-        test = Path(inputs['fp'] + "/conet_family_test.txt")
+        test = Path(inputs['fp'] + "/conet_family_test.h5")
         self.assertTrue(test.is_file())
         call(("rm " + inputs['biom_file'][0]))
         call(("rm " + inputs['fp'] + "/settings.json"))
@@ -0,0 +1,190 @@
+"""
+This file contains all testing functions for netarray.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import unittest
+import tempfile
+
+import numpy as np
+import pandas
+import networkx as nx
+from massoc.scripts.netarray import read_triplets, triplets_to_graph, NetArray, EdgeWriter, consensus, \
+    edge_keys, isin_sorted
+
+ids = ['GG_OTU_1', 'GG_OTU_2', 'GG_OTU_3', 'GG_OTU_4']
+
+corrtab = pandas.DataFrame([[1, 0.5, -0.4, 0],
+                            [0.5, 1, 0, 0.2],
+                            [-0.4, 0, 1, 0],
+                            [0, 0.2, 0, 1]], index=ids, columns=ids)
+
+pvaltab = pandas.DataFrame([[1, 0.001, 0.0001, 1],
+                            [0.001, 1, 1, 0.5],
+                            [0.0001, 1, 1, 1],
+                            [1, 0.5, 1, 1]], index=ids, columns=ids)
+
+
+class TestNetArray(unittest.TestCase):
+    """Tests netarray.
+    More specifically, checks whether association matrices
+    are converted to the same graphs as with NetworkX adjacency conversion,
+    and whether NetArray objects are converted without loss of information.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.corrs = os.path.join(self.folder, 'corrs.tsv')
+        self.pvals = os.path.join(self.folder, 'pvals.tsv')
+        corrtab.to_csv(self.corrs, sep='\t')
+        pvaltab.to_csv(self.pvals, sep='\t')
+
+    def tearDown(self):
+        os.remove(self.corrs)
+        os.remove(self.pvals)
+        os.rmdir(self.folder)
+
+    def test_read_triplets(self):
+        """Checks whether only the upper triangle
+        of cells passing the mask is returned."""
+        nodes, rows, cols, weights = read_triplets(self.corrs, mask=self.pvals,
+                                                   threshold=0.05, chunksize=1)
+        self.assertEqual(nodes, ids)
+        self.assertEqual(sorted(zip(rows.tolist(), cols.tolist())), [(0, 1), (0, 2)])
+
+    def test_triplets_to_graph(self):
+        """Checks whether the graph matches nx.from_pandas_adjacency."""
+        mask = corrtab.where(pvaltab < 0.05).fillna(0)
+        mask[mask > 0] = 1
+        mask[mask < 0] = -1
+        network = nx.from_pandas_adjacency(mask)
+        triplets = read_triplets(self.corrs, mask=self.pvals, threshold=0.05)
+        self.assertTrue(nx.utils.graphs_equal(network, triplets_to_graph(*triplets)))
+
+    def test_isolated_nodes(self):
+        """Checks whether nodes without edges are kept."""
+        network = triplets_to_graph(ids, np.array([0]), np.array([1]), np.array([0.5]))
+        self.assertEqual(len(network.nodes), 4)
+
+    def test_netarray_networkx(self):
+        """Checks whether conversion to NetArray and back
+        returns the same graph, including node attributes."""
+        network = nx.Graph()
+        network.add_edge('GG_OTU_1', 'GG_OTU_2', weight=-1.0)
+        network.add_edge('GG_OTU_2', 'GG_OTU_3', weight=1.0)
+        network.add_node('GG_OTU_4')
+        nx.set_node_attributes(network, {'GG_OTU_1': 'g__Escherichia',
+                                         'GG_OTU_2': 'g__Escherichia'}, name='Genus')
+        netarray = NetArray.from_networkx(network)
+        self.assertEqual(netarray.sign.tolist(), [-1, 1])
+        self.assertEqual(len(netarray.attributes['Genus'][0]), 1)
+        self.assertTrue(nx.utils.graphs_equal(network, netarray.to_networkx()))
+        self.assertEqual(dict(network.nodes(data=True)),
+                         dict(netarray.to_networkx().nodes(data=True)))
+
+    def test_netarray_edgelist(self):
+        """Checks whether edge lists can be read by NetworkX and NetArray."""
+        path = os.path.join(self.folder, 'network.txt')
+        netarray = NetArray(*read_triplets(self.corrs, mask=self.pvals, threshold=0.05))
+        netarray.write_edgelist(path)
+        network = nx.read_weighted_edgelist(path)
+        copy = NetArray.read_edgelist(path)
+        os.remove(path)
+        self.assertTrue(nx.utils.graphs_equal(network, copy.to_networkx()))
+        self.assertEqual(copy.number_of_edges(), 2)
+
+    def test_netarray_hdf5(self):
+        """Checks whether networks written to HDF5
+        are read with memory-mapped edges and the same attributes."""
+        path = os.path.join(self.folder, 'network.h5')
+        netarray = NetArray(*read_triplets(self.corrs, mask=self.pvals, threshold=0.05))
+        netarray.set_node_attributes({'GG_OTU_1': {'Genus': 'g__Escherichia'},
+                                      'GG_OTU_4': {'Genus': float('nan')}})
+        netarray.set_edge_attribute('stability', np.arange(netarray.number_of_edges()) / 10)
+        netarray.write_hdf5(path)
+        self.assertNotIsInstance(NetArray.read_hdf5(path).src, np.memmap)
+        copy = NetArray.read_hdf5(path, mmap=True)
+        self.assertIsInstance(copy.src, np.memmap)
+        # the file is replaced instead of truncated, so the memory-mapped copy stays readable
+        netarray.write_hdf5(path)
+        self.assertEqual(copy.src.tolist(), netarray.src.tolist())
+        self.assertEqual(sorted(os.listdir(self.folder)), ['corrs.tsv', 'network.h5', 'pvals.tsv'])
+        self.assertEqual(copy.nodes, ids)
+        self.assertEqual(copy.weight.tolist(), netarray.weight.tolist())
+        self.assertEqual(copy.get_node_attributes('Genus')['GG_OTU_1'], 'g__Escherichia')
+        self.assertTrue(np.isnan(copy.get_node_attributes('Genus')['GG_OTU_4']))
+        self.assertEqual(copy.edge_attributes['stability'].tolist(),
+                         netarray.edge_attributes['stability'].tolist())
+        edge = (ids[copy.src[1]], ids[copy.dst[1]])
+        self.assertEqual(copy.to_networkx().edges[edge]['stability'], 0.1)
+        del copy
+        os.remove(path)
+
+    def test_edge_writer(self):
+        """Checks whether edges appended in chunks
+        are read as a single network."""
+        path = os.path.join(self.folder, 'edges.h5')
+        with EdgeWriter(path, ids, chunksize=2) as writer:
+            writer.append(np.array([0, 0]), np.array([1, 2]), np.array([0.5, -0.4]))
+            writer.append(np.array([1]), np.array([3]), np.array([0.2]))
+        netarray = NetArray.read_hdf5(path)
+        self.assertEqual(netarray.nodes, ids)
+        self.assertEqual(netarray.src.tolist(), [0, 0, 1])
+        self.assertEqual(netarray.dst.tolist(), [1, 2, 3])
+        os.remove(path)
+        self.assertEqual(netarray.sign.tolist(), [1, -1, 1])
+
+    def test_consensus(self):
+        """Checks whether edges are only kept if they have the same sign
+        in enough networks, regardless of node order."""
+        first = NetArray(ids, np.array([0, 1]), np.array([1, 2]), np.array([1.0, -1.0]))
+        second = NetArray(ids[::-1], np.array([2, 0]), np.array([3, 1]), np.array([1.0, 1.0]))
+        networks = consensus([first, second], [1, 2])
+        self.assertEqual(networks[1].number_of_edges(), 3)
+        edges = networks[2].to_networkx().edges(data='weight')
+        self.assertEqual([tuple(sorted(edge[:2])) + (edge[2],) for edge in edges],
+                         [('GG_OTU_1', 'GG_OTU_2', 1.0)])
+
+    def test_read_triplets_order(self):
+        """Checks whether mask cells are matched by name
+        if the mask has rows and columns in a different order."""
+        order = [2, 0, 3, 1]
+        pvaltab.iloc[order, order[::-1]].to_csv(self.pvals, sep='\t')
+        for chunksize in [1, 1000]:
+            nodes, rows, cols, weights = read_triplets(self.corrs, mask=self.pvals,
+                                                       threshold=0.05, chunksize=chunksize)
+            self.assertEqual(nodes, ids)
+            self.assertEqual(sorted(zip(rows.tolist(), cols.tolist())), [(0, 1), (0, 2)])
+        pvaltab.rename(index={'GG_OTU_4': 'GG_OTU_5'}).to_csv(self.pvals, sep='\t')
+        with self.assertRaises(ValueError):
+            read_triplets(self.corrs, mask=self.pvals, threshold=0.05)
+
+    def test_consensus_zero(self):
+        """Checks whether edges with a weight of 0 are not counted
+        as negative edges."""
+        first = NetArray(ids, np.array([0, 2]), np.array([1, 3]), np.array([0.0, -1.0]))
+        second = NetArray(ids, np.array([0, 2]), np.array([1, 3]), np.array([-1.0, -1.0]))
+        networks = consensus([first, second], [1, 2])
+        self.assertEqual(networks[1].number_of_edges(), 2)
+        edges = networks[2].to_networkx().edges(data='weight')
+        self.assertEqual([tuple(sorted(edge[:2])) + (edge[2],) for edge in edges],
+                         [('GG_OTU_3', 'GG_OTU_4', -1.0)])
+
+    def test_edge_keys(self):
+        """Checks whether both directions of an edge get the same key
+        and whether keys are found in a sorted array."""
+        keys = edge_keys([0, 2, 3], [2, 0, 1], 4)
+        self.assertEqual(keys.tolist(), [2, 2, 7])
+        found = isin_sorted(np.array([2, 5, 7, 9]), np.unique(keys))
+        self.assertEqual(found.tolist(), [True, False, True, False])
+        self.assertEqual(isin_sorted(keys, np.array([], dtype=np.int64)).tolist(), [False] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
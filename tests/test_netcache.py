@@ -0,0 +1,108 @@
+"""
+This file contains all testing functions for netcache.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import biom
+import networkx as nx
+from massoc.scripts.netcache import NetCache
+
+testraw = """{
+     "id":null,
+     "format": "Biological Observation Matrix 1.0.0-dev",
+     "format_url": "http://biom-format.org",
+     "type": "OTU table",
+     "generated_by": "QIIME revision XYZ",
+     "date": "2011-12-19T19:00:00",
+     "rows":[
+        {"id":"GG_OTU_1", "metadata":null},
+        {"id":"GG_OTU_2", "metadata":null},
+        {"id":"GG_OTU_3", "metadata":null}
+        ],
+     "columns":[
+        {"id":"Sample1", "metadata":null},
+        {"id":"Sample2", "metadata":null},
+        {"id":"Sample3", "metadata":null}
+        ],
+     "matrix_type": "sparse",
+     "matrix_element_type": "int",
+     "shape": [3, 3],
+     "data":[[0,2,1],
+             [1,0,5],
+             [1,1,1],
+             [2,2,4]
+            ]
+    }
+"""
+
+testbiom = biom.parse.parse_biom_table(testraw)
+
+testnetwork = nx.Graph()
+testnetwork.add_edge('GG_OTU_1', 'GG_OTU_2', weight=1.0)
+testnetwork.add_edge('GG_OTU_2', 'GG_OTU_3', weight=-1.0)
+
+
+class TestNetCache(unittest.TestCase):
+    """Tests netcache.
+    More specifically, checks whether networks can be
+    retrieved from the cache and whether the cache stays below its size limit.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_get_key(self):
+        """Checks whether different settings give different keys."""
+        cache = NetCache(self.folder)
+        key = cache.get_key(testbiom, 'sparcc', settings={'spar_boot': 100})
+        same_key = cache.get_key(testbiom, 'sparcc', settings={'spar_boot': 100})
+        other_key = cache.get_key(testbiom, 'sparcc', settings={'spar_boot': 10})
+        self.assertEqual(key, same_key)
+        self.assertNotEqual(key, other_key)
+
+    def test_get_key_file(self):
+        """Checks whether changing a settings file changes the key."""
+        cache = NetCache(self.folder)
+        script = os.path.join(self.folder, 'script.R')
+        with open(script, 'w') as file:
+            file.write('method = "glasso"')
+        key = cache.get_key(testbiom, 'spiec-easi', files=[script])
+        with open(script, 'w') as file:
+            file.write('method = "mb"')
+        self.assertNotEqual(key, cache.get_key(testbiom, 'spiec-easi', files=[script]))
+
+    def test_put_get(self):
+        """Checks whether a cached network is returned unchanged."""
+        cache = NetCache(self.folder)
+        key = cache.get_key(testbiom, 'conet')
+        self.assertIsNone(cache.get(key))
+        cache.put(key, testnetwork)
+        self.assertTrue(nx.utils.graphs_equal(testnetwork, cache.get(key).to_networkx()))
+
+    def test_evict(self):
+        """Checks whether the least recently used network is removed."""
+        cache = NetCache(self.folder)
+        cache.put('first', testnetwork)
+        size = os.path.getsize(os.path.join(self.folder, 'first.npz'))
+        os.utime(os.path.join(self.folder, 'first.npz'), (0, 0))
+        cache.max_size = 1.5 * size / (1024 * 1024)
+        cache.put('second', testnetwork)
+        self.assertIsNone(cache.get('first'))
+        self.assertIsNotNone(cache.get('second'))
+
+
+if __name__ == '__main__':
+    unittest.main()
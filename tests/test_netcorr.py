@@ -0,0 +1,137 @@
+"""
+This file contains all testing functions for netcorr.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import biom
+from scipy.stats import spearmanr
+
+from massoc.scripts.netcorr import CorrStats, clr, stats_path, correlation_network, rho_cutoff, \
+    edge_number_network
+
+rng = np.random.default_rng(5)
+counts = rng.poisson(20, (8, 30)).astype(float)
+counts[1] = counts[0] * 2 + rng.poisson(2, 30)
+taxa = ['OTU_' + str(i) for i in range(8)]
+samples = ['Sample' + str(i) for i in range(30)]
+table = biom.Table(counts, taxa, samples)
+
+
+class TestNetCorr(unittest.TestCase):
+    """Tests netcorr.
+    More specifically, checks whether statistics updated with new samples
+    give the same correlations as statistics computed from all samples.
+    """
+
+    def test_correlation(self):
+        """Checks whether correlations match those computed directly."""
+        stats = CorrStats.from_table(table)
+        self.assertTrue(np.allclose(stats.correlation(), np.corrcoef(clr(counts))))
+
+    def test_update(self):
+        """Checks whether only new samples are added to the statistics."""
+        stats = CorrStats.from_table(table.filter(samples[:20], axis='sample', inplace=False))
+        self.assertTrue(stats.matches(table))
+        self.assertEqual(stats.update(table), 10)
+        self.assertEqual(stats.update(table), 0)
+        full = CorrStats.from_table(table)
+        self.assertTrue(np.allclose(stats.correlation(), full.correlation()))
+        self.assertFalse(stats.matches(table.filter(taxa[:7], axis='observation', inplace=False)))
+        self.assertFalse(stats.matches(table.filter(samples[1:], axis='sample', inplace=False)))
+
+    def test_aggregate(self):
+        """Checks whether statistics of aggregated taxa match
+        those computed from the summed counts."""
+        stats = CorrStats.from_table(table, ['Genus_1', 'Genus_2'], [taxa[:3], taxa[3:]])
+        summed = np.vstack([counts[:3].sum(axis=0), counts[3:].sum(axis=0)])
+        collapsed = CorrStats.from_table(biom.Table(summed, ['Genus_1', 'Genus_2'], samples))
+        self.assertEqual(stats.nodes, ['Genus_1', 'Genus_2'])
+        self.assertTrue(np.allclose(stats.covariance(), np.cov(clr(summed))))
+        self.assertTrue(np.allclose(stats.correlation(), collapsed.correlation()))
+
+    def test_network(self):
+        """Checks whether strongly correlated taxa are connected."""
+        folder = tempfile.mkdtemp()
+        CorrStats.from_table(table).write_hdf5(stats_path(folder, 'pearson_otu_test'))
+        stats = CorrStats.read_hdf5(stats_path(folder, 'pearson_otu_test'))
+        shutil.rmtree(folder)
+        self.assertEqual(stats.n, 30)
+        network = stats.network(0.001)
+        edge = np.nonzero((network.src == 0) & (network.dst == 1))[0]
+        self.assertEqual(len(edge), 1)
+        self.assertEqual(network.sign[edge[0]], 1)
+        self.assertEqual(CorrStats(taxa).network().number_of_edges(), 0)
+
+
+    def test_correlation_network(self):
+        """Checks whether blocked correlations give the same network
+        as correlations computed at once, with one or more processes."""
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, 'edges.h5')
+        full = CorrStats.from_table(table).network(0.01)
+        for cores in [1, 2]:
+            network = correlation_network(counts, taxa, path, pval_threshold=0.01, block=3, cores=cores)
+            self.assertEqual(set(zip(network.src.tolist(), network.dst.tolist(), network.sign.tolist())),
+                             set(zip(full.src.tolist(), full.dst.tolist(), full.sign.tolist())))
+        network = correlation_network(counts, taxa, path, method='spearman', threshold=0.5, block=3)
+        rho = spearmanr(clr(counts).T)[0]
+        self.assertTrue(np.allclose(network.weight, rho[network.src, network.dst]))
+        self.assertEqual(network.number_of_edges(), int(np.sum(np.abs(np.triu(rho, 1)) >= 0.5)))
+        self.assertEqual(os.listdir(folder), ['edges.h5'])
+        shutil.rmtree(folder)
+
+    def test_rho_cutoff(self):
+        """Checks whether the proportionality threshold is the same with one or more processes,
+        and whether the network at the threshold keeps the proportional pair."""
+        folder = tempfile.mkdtemp()
+        cutoff = rho_cutoff(counts, fdr=0.1, permutations=5, block=3, seed=1, folder=folder)
+        self.assertEqual(rho_cutoff(counts, fdr=0.1, permutations=5, block=3, cores=2,
+                                    seed=1, folder=folder), cutoff)
+        self.assertLess(cutoff, 1)
+        self.assertEqual(os.listdir(folder), [])
+        network = correlation_network(counts, taxa, os.path.join(folder, 'edges.h5'),
+                                      method='rho', threshold=cutoff, block=3)
+        shutil.rmtree(folder)
+        values = clr(counts)
+        variances = np.var(values, axis=1)
+        rho = 1 - np.var(values[:, np.newaxis] - values[np.newaxis], axis=2) / \
+            (variances[:, np.newaxis] + variances[np.newaxis])
+        self.assertTrue(np.allclose(network.weight, rho[network.src, network.dst]))
+        self.assertIn((0, 1), set(zip(network.src.tolist(), network.dst.tolist())))
+        # pairs with negative proportionality are not kept
+        negative = np.triu(rho, 1) <= -cutoff
+        self.assertTrue(np.any(negative))
+        self.assertTrue(np.all(network.weight > 0))
+        self.assertEqual(network.number_of_edges(), int(np.sum(np.triu(rho, 1) >= cutoff)))
+        folder = tempfile.mkdtemp()
+        network, lower, upper = edge_number_network(counts, taxa, 6, method='rho', block=3, folder=folder)
+        shutil.rmtree(folder)
+        self.assertIsNone(lower)
+        self.assertTrue(np.allclose(np.sort(network.weight), np.sort(rho[np.triu_indices(8, 1)])[-6:]))
+    def test_edge_number(self):
+        """Checks whether the network with a number of edges has the pairs
+        with the highest and lowest correlations, with one or more processes."""
+        folder = tempfile.mkdtemp()
+        values = np.corrcoef(clr(counts))[np.triu_indices(8, 1)]
+        values.sort()
+        for cores in [1, 2]:
+            network, lower, upper = edge_number_network(counts, taxa, 6, block=3, cores=cores, folder=folder)
+            self.assertEqual(network.number_of_edges(), 6)
+            self.assertTrue(np.allclose(np.sort(network.weight), np.concatenate([values[:3], values[-3:]])))
+            self.assertTrue(np.allclose([lower, upper], [values[2], values[-3]]))
+        self.assertEqual(os.listdir(folder), [])
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
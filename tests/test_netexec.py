@@ -0,0 +1,128 @@
+"""
+This file contains all testing functions for netexec.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from time import time
+
+from massoc.scripts.netexec import JobSupervisor, ToolError, cancel_jobs, cancel_path, clear_cancel
+
+python = '"' + sys.executable + '"'
+
+
+class TestNetExec(unittest.TestCase):
+    """Tests netexec.
+    More specifically, checks whether commands are stopped
+    when they exceed their limits or are cancelled.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_call(self):
+        """Checks whether the exit code of a command is returned."""
+        supervisor = JobSupervisor()
+        code = supervisor.call(python + ' -c "import sys; sys.exit(3)"')
+        self.assertEqual(code, 3)
+
+    def test_timeout(self):
+        """Checks whether a command that runs too long is killed,
+        including the child processes it started."""
+        supervisor = JobSupervisor(timeout=1, interval=0.1)
+        cmd = python + ' -c "import subprocess, sys; ' \
+                       'subprocess.call([sys.executable, \'-c\', \'import time; time.sleep(30)\'])"'
+        start = time()
+        with self.assertRaises(ToolError) as error:
+            supervisor.call(cmd)
+        self.assertEqual(error.exception.reason, 'timeout')
+        self.assertLess(time() - start, 10)
+
+    def test_memory(self):
+        """Checks whether a command that uses too much memory is killed."""
+        supervisor = JobSupervisor(max_memory=50, interval=0.1)
+        cmd = python + ' -c "import time; data = bytearray(200 * 1024 * 1024); time.sleep(30)"'
+        with self.assertRaises(ToolError) as error:
+            supervisor.call(cmd)
+        self.assertEqual(error.exception.reason, 'memory')
+
+    def test_cancel(self):
+        """Checks whether a cancelled job does not start new commands."""
+        supervisor = JobSupervisor(cancel=cancel_path(self.folder))
+        cancel_jobs(self.folder)
+        self.assertTrue(os.path.isfile(cancel_path(self.folder)))
+        with self.assertRaises(ToolError) as error:
+            supervisor.call(python + ' -c "print(1)"')
+        self.assertEqual(error.exception.reason, 'cancelled')
+
+    def test_clear_cancel(self):
+        """Checks whether only cancellation files from before the run started are removed."""
+        started = time()
+        cancel_jobs(self.folder)
+        self.assertFalse(clear_cancel(self.folder, started - 60))
+        self.assertTrue(os.path.isfile(cancel_path(self.folder)))
+        os.utime(cancel_path(self.folder), (started - 120, started - 120))
+        self.assertTrue(clear_cancel(self.folder, started - 60))
+        self.assertFalse(os.path.isfile(cancel_path(self.folder)))
+        self.assertFalse(clear_cancel(self.folder, started))
+
+    def test_run(self):
+        """Checks whether output is logged with the job name
+        and whether failed commands raise a ToolError."""
+        supervisor = JobSupervisor()
+        with self.assertLogs('massoc.scripts.netexec') as logs:
+            supervisor.run([sys.executable, '-c', 'import sys; print("hello"); sys.stderr.write("world")'],
+                           tag='sparcc_genus_test')
+        self.assertIn('[sparcc_genus_test] hello', logs.output[0])
+        self.assertIn('[sparcc_genus_test] stderr: world', logs.output[1])
+        with self.assertRaises(ToolError) as error:
+            supervisor.run([sys.executable, '-c', 'import sys; sys.exit(3)'])
+        self.assertEqual(error.exception.reason, 'exit')
+        with self.assertRaises(ToolError) as error:
+            supervisor.run([sys.executable, '-c', 'print(1)'],
+                           artifacts=[os.path.join(self.folder, 'network.txt')])
+        self.assertEqual(error.exception.reason, 'output')
+
+    def test_run_many(self):
+        """Checks whether commands run at the same time,
+        and whether the other commands are stopped when one fails."""
+        supervisor = JobSupervisor(concurrency=4)
+        cmd = [sys.executable, '-c', 'import time; time.sleep(1)']
+        start = time()
+        supervisor.run_many([{'cmd': cmd} for i in range(4)])
+        self.assertLess(time() - start, 3.5)
+        commands = [{'cmd': [sys.executable, '-c', 'import sys; sys.exit(1)']}] + \
+                   [{'cmd': [sys.executable, '-c', 'import time; time.sleep(30)']} for i in range(3)]
+        start = time()
+        with self.assertRaises(ToolError):
+            supervisor.run_many(commands)
+        self.assertLess(time() - start, 10)
+
+    def test_scratch_dir(self):
+        """Checks whether scratch directories are separate
+        and removed when the job fails."""
+        supervisor = JobSupervisor(scratch=self.folder)
+        with self.assertRaises(ValueError):
+            with supervisor.scratch_dir('sparcc_genus_test') as first:
+                with supervisor.scratch_dir('sparcc_genus_test') as second:
+                    self.assertNotEqual(first, second)
+                    open(os.path.join(first, 'cov_mat_SparCC.out'), 'w').close()
+                raise ValueError
+        self.assertFalse(os.path.isdir(first))
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+This file contains all testing functions for netnull.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import unittest
+import numpy as np
+import networkx as nx
+
+from massoc.scripts.netarray import NetArray
+from massoc.scripts.netnull import randomize, overlap_statistics, null_model
+
+
+def _random_network(seed, n=40, m=120):
+    graph = nx.gnm_random_graph(n, m, seed=seed)
+    nx.relabel_nodes(graph, {i: 'OTU_' + str(i) for i in graph.nodes}, copy=False)
+    for u, v in graph.edges:
+        graph[u][v]['weight'] = 1.0
+    return NetArray.from_networkx(graph)
+
+
+class TestNetNull(unittest.TestCase):
+    """Tests netnull.
+    More specifically, checks whether randomizations preserve degrees
+    and whether overlapping networks get small p-values.
+    """
+
+    def test_randomize(self):
+        """Checks whether a randomized network has the same degrees,
+        but no self-loops or duplicate edges."""
+        network = _random_network(1)
+        randomized = randomize(network, seed=3)
+        n = len(network.nodes)
+        self.assertTrue(np.array_equal(
+            np.bincount(np.concatenate([network.src, network.dst]), minlength=n),
+            np.bincount(np.concatenate([randomized.src, randomized.dst]), minlength=n)))
+        self.assertFalse(np.any(randomized.src == randomized.dst))
+        keys = np.minimum(randomized.src, randomized.dst) * n + np.maximum(randomized.src, randomized.dst)
+        self.assertEqual(len(np.unique(keys)), network.number_of_edges())
+        original = set(np.minimum(network.src, network.dst) * n + np.maximum(network.src, network.dst))
+        self.assertLess(len(original.intersection(keys)), network.number_of_edges())
+
+    def test_overlap_statistics(self):
+        """Checks whether union, intersection and difference sizes are correct."""
+        network = _random_network(1)
+        stats = overlap_statistics([network, network], num=[1])
+        self.assertEqual(stats['union'], network.number_of_edges())
+        self.assertEqual(stats['intersection'], network.number_of_edges())
+        self.assertEqual(stats['difference'], 0)
+        self.assertEqual(stats['intersection_1'], network.number_of_edges())
+
+    def test_null_model(self):
+        """Checks whether identical networks overlap more than expected,
+        while unrelated networks do not."""
+        network = _random_network(1)
+        same = null_model([network, network], n=19, seed=5)
+        self.assertAlmostEqual(same['intersection']['p'], 0.05)
+        self.assertAlmostEqual(same['union']['p'], 0.05)
+        other = null_model([network, _random_network(2)], n=19, seed=5)
+        self.assertGreater(other['intersection']['p'], 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+This file contains all testing functions for netqueue.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing as mp
+from time import time, sleep
+
+from massoc.scripts.netqueue import FileQueue, work
+
+
+def square(job, metadata):
+    """Job that returns the square of a number."""
+    sleep(0.05)
+    return {'value': job * job, 'pid': os.getpid()}
+
+
+def crash_once(job, metadata):
+    """Job that stops the worker the first time it is run."""
+    marker = os.path.join(metadata['folder'], 'crashed')
+    if not os.path.isfile(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return {'value': job}
+
+
+def collect(queue, number, timeout=30):
+    """Collects results like the submitting process does."""
+    results = dict()
+    start = time()
+    while len(results) < number and time() - start < timeout:
+        results.update(queue.collect())
+        queue.requeue_stalled()
+        sleep(0.05)
+    queue.finish()
+    return results
+
+
+class TestNetQueue(unittest.TestCase):
+    """Tests netqueue.
+    More specifically, checks whether jobs are claimed once by multiple workers
+    and whether jobs of crashed workers are put back in the queue.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_workers(self):
+        """Checks whether several worker processes complete all jobs exactly once."""
+        queue = FileQueue(self.folder, heartbeat=0.1, stale=5)
+        queue.start()
+        for i in range(12):
+            queue.submit('job_' + str(i), i)
+        workers = [mp.Process(target=work, args=(self.folder, square), kwargs={'poll': 0.05})
+                   for i in range(3)]
+        for worker in workers:
+            worker.start()
+        results = collect(queue, 12)
+        for worker in workers:
+            worker.join(10)
+            self.assertEqual(worker.exitcode, 0)
+        self.assertEqual({name: results[name]['value'] for name in results},
+                         {'job_' + str(i): i * i for i in range(12)})
+        self.assertEqual(os.listdir(os.path.join(self.folder, 'running')), [])
+
+    def test_claim(self):
+        """Checks whether a job can only be claimed once."""
+        queue = FileQueue(self.folder)
+        queue.start()
+        queue.submit('job', 1)
+        other = FileQueue.open(self.folder)
+        self.assertEqual(queue.claim()['job'], 1)
+        self.assertIsNone(other.claim())
+
+    def test_requeue(self):
+        """Checks whether jobs without heartbeat are put back in the queue,
+        and fail after the maximum number of attempts."""
+        queue = FileQueue(self.folder, stale=0, attempts=2)
+        queue.start()
+        queue.submit('job', 1)
+        queue.claim()
+        self.assertEqual(queue.requeue_stalled(), [])
+        self.assertEqual(queue.requeue_stalled(), ['job'])
+        record = queue.claim()
+        self.assertEqual(record['attempt'], 1)
+        queue.requeue_stalled()
+        queue.requeue_stalled()
+        self.assertEqual(queue.pending(), 0)
+        self.assertEqual(queue.collect()['job']['reason'], 'stalled')
+
+    def test_requeue_owner(self):
+        """Checks whether a worker whose job was put back in the queue
+        does not report a result or remove the files of the new claim."""
+        queue = FileQueue(self.folder, stale=0)
+        queue.start()
+        queue.submit('job', 1)
+        queue.claim()
+        queue.requeue_stalled()
+        self.assertEqual(queue.requeue_stalled(), ['job'])
+        self.assertEqual(os.listdir(os.path.join(self.folder, 'running')), [])
+        self.assertFalse(queue.complete('job', {'value': 1}))
+        queue.claim()
+        with open(os.path.join(self.folder, 'running', 'job.heartbeat'), 'w') as file:
+            file.write('other:1')
+        self.assertFalse(queue.complete('job', {'value': 1}))
+        self.assertEqual(queue.collect(), dict())
+        self.assertEqual(sorted(os.listdir(os.path.join(self.folder, 'running'))),
+                         ['job.heartbeat', 'job.job'])
+
+    def test_crash(self):
+        """Checks whether the job of a crashed worker is run by another worker."""
+        queue = FileQueue(self.folder, heartbeat=0.1, stale=0.5)
+        queue.start({'folder': self.folder})
+        queue.submit('job', 7)
+        crashed = mp.Process(target=work, args=(self.folder, crash_once), kwargs={'poll': 0.05})
+        crashed.start()
+        crashed.join(10)
+        self.assertEqual(crashed.exitcode, 1)
+        worker = mp.Process(target=work, args=(self.folder, crash_once), kwargs={'poll': 0.05})
+        worker.start()
+        results = collect(queue, 1)
+        worker.join(10)
+        self.assertEqual(results, {'job': {'value': 7}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+This file contains all testing functions for netstable.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import unittest
+import numpy as np
+
+from massoc.scripts.netarray import NetArray
+from massoc.scripts.netstable import EdgeStability, edge_stability
+
+nodes = ['OTU_' + str(i) for i in range(5)]
+rng = np.random.default_rng(3)
+weights = rng.uniform(-1, 1, (20, 10))
+present = rng.uniform(0, 1, (20, 10)) > 0.4
+first, second = np.triu_indices(5, 1)
+
+
+def _networks():
+    """Generates networks with a random subset of the ten possible edges."""
+    for i in range(len(weights)):
+        keep = present[i]
+        yield NetArray(nodes, first[keep], second[keep], weights[i][keep])
+
+
+class TestNetStable(unittest.TestCase):
+    """Tests netstable.
+    More specifically, checks whether statistics updated one network at a time
+    match statistics computed from all networks at once.
+    """
+
+    def test_statistics(self):
+        """Checks whether frequencies, means and variances match numpy."""
+        stability = edge_stability(_networks())
+        values = np.where(present, weights, 0)
+        n = np.int64(len(nodes))
+        order = np.argsort(first * n + second)
+        seen = present.any(axis=0)[order]
+        self.assertEqual(stability.n, 20)
+        self.assertTrue(np.allclose(stability.frequency(), present.mean(axis=0)[order][seen]))
+        self.assertTrue(np.allclose(stability.mean, values.mean(axis=0)[order][seen]))
+        self.assertTrue(np.allclose(stability.variance(), values.var(axis=0, ddof=1)[order][seen]))
+
+    def test_annotate(self):
+        """Checks whether edges with reversed or reordered nodes get the same statistics,
+        and whether edges that were never seen get a stability of 0."""
+        stability = EdgeStability(nodes)
+        stability.update(NetArray(nodes, [0, 1], [1, 2], [0.5, -0.5]))
+        stability.update(NetArray(nodes[::-1], [3], [4], [0.7]))
+        network = stability.annotate(NetArray(nodes, [1, 3], [0, 4], [1, 1]))
+        self.assertEqual(network.edge_attributes['stability'].tolist(), [1, 0])
+        self.assertTrue(np.allclose(network.edge_attributes['weight_mean'], [0.6, 0]))
+        self.assertTrue(np.allclose(network.edge_attributes['weight_sd'], [np.std([0.5, 0.7], ddof=1), 0]))
+        stable = stability.network(frequency=1)
+        self.assertEqual(stable.number_of_edges(), 1)
+        self.assertEqual(stable.to_networkx().edges['OTU_0', 'OTU_1']['stability'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+This file contains all testing functions for netsweep.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas
+
+from massoc.scripts.netarray import read_triplets
+from massoc.scripts.netsweep import EdgeScores, EdgeSelector, scores_path, threshold_sweep
+
+nodes = ['OTU_' + str(i) for i in range(6)]
+rng = np.random.default_rng(2)
+corrs = rng.uniform(-1, 1, (6, 6))
+corrs = (corrs + corrs.T) / 2
+np.fill_diagonal(corrs, 1)
+pvals = rng.uniform(0, 0.1, (6, 6))
+pvals = (pvals + pvals.T) / 2
+np.fill_diagonal(pvals, 1)
+
+
+class TestNetSweep(unittest.TestCase):
+    """Tests netsweep.
+    More specifically, checks whether networks derived from sorted scores
+    match networks thresholded directly.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.corrs = os.path.join(self.folder, 'corrs.tsv')
+        self.pvals = os.path.join(self.folder, 'pvals.tsv')
+        pandas.DataFrame(corrs, index=nodes, columns=nodes).to_csv(self.corrs, sep='\t')
+        pandas.DataFrame(pvals, index=nodes, columns=nodes).to_csv(self.pvals, sep='\t')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_network(self):
+        """Checks whether the network at each threshold has the same edges
+        as the network read with a p-value mask."""
+        scores = EdgeScores.read_matrices(self.corrs, self.pvals, chunksize=4)
+        for threshold in [0.01, 0.03, 0.05, 0.2]:
+            network = scores.network(threshold)
+            triplets = read_triplets(self.corrs, mask=self.pvals, threshold=threshold)
+            self.assertEqual(set(zip(network.src, network.dst, network.sign)),
+                             set(zip(triplets[1], triplets[2], np.sign(triplets[3]).astype(np.int8))))
+        self.assertEqual(scores.network(edges=3).number_of_edges(), 3)
+
+    def test_sweep(self):
+        """Checks whether edge counts and densities are reported per threshold."""
+        scores = EdgeScores.read_matrices(self.corrs, self.pvals)
+        scores.write_hdf5(scores_path(self.folder, 'sparcc_genus_test'))
+        results = threshold_sweep(self.folder, ['sparcc_genus_test'], [0.2, 0.01])
+        rows = results['sparcc_genus_test']
+        self.assertEqual([row['threshold'] for row in rows], [0.01, 0.2])
+        self.assertEqual(rows[1]['edges'], 15)
+        self.assertEqual(rows[1]['density'], 1)
+        self.assertEqual(rows[0]['edges'], int(np.sum(np.triu(pvals, 1)[np.triu_indices(6, 1)] < 0.01)))
+        self.assertTrue(os.path.isfile(os.path.join(self.folder, 'threshold_sweep.txt')))
+
+    def test_selector(self):
+        """Checks whether pairs selected from blocks are the pairs
+        with the highest or lowest scores of all pairs."""
+        first, second = np.triu_indices(6, 1)
+        scores = corrs[first, second]
+        order = np.argsort(scores)
+        for largest, expected in [(True, order[::-1][:4]), (False, order[:4])]:
+            selector = EdgeSelector(4, largest=largest)
+            for start in range(0, len(scores), 4):
+                selector.add(first[start:start + 4], second[start:start + 4], scores[start:start + 4])
+            rows, cols, selected = selector.edges()
+            self.assertEqual(selected.tolist(), scores[expected].tolist())
+            self.assertEqual(rows.tolist(), first[expected].tolist())
+            self.assertEqual(selector.threshold(), scores[expected[-1]])
+        selector = EdgeSelector(4)
+        selector.add([0, 1], [1, 2], [np.nan, 0.5])
+        self.assertEqual(len(selector), 1)
+        self.assertIsNone(EdgeSelector(4).threshold())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+This file contains all testing functions for networker.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from massoc.scripts.netexec import JobSupervisor, ToolError
+from massoc.scripts.networker import WarmWorker, WorkerExit, get_worker, stop_workers, run_warm
+
+stub = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_worker.py')]
+
+
+class TestNetWorker(unittest.TestCase):
+    """Tests networker.
+    More specifically, checks whether jobs are sent to a single worker process
+    and whether the worker is started again after it crashes or is stopped.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.worker = WarmWorker(stub, 'stub')
+
+    def tearDown(self):
+        self.worker.stop()
+        shutil.rmtree(self.folder)
+
+    def test_request(self):
+        """Checks whether multiple jobs are run by the same process."""
+        for i in range(3):
+            self.worker.request(['write', os.path.join(self.folder, str(i))])
+        self.assertEqual(sorted(os.listdir(self.folder)), ['0', '1', '2'])
+        self.assertEqual(self.worker.restarts, 0)
+        self.assertTrue(self.worker.alive())
+
+    def test_error(self):
+        """Checks whether failed jobs raise a ToolError without stopping the worker."""
+        self.worker.request(['sleep', '0'])
+        pid = self.worker.process.pid
+        with self.assertRaises(ToolError):
+            self.worker.request(['fail'])
+        self.assertEqual(self.worker.process.pid, pid)
+
+    def test_restart(self):
+        """Checks whether a crashed worker is started again by the next job."""
+        self.worker.request(['sleep', '0'])
+        with self.assertRaises(ToolError) as error:
+            self.worker.request(['crash'])
+        self.assertEqual(error.exception.reason, 'exit')
+        self.worker.request(['write', os.path.join(self.folder, 'network')])
+        self.assertEqual(self.worker.restarts, 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.folder, 'network')))
+
+    def test_exit(self):
+        """Checks whether a job is run without the worker
+        if the worker stops before it answers,
+        and whether the next job is run after the worker exits."""
+        cold = list()
+
+        def write(name):
+            cold.append(name)
+            open(os.path.join(self.folder, name), 'w').close()
+
+        run_warm(self.worker, [['exit']], None, lambda: write('exit'))
+        run_warm(self.worker, [['write', os.path.join(self.folder, 'first')]], None, lambda: write('first'))
+        with self.assertRaises(WorkerExit):
+            self.worker.request(['crash'])
+        run_warm(self.worker, [['crash']], None, lambda: write('crash'))
+        self.assertEqual(sorted(os.listdir(self.folder)), ['crash', 'first'])
+        self.assertIn('crash', cold)
+        self.assertNotIn('exit', cold)
+        # the worker stopped during the maximum number of jobs, so it is not started again
+        restarts = self.worker.restarts
+        run_warm(self.worker, [['write', os.path.join(self.folder, 'second')]], None, lambda: write('second'))
+        self.assertEqual(self.worker.restarts, restarts)
+        self.assertEqual(cold[-1], 'second')
+
+    def test_timeout(self):
+        """Checks whether the worker is stopped if a job exceeds its time limit."""
+        supervisor = JobSupervisor(timeout=0.5, interval=0.1)
+        with self.assertRaises(ToolError) as error:
+            self.worker.request(['sleep', '10'], supervisor)
+        self.assertEqual(error.exception.reason, 'timeout')
+        self.assertFalse(self.worker.alive())
+
+    def test_get_worker(self):
+        """Checks whether workers are reused within a process."""
+        worker = get_worker('stub', stub)
+        self.assertIs(get_worker('stub', stub), worker)
+        worker.request(['sleep', '0'])
+        stop_workers()
+        self.assertFalse(worker.alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
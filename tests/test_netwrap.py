@@ -10,13 +10,22 @@ __license__ = 'Apache 2.0'
 
 import os
 import random
+import shutil
+import tempfile
 import unittest
 from copy import deepcopy
 from subprocess import call
 
 import biom
+import numpy
+import networkx as nx
 from massoc.scripts.batch import Batch
-from massoc.scripts.netwrap import Nets, run_spiec, run_spar, run_conet, run_jobs, get_joblist
+from massoc.scripts.netarray import NetArray
+from massoc.scripts.netcorr import CorrStats, stats_path
+from massoc.scripts.netwrap import Nets, run_spiec, run_spar, run_conet, run_pearson, run_jobs, get_joblist, \
+    run_correlation, run_rho, \
+    _estimate_cost, _resume_jobs, _write_checkpoint, _add_tax, _get_taxonomy, \
+    _write_context, _init_worker, _job_context, _taxonomy, _conet_arguments, run_tasks, Job, Task
 
 import massoc
 from massoc.scripts.main import run_parallel
@@ -210,11 +219,25 @@ class TestNetWrap(unittest.TestCase):
                 call(("rm " + file))
         self.assertEqual(len(network), 2)
 
+    def test_conet_arguments(self):
+        """
+        Checks whether the calls of the CoNet script are sent to the warm worker.
+        """
+        script = os.path.join(os.path.dirname(massoc.__file__), 'data', 'CoNet.sh')
+        calls = _conet_arguments(script, 'counts.txt', 'network.tsv', 'scratch/otu_test', '12')
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(calls[0][:2], ['--method', 'ensemble'])
+        self.assertEqual(calls[0][calls[0].index('--output') + 1], 'scratch/otu_test_threshold')
+        self.assertEqual(calls[1][calls[1].index('--output') + 1], 'scratch/otu_test_permnet')
+        self.assertEqual(calls[2][calls[2].index('--guessingparam') + 1], '12')
+        self.assertEqual(calls[3][calls[3].index('--output') + 1], 'network.tsv')
+        self.assertTrue(all(call[call.index('--input') + 1] == 'counts.txt' for call in calls))
+
     def test_get_joblist(self):
         """
         Checks whether the joblist function
-        returns a joblist in the appropriate format:
-        list of dicts with each only 1 key.
+        returns one job per tool and taxonomic level,
+        without jobs for settings.
         """
         inputs = {'biom_file': None,
                   'cluster': None,
@@ -225,10 +248,10 @@ class TestNetWrap(unittest.TestCase):
                   'tax_table': [(testloc + 'otu_tax.txt')],
                   'fp': testloc,
                   'otu_table': [(testloc + 'otu_otus.txt')],
-                  'tools': ['spiec-easi', 'conet'],
+                  'tools': ['spiec-easi', 'conet', 'conet'],
                   'spiec': ['somefile.txt'],
                   'conet': None,
-                  'spar_pval': None,
+                  'spar_pval': 0.01,
                   'spar_boot': None,
                   'levels': ['family', 'class'],
                   'prev': ['20'],
@@ -245,7 +268,297 @@ class TestNetWrap(unittest.TestCase):
         call("rm " + filename)
         filename = netbatch.inputs['fp'] + '/spiec-easi_family_test.txt'
         call("rm " + filename)
-        self.assertEqual(len(jobs), 6)
+        self.assertEqual(len(jobs), 4)
+        self.assertEqual(set([job.tool for job in jobs]), {'spiec-easi', 'conet'})
+        self.assertEqual(jobs[0].settings, {'settings': 'somefile.txt'})
+        self.assertIn(Task('conet_table', 'family', 'test'), jobs[1].requires)
+
+    def test_estimate_cost(self):
+        """
+        Checks whether jobs on larger tables and jobs
+        with more bootstraps are estimated to take longer.
+        """
+        testnets = Batch(deepcopy(testbiom), deepcopy(inputs))
+        testnets.collapse_tax()
+        otu_job = _estimate_cost(Job('otu', 'sparcc', 'test', (), ()), testnets)
+        order_job = _estimate_cost(Job('order', 'sparcc', 'test', (), ()), testnets)
+        boot_job = _estimate_cost(Job('otu', 'sparcc', 'test', (('boots', 1000),), ()), testnets)
+        for level in ['otu', 'order']:
+            call(("rm " + testnets.inputs['fp'] + '/test_' + level + '.hdf5'), shell=True)
+        self.assertGreater(otu_job, order_job)
+        self.assertGreater(boot_job, otu_job)
+
+    def test_resume_jobs(self):
+        """
+        Checks whether completed jobs are read from disk
+        and only the other jobs are returned.
+        """
+        testnets = deepcopy(netbatch)
+        testnets.write_bioms()
+        testnets.inputs['procbioms'] = testnets.get_filenames()
+        network = nx.Graph()
+        network.add_edge('GG_OTU_1', 'GG_OTU_2', weight=1.0)
+        _write_checkpoint(testnets.inputs['fp'], 'spiec-easi_otu_test', NetArray.from_networkx(network))
+        journal = {'spiec-easi_otu_test': {'status': 'completed',
+                                           'networks': ['spiec-easi_otu_test']},
+                   'spiec-easi_order_test': {'status': 'failed', 'error': ''}}
+        jobs = _resume_jobs(testnets, [Job('otu', 'spiec-easi', 'test', (), ()),
+                                       Job('order', 'spiec-easi', 'test', (), ())], journal)
+        resumed = testnets.networks['spiec-easi_otu_test']
+        testnets.networks['spiec-easi_otu_test'] = NetArray(['GG_OTU_1', 'GG_OTU_3'], [0], [1], [-1.0])
+        testnets.write_networks()
+        copy = NetArray.read_hdf5(testnets.inputs['fp'] + '/spiec-easi_otu_test.h5')
+        for level in ['otu', 'order']:
+            call(("rm " + testnets.inputs['fp'] + '/test_' + level + '.hdf5'), shell=True)
+        call(("rm " + testnets.inputs['fp'] + '/spiec-easi_otu_test.h5'), shell=True)
+        self.assertEqual(jobs, [Job('order', 'spiec-easi', 'test', (), ())])
+        self.assertNotIsInstance(resumed.src, numpy.memmap)
+        self.assertEqual(resumed.number_of_edges(), 1)
+        self.assertEqual(resumed.weight.tolist(), [1.0])
+        self.assertEqual(copy.nodes, ['GG_OTU_1', 'GG_OTU_3'])
+        self.assertEqual(copy.weight.tolist(), [-1.0])
+
+    def test_run_tasks(self):
+        """
+        Checks whether preparation tasks shared by jobs
+        write the inputs of each tool once per BIOM file.
+        """
+        testnets = Batch(deepcopy(testbiom), deepcopy(inputs))
+        testnets.collapse_tax()
+        testnets.inputs['procbioms'] = testnets.get_filenames()
+        testnets.inputs['tools'] = ['conet', 'sparcc']
+        testnets.inputs['spar_boot'] = None
+        testnets.inputs['spar_pval'] = None
+        jobs = get_joblist(testnets)
+        _taxonomy.clear()
+        orig_ids, obs_ids = run_tasks(testnets, jobs, cores=2)
+        filename = testnets.inputs['procbioms']['otu']['test']
+        file = biom.load_table(filename)
+        with open(filename[:-5] + '_otus_sparcc.txt', 'r') as table:
+            sparcc = table.read()
+        with open(filename[:-5] + '_counts_conet.txt', 'r') as table:
+            conet = table.read()
+        for level in ['otu', 'order']:
+            prefix = testnets.inputs['fp'] + '/test_' + level
+            for suffix in ['.hdf5', '_otus_sparcc.txt', '_counts_conet.txt']:
+                os.remove(prefix + suffix)
+        self.assertEqual(sparcc.splitlines(), file.to_tsv().splitlines()[1:])
+        self.assertEqual(conet.splitlines()[0], 'ID\t' + '\t'.join(file.ids(axis='sample')))
+        self.assertEqual(orig_ids['otu']['test']['otu-0'], file.ids(axis='observation')[0])
+        self.assertEqual(list(obs_ids['order']['test']),
+                         list(testnets.levels['order']['test'].ids(axis='observation')))
+        self.assertIn(filename, _taxonomy)
+
+    def test_run_pearson(self):
+        """
+        Checks whether statistics from a previous run
+        are updated with new samples instead of computed again.
+        """
+        folder = tempfile.mkdtemp()
+        table = deepcopy(testbiom['otu']['test'])
+        filename = folder + '/test_otu.hdf5'
+        first = table.filter(['Sample1', 'Sample2', 'Sample3', 'Sample4'], axis='sample', inplace=False)
+        with biom.util.biom_open(filename, 'w') as file:
+            first.to_hdf5(file, 'test')
+        run_pearson({'otu': {'test': filename}}, stats=folder)
+        with biom.util.biom_open(filename, 'w') as file:
+            table.to_hdf5(file, 'test')
+        networks = run_pearson({'otu': {'test': filename}}, pval_threshold=0.5, stats=folder)
+        stats = CorrStats.read_hdf5(stats_path(folder, 'pearson_otu_test'))
+        full = CorrStats.from_table(table)
+        shutil.rmtree(folder)
+        self.assertEqual(stats.samples, ['Sample1', 'Sample2', 'Sample3', 'Sample4',
+                                         'Sample5', 'Sample6'])
+        self.assertTrue(numpy.allclose(stats.correlation(), full.correlation()))
+        self.assertEqual(networks['pearson_otu_test'].number_of_edges(),
+                         full.network(0.5).number_of_edges())
+
+    def test_correlation_stability(self):
+        """
+        Checks whether bootstraps add edge stability to correlation networks.
+        """
+        folder = tempfile.mkdtemp()
+        filename = folder + '/test_otu.hdf5'
+        with biom.util.biom_open(filename, 'w') as file:
+            testbiom['otu']['test'].to_hdf5(file, 'test')
+        networks = run_correlation({'otu': {'test': filename}}, method='spearman',
+                                   pval_threshold=0.5, boots=5)
+        shutil.rmtree(folder)
+        network = networks['spearman_otu_test']
+        self.assertEqual(sorted(network.edge_attributes), ['stability', 'weight_mean', 'weight_sd'])
+        self.assertTrue(numpy.all((network.edge_attributes['stability'] >= 0) &
+                                  (network.edge_attributes['stability'] <= 1)))
+
+    def test_run_rho(self):
+        """
+        Checks whether proportionality networks are signed and annotated.
+        """
+        folder = tempfile.mkdtemp()
+        filename = folder + '/test_otu.hdf5'
+        with biom.util.biom_open(filename, 'w') as file:
+            testbiom['otu']['test'].to_hdf5(file, 'test')
+        networks = run_rho({'otu': {'test': filename}}, fdr=0.5, permutations=5)
+        shutil.rmtree(folder)
+        network = networks['rho_otu_test']
+        self.assertEqual(network.nodes, list(testbiom['otu']['test'].ids(axis='observation')))
+        self.assertTrue(set(network.weight.tolist()) <= {1.0})
+        self.assertIn('Genus', network.attributes)
+
+    def test_derive_levels(self):
+        """
+        Checks whether Pearson networks of higher taxonomic levels
+        are derived from the OTU-level statistics.
+        """
+        testnets = Batch(deepcopy(testbiom), deepcopy(inputs))
+        testnets.collapse_tax()
+        filenames = testnets.get_filenames()
+        networks = run_pearson({'otu': {'test': filenames['otu']['test']}}, pval_threshold=0.5,
+                               derive={'order': filenames['order']})
+        direct = run_pearson({'order': {'test': filenames['order']['test']}}, pval_threshold=0.5)
+        collapsed = biom.load_table(filenames['order']['test'])
+        for level in ['otu', 'order']:
+            call(("rm " + testnets.inputs['fp'] + '/test_' + level + '.hdf5'), shell=True)
+        self.assertEqual(sorted(networks), ['pearson_order_test', 'pearson_otu_test'])
+        self.assertEqual(networks['pearson_order_test'].nodes,
+                         list(collapsed.ids(axis='observation')))
+        self.assertIn('Order', networks['pearson_order_test'].attributes)
+        derived = networks['pearson_order_test']
+        self.assertGreater(derived.number_of_edges(), 0)
+        self.assertEqual(derived.src.tolist(), direct['pearson_order_test'].src.tolist())
+        self.assertEqual(derived.dst.tolist(), direct['pearson_order_test'].dst.tolist())
+        self.assertEqual(derived.weight.tolist(), direct['pearson_order_test'].weight.tolist())
+
+    def test_add_tax(self):
+        """
+        Checks whether taxonomy is added to the network
+        and whether the file is only read once.
+        """
+        testnets = Batch(deepcopy(testbiom), deepcopy(inputs))
+        testnets.write_bioms()
+        filename = testnets.get_filenames()['otu']['test']
+        network = nx.Graph()
+        network.add_edge('GG_OTU_1', 'GG_OTU_2', weight=1.0)
+        network = _add_tax(network, filename)
+        for level in ['otu', 'order']:
+            call(("rm " + testnets.inputs['fp'] + '/test_' + level + '.hdf5'), shell=True)
+        # the removed file is not read again
+        taxonomy = _get_taxonomy(filename)
+        self.assertEqual(network.nodes['GG_OTU_1']['Genus'], taxonomy['GG_OTU_1']['Genus'])
+        self.assertEqual(len(taxonomy), 5)
+
+    def test_init_worker(self):
+        """
+        Checks whether a worker reads the job context
+        and the taxonomy from the context file.
+        """
+        context = {'filenames': {'otu': {'test': 'test_otu.hdf5'}},
+                   'limits': {'timeout': 60},
+                   'taxonomy': {'test_otu.hdf5': {'GG_OTU_1': {'Kingdom': 'k__Bacteria'}}}}
+        path = _write_context(context)
+        _init_worker(path)
+        os.remove(path)
+        self.assertEqual(_job_context['limits'], {'timeout': 60})
+        self.assertNotIn('taxonomy', _job_context)
+        self.assertEqual(_get_taxonomy('test_otu.hdf5')['GG_OTU_1']['Kingdom'], 'k__Bacteria')
+
+    def test_queue_executor(self):
+        """
+        Checks whether networks inferred by queue workers
+        are read into memory and can be written to the same output folder.
+        """
+        testinputs = deepcopy(inputs)
+        testinputs.update({'fp': tempfile.mkdtemp(), 'tools': ['pearson'], 'corr_pval': 0.5,
+                           'executor': 'queue', 'cores': 1, 'cache_size': 0})
+        batch = Batch(deepcopy(testbiom), testinputs)
+        batch.collapse_tax()
+        batch.write_bioms()
+        batch.inputs['procbioms'] = batch.get_filenames()
+        testnets = run_parallel(Nets(batch))
+        network = testnets.networks['pearson_otu_test']
+        self.assertNotIsInstance(network.src, numpy.memmap)
+        edges = network.number_of_edges()
+        testnets.write_networks()
+        copy = NetArray.read_hdf5(testinputs['fp'] + '/pearson_otu_test.h5')
+        shutil.rmtree(testinputs['fp'])
+        self.assertEqual(sorted(testnets.networks), ['pearson_order_test', 'pearson_otu_test'])
+        self.assertEqual(copy.number_of_edges(), edges)
+        self.assertEqual(network.src.tolist(), copy.src.tolist())
+
+    def test_async_executor(self):
+        """
+        Checks whether the async executor reports failed tool jobs
+        and runs the other jobs in the pool.
+        """
+        testinputs = deepcopy(inputs)
+        testinputs.update({'fp': tempfile.mkdtemp(), 'tools': ['sparcc', 'pearson'], 'corr_pval': 0.5,
+                           'spar': tempfile.mkdtemp(), 'spar_boot': 2, 'spar_pval': None,
+                           'executor': 'async', 'cores': 2, 'cache_size': 0})
+        batch = Batch(deepcopy(testbiom), testinputs)
+        batch.collapse_tax()
+        batch.write_bioms()
+        batch.inputs['procbioms'] = batch.get_filenames()
+        testnets = run_parallel(Nets(batch))
+        shutil.rmtree(testinputs['fp'])
+        shutil.rmtree(testinputs['spar'])
+        self.assertEqual(sorted(testnets.networks), ['pearson_order_test', 'pearson_otu_test'])
+        self.assertEqual(sorted(testnets.inputs['failed_jobs']), ['sparcc_order_test', 'sparcc_otu_test'])
+
+    def test_write_networks(self):
+        """
+        Checks whether checkpoints that were not replaced are not written again,
+        and whether other networks are written.
+        """
+        testnets = Nets(Batch(deepcopy(testbiom), deepcopy(inputs)))
+        testnets.inputs['fp'] = tempfile.mkdtemp()
+        network = NetArray(['GG_OTU_1', 'GG_OTU_2'], [0], [1], [1.0])
+        _write_checkpoint(testnets.inputs['fp'], 'spiec-easi_otu_test', network)
+        path = testnets.inputs['fp'] + '/spiec-easi_otu_test.h5'
+        checkpoint = NetArray.read_hdf5(path, mmap=True)
+        testnets.networks['spiec-easi_otu_test'] = checkpoint
+        testnets.checkpoints['spiec-easi_otu_test'] = checkpoint
+        testnets.networks['conet_otu_test'] = network
+        written = os.stat(path).st_ino
+        testnets.write_networks()
+        self.assertEqual(os.stat(path).st_ino, written)
+        testnets.networks['spiec-easi_otu_test'] = NetArray(['GG_OTU_1', 'GG_OTU_3'], [0], [1], [-1.0])
+        testnets.write_networks()
+        copy = NetArray.read_hdf5(path)
+        self.assertEqual(checkpoint.weight.tolist(), [1.0])
+        self.assertEqual(copy.weight.tolist(), [-1.0])
+        self.assertEqual(sorted(os.listdir(testnets.inputs['fp'])),
+                         ['conet_otu_test.h5', 'spiec-easi_otu_test.h5'])
+        shutil.rmtree(testnets.inputs['fp'])
+
+    def test_add_networks(self):
+        """
+        Checks whether nodes that are not in the BIOM files are reported.
+        """
+        testnets = Nets(Batch(deepcopy(testbiom), deepcopy(inputs)))
+        network = nx.Graph()
+        network.add_edge('GG_OTU_1', 'GG_OTU_2', weight=1.0)
+        network.add_edge('GG_OTU_2', 'Unknown_OTU', weight=-1.0)
+        report = testnets.add_networks(network, 'imported')
+        self.assertEqual(report['unmatched'], ['Unknown_OTU'])
+        self.assertEqual(report['matched']['otu'], 2)
+        self.assertEqual(testnets.networks['imported'].number_of_edges(), 2)
+        self.assertIsNone(testnets.add_networks(None, 'missing'))
+        self.assertNotIn('missing', testnets.networks)
+
+    def test_consensus(self):
+        """
+        Checks whether consensus networks are constructed
+        per taxonomic level from the networks of all tools.
+        """
+        testnets = Nets(Batch(deepcopy(testbiom), deepcopy(inputs)))
+        for tool, weight in [('sparcc', 1.0), ('conet', 1.0), ('spiec-easi', -1.0)]:
+            network = nx.Graph()
+            network.add_edge('GG_OTU_1', 'GG_OTU_2', weight=weight)
+            network.add_edge('GG_OTU_2', 'GG_OTU_3', weight=1.0)
+            testnets.networks[tool + '_otu_test'] = NetArray.from_networkx(network)
+        networks = testnets.consensus([2, 3])
+        self.assertEqual(networks['consensus-2_otu_test'].number_of_edges(), 2)
+        self.assertEqual(networks['consensus-3_otu_test'].number_of_edges(), 1)
+        self.assertIn('consensus-3_otu_test', testnets.networks)
 
     def test_run_jobs(self):
         """
@@ -332,7 +645,7 @@ class TestNetWrap(unittest.TestCase):
         call("rm " + filename)
         filename = netbatch.inputs['fp'] + '/' + x + '_family.hdf5'
         call("rm " + filename)
-        filename = netbatch.inputs['fp'] + '/conet_family_test.txt'
+        filename = netbatch.inputs['fp'] + '/conet_family_test.h5'
         call("rm " + filename)
         self.assertEqual(len(netbatch.networks), 1)
 